@@ -0,0 +1,302 @@
+from dataset_stats import list_segments
+from feature_store import FeatureStore, split_segment_name, INDEX_FILE
+from metrics import get_logger, log_event
+import metrics
+import logging
+import argparse
+import hashlib
+import queue
+import threading
+import time
+import numpy as np
+import pandas as pd
+import os
+
+# Batches of the extracted features for training, with no framework dependency: every batch is a tuple of numpy arrays
+# (features: batch x rows x frames float32, labels: batch int64, lengths: batch int64), so it can be fed to any framework.
+#
+# - The segments are shuffled with a seed, a new order every epoch (seed + epoch), so a run can be repeated.
+# - With balanced=True every accent type is sampled equally often: American has 7815 segments and Scottish 4985, the small classes
+#   are repeated and the large ones subsampled in every epoch.
+# - The segments are padded with zeros or cropped to a fixed number of frames, lengths is the number of real frames.
+# - The batches are read on a background thread, prefetch batches ahead, so the training loop doesn't wait on the disk.
+# - The train/val/test split is by source video: all the segments of a video are in the same split, a hash of the video decides
+#   which one. The split of a video never changes when videos are added or removed.
+#
+# The input is the csv output of extract_and_save_mfcc or a feature store, like dataset_stats.py.
+#
+# loader = FeatureBatchLoader('features', split='train', batch_size=64, balanced=True)
+# for epoch in range(10):
+#     for features, labels, lengths in loader.epoch(epoch):
+#         ...
+
+logger = get_logger('batch_loader')
+
+SPLITS = ('train', 'val', 'test')
+
+def source_split(accent_type, source_file, val_share=0.1, test_share=0.1, seed=0):
+    """
+    Returns the split of a source video, from a hash of its name, so it's the same on every machine and in every run.
+
+    Parameters:
+    - accent_type: Accent type of the video
+    - source_file: Name of the source audio file of the video
+    - val_share: Share of the videos in the validation split
+    - test_share: Share of the videos in the test split
+    - seed: Seed of the split, another seed gives another split
+
+    Returns:
+    - 'train', 'val' or 'test'.
+    """
+
+    digest = hashlib.sha1(f"{seed}/{accent_type}/{source_file}".encode('utf-8')).digest()
+    position = int.from_bytes(digest[:8], 'big') / 2 ** 64
+    if position < test_share:
+        return 'test'
+    if position < test_share + val_share:
+        return 'val'
+    return 'train'
+
+def fit_frames(features, frames, offset=0):
+    """
+    Pads a segment with zeros or crops it to a number of frames.
+
+    Parameters:
+    - features: 2D array (rows x frames)
+    - frames: Number of frames of the result
+    - offset: First frame of the crop, if the segment is longer
+
+    Returns:
+    - A tuple of (2D float32 array (rows x frames), number of real frames).
+    """
+
+    features = np.asarray(features, dtype=np.float32)
+    length = min(features.shape[1] - offset, frames)
+    output = np.zeros((features.shape[0], frames), dtype=np.float32)
+    output[:, :length] = features[:, offset:offset + length]
+    return output, length
+
+class FeatureBatchLoader:
+    """
+    Shuffled, optionally class-balanced batches of the features of one split, read ahead on a background thread.
+
+    Parameters:
+    - input_dir: Path to the csv output of extract_and_save_mfcc, or to a feature store.
+    - split: 'train', 'val' or 'test', or None for all the segments.
+    - batch_size: Number of segments in a batch.
+    - frames: Number of frames every segment is padded or cropped to, 157 is a 5 second segment at 16 kHz with hop_length=512.
+    - balanced: Sample every accent type equally often.
+    - shuffle: Shuffle the segments, a new order every epoch.
+    - random_crop: Crop the longer segments at a random frame instead of the first one.
+    - drop_last: Leave out the last batch if it's smaller than batch_size.
+    - prefetch: Number of batches read ahead, 0 reads them in the training loop.
+    - normalization: (mean, std) of every feature row, the features are normalized with (x - mean) / std. See
+      dataset_stats.DatasetStats.normalization.
+    - val_share: Share of the videos in the validation split.
+    - test_share: Share of the videos in the test split.
+    - seed: Seed of the shuffling and of the split.
+    """
+
+    def __init__(self, input_dir, split='train', batch_size=64, frames=157, balanced=False, shuffle=True, random_crop=False,
+                 drop_last=False, prefetch=4, normalization=None, val_share=0.1, test_share=0.1, seed=0):
+        if split is not None and split not in SPLITS:
+            raise ValueError(f"Unknown split: {split}, must be one of {SPLITS}")
+
+        self.batch_size = batch_size
+        self.frames = frames
+        self.balanced = balanced
+        self.shuffle = shuffle
+        self.random_crop = random_crop
+        self.drop_last = drop_last
+        self.prefetch = prefetch
+        self.seed = seed
+        self.store = FeatureStore(input_dir) if os.path.exists(os.path.join(input_dir, INDEX_FILE)) else None
+
+        if normalization is not None:
+            mean, std = normalization
+            # A row that never changes would be divided by zero.
+            self.mean = np.asarray(mean, dtype=np.float32)[:, None]
+            self.scale = (1.0 / np.maximum(np.asarray(std, dtype=np.float32), 1e-8))[:, None]
+        else:
+            self.mean = self.scale = None
+
+        # The classes are the ones of the whole dataset, not only of the split, so a label is the same accent type in every split
+        # even if an accent type has no videos in one of them.
+        segments = list_segments(input_dir)
+        self.classes = sorted({accent_type for accent_type, _ in segments})
+
+        # (accent_type, item) of the segments of the split, item is a csv path or a store key.
+        self.segments = []
+        for accent_type, item in segments:
+            source_file = item[1] if self.store is not None else split_segment_name(os.path.splitext(os.path.basename(item))[0])[0]
+            if split is None or source_split(accent_type, source_file, val_share, test_share, seed) == split:
+                self.segments.append((accent_type, item))
+
+        labels = {accent_type: label for label, accent_type in enumerate(self.classes)}
+        self.labels = np.array([labels[accent_type] for accent_type, _ in self.segments], dtype=np.int64)
+
+    def __len__(self):
+        """
+        Returns the number of batches in an epoch.
+        """
+
+        if self.drop_last:
+            return len(self.segments) // self.batch_size
+        return (len(self.segments) + self.batch_size - 1) // self.batch_size
+
+    def _order(self, rng):
+        # Indices of the segments of an epoch.
+        if not self.balanced:
+            return rng.permutation(len(self.segments)) if self.shuffle else np.arange(len(self.segments))
+
+        # Same number of samples from every class, as many as there are segments in total. The segments of each class are taken in
+        # a shuffled order, the small classes go through theirs more than once.
+        by_class = [np.flatnonzero(self.labels == label) for label in range(len(self.classes))]
+        # The accent types with no segments in the split can't be sampled.
+        by_class = [indices for indices in by_class if len(indices)]
+        if not by_class:
+            return np.arange(0)
+        count = len(self.segments) // len(by_class)
+        order = []
+        for indices in by_class:
+            repeats = (count + len(indices) - 1) // len(indices)
+            order.append(np.concatenate([rng.permutation(indices) for _ in range(repeats)])[:count])
+        order = np.concatenate(order)
+        return rng.permutation(order) if self.shuffle else order
+
+    def _read(self, index):
+        accent_type, item = self.segments[index]
+        if self.store is not None:
+            return self.store.get(*item)
+        return pd.read_csv(item).to_numpy(dtype=np.float32)
+
+    def _batch(self, indices, rng):
+        features = None
+        lengths = np.empty(len(indices), dtype=np.int64)
+        for position, index in enumerate(indices):
+            with metrics.timer('loader.read'):
+                segment = self._read(index)
+            if features is None:
+                features = np.zeros((len(indices), segment.shape[0], self.frames), dtype=np.float32)
+            extra = segment.shape[1] - self.frames
+            offset = int(rng.integers(extra + 1)) if self.random_crop and extra > 0 else 0
+            features[position], lengths[position] = fit_frames(segment, self.frames, offset)
+
+        if self.mean is not None:
+            features -= self.mean
+            features *= self.scale
+            # The padding stays zero.
+            for position, length in enumerate(lengths):
+                features[position, :, length:] = 0.0
+        metrics.count('batches', stage='loader')
+        metrics.count('segments', len(indices), stage='loader')
+        return features, self.labels[indices], lengths
+
+    def _batches(self, epoch):
+        rng = np.random.default_rng([self.seed, epoch])
+        order = self._order(rng)
+        end = len(order) - len(order) % self.batch_size if self.drop_last else len(order)
+        for start in range(0, end, self.batch_size):
+            yield self._batch(order[start:start + self.batch_size], rng)
+
+    def epoch(self, epoch=0):
+        """
+        Iterates over the batches of an epoch.
+
+        Parameters:
+        - epoch: Index of the epoch, the order of the segments is seeded with (seed, epoch).
+
+        Returns:
+        - A generator of (features, labels, lengths) tuples, features is a float32 array (batch x rows x frames), labels the index
+          of the accent type in self.classes and lengths the number of real frames of every segment.
+        """
+
+        if self.prefetch <= 0:
+            yield from self._batches(epoch)
+            return
+
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            # A timeout so the thread notices when the consumer stops early, even with a full queue.
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for batch in self._batches(epoch):
+                    if not put(batch):
+                        return
+                put(done)
+            except Exception as e:
+                put(e)
+
+        thread = threading.Thread(target=produce, name='batch-prefetch', daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is done:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+    def __iter__(self):
+        return self.epoch(0)
+
+def measure_throughput(loader, epochs=1, work_seconds=0.0):
+    """
+    Measures how many batches per second the loader gives.
+
+    Parameters:
+    - loader: A FeatureBatchLoader
+    - epochs: Number of epochs to go through
+    - work_seconds: Time spent on every batch, to simulate a training step. With prefetching the reading overlaps with it.
+
+    Returns:
+    - A dict with the number of batches, the seconds and the batches per second.
+    """
+
+    batches = 0
+    start = time.perf_counter()
+    for epoch in range(epochs):
+        for _ in loader.epoch(epoch):
+            batches += 1
+            if work_seconds:
+                time.sleep(work_seconds)
+    seconds = time.perf_counter() - start
+    result = {'batches': batches, 'seconds': round(seconds, 3), 'batches_per_second': round(batches / seconds, 2) if seconds else 0.0}
+    log_event(logger, logging.INFO, "throughput", **result)
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the throughput of the feature batch loader.")
+    parser.add_argument('input_dir', nargs='?', default='features', help="Feature csv folder or feature store")
+    parser.add_argument('--split', default='train', choices=SPLITS, help="Split to read")
+    parser.add_argument('--batch-size', type=int, default=64, help="Number of segments in a batch")
+    parser.add_argument('--frames', type=int, default=157, help="Number of frames of every segment")
+    parser.add_argument('--balanced', action='store_true', help="Sample every accent type equally often")
+    parser.add_argument('--prefetch', type=int, default=4, help="Number of batches read ahead")
+    parser.add_argument('--epochs', type=int, default=1, help="Number of epochs")
+    parser.add_argument('--work-seconds', type=float, default=0.0, help="Simulated training step time of every batch")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the shuffling and of the split")
+    args = parser.parse_args()
+
+    metrics.configure(level='INFO', textfile="pipeline_metrics.prom")
+    loader = FeatureBatchLoader(args.input_dir, split=args.split, batch_size=args.batch_size, frames=args.frames, balanced=args.balanced,
+                                prefetch=args.prefetch, seed=args.seed)
+    log_event(logger, logging.INFO, "loader", split=args.split, segments=len(loader.segments), batches=len(loader),
+              classes=len(loader.classes))
+    measure_throughput(loader, epochs=args.epochs, work_seconds=args.work_seconds)
+    metrics.report()
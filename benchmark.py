@@ -0,0 +1,370 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import importlib.util
+import soundfile as sf
+import numpy as np
+import argparse
+import platform
+import shutil
+import json
+import glob
+import time
+import os
+
+# resource is only on Unix, the peak memory is left out without it.
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Benchmark suite of the pipeline stages. It generates a synthetic corpus (speech-like harmonic syllables, a noise floor and silence
+# gaps) that is the same for the same seed, runs every stage over it and reports for each one:
+# - seconds: wall time of the stage
+# - realtime_factor: seconds of input audio processed per second, 100 means 100 seconds of audio in one second
+# - files_per_second
+# - peak_rss_mb: peak resident memory of the process running the stage, and of its worker processes if it has any
+#
+# Every stage runs in a new process, so the peak memory of one stage doesn't hide the next one and the imports aren't cached. The
+# results are saved as json, compare_results shows the changes between two runs.
+#
+# python benchmark.py --files 8 --duration 30 --output bench.json
+# python benchmark.py --files 8 --duration 30 --output bench_new.json --compare bench.json
+
+CORPUS_INFO = 'corpus.json'
+
+def make_corpus(output_dir, files=8, duration=30.0, accent_types=('American', 'British'), sample_rate=44100, seed=0, audio_format='mp3'):
+    """
+    Generates a synthetic audio dataset with the same layout as the crawler's downloads, {output_dir}/{accent_type}/*.mp3.
+
+    Parameters:
+    - output_dir: Path to the corpus, it's created if it doesn't exist.
+    - files: Number of files, split between the accent types.
+    - duration: Length of each file in seconds.
+    - accent_types: Names of the accent folders.
+    - sample_rate: Sampling rate of the files.
+    - seed: Seed of the generator, the same seed gives the same corpus.
+    - audio_format: 'mp3' or 'wav'.
+
+    Returns:
+    - A dictionary of file path -> duration in seconds, also saved as {output_dir}/corpus.json.
+    """
+
+    # Imported here, the benchmark itself doesn't need pydub.
+    from pydub import AudioSegment
+
+    durations = {}
+    for index in range(files):
+        accent_type = accent_types[index % len(accent_types)]
+        accent_dir = os.path.join(output_dir, accent_type)
+        os.makedirs(accent_dir, exist_ok=True)
+
+        samples = synthetic_speech(duration, sample_rate, seed=seed * 100003 + index)
+        file_path = os.path.join(accent_dir, f"synthetic_{index:04d}.{audio_format}")
+        pcm = (samples * 32767).astype(np.int16)
+        if audio_format == 'wav':
+            sf.write(file_path, pcm, sample_rate, subtype='PCM_16')
+        else:
+            # Stereo like the downloads, so the downmix is part of the work.
+            stereo = np.repeat(pcm[:, None], 2, axis=1)
+            AudioSegment(stereo.tobytes(), frame_rate=sample_rate, sample_width=2, channels=2).export(file_path, format=audio_format)
+        durations[file_path] = len(samples) / sample_rate
+
+    with open(os.path.join(output_dir, CORPUS_INFO), 'w') as f:
+        json.dump({'files': files, 'duration': duration, 'sample_rate': sample_rate, 'seed': seed, 'durations': durations}, f,
+                  indent=2)
+    return durations
+
+def synthetic_speech(duration, sample_rate, seed=0):
+    """
+    Generates a speech-like signal: words of harmonic syllables with a gliding pitch, short pauses between the words, longer silence
+    gaps between the sentences (longer than the 1 second cleaner.py removes), and a noise floor.
+
+    Parameters:
+    - duration: Length of the signal in seconds.
+    - sample_rate: Sampling rate of the signal.
+    - seed: Seed of the generator.
+
+    Returns:
+    - Mono float32 signal in [-1.0, 1.0].
+    """
+
+    rng = np.random.default_rng(seed)
+    total = int(duration * sample_rate)
+    signal = np.zeros(total, dtype=np.float32)
+
+    position = 0
+    while position < total:
+        # A sentence of 2-5 seconds, then a 1.2-2.5 second gap.
+        sentence_end = min(total, position + int(rng.uniform(2.0, 5.0) * sample_rate))
+        while position < sentence_end:
+            length = min(sentence_end - position, int(rng.uniform(0.12, 0.3) * sample_rate))
+            t = np.arange(length) / sample_rate
+
+            # Pitch glides like intonation, the harmonics get weaker with a random tilt like different vowels.
+            f0 = rng.uniform(90, 250) * (1 + rng.uniform(-0.15, 0.15) * t / max(t[-1], 1e-3))
+            phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+            tilt = rng.uniform(0.5, 1.5)
+            syllable = sum(np.sin(k * phase) / k ** tilt for k in range(1, 16) if k * np.max(f0) < sample_rate / 2)
+            signal[position:position + length] = syllable * np.hanning(length) * rng.uniform(0.1, 0.4)
+
+            # Short pause between the syllables and the words.
+            position += length + int(rng.uniform(0.0, 0.15) * sample_rate)
+        position = sentence_end + int(rng.uniform(1.2, 2.5) * sample_rate)
+
+    # Noise floor: audible under the speech, under the -55 dBFS silence threshold in the gaps.
+    signal += rng.normal(0, 10 ** (-70 / 20), total).astype(np.float32)
+    peak = np.max(np.abs(signal))
+    return (signal / peak * 0.8).astype(np.float32) if peak > 0 else signal
+
+def load_script(file_name):
+    """
+    Loads one of the scripts with a '-' in its name (split-audio.py, mfcc-feature-extraction.py) as a module.
+
+    Parameters:
+    - file_name: Name of the script file.
+
+    Returns:
+    - The module.
+    """
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name)
+    spec = importlib.util.spec_from_file_location(os.path.splitext(file_name)[0].replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _each_file(input_dir, output_dir, pattern, step):
+    # Runs a file -> file step of cleaner.py for every file of every accent folder.
+    for input_file in sorted(glob.glob(os.path.join(input_dir, '*', pattern))):
+        accent_dir = os.path.join(output_dir, os.path.basename(os.path.dirname(input_file)))
+        os.makedirs(accent_dir, exist_ok=True)
+        step(input_file, os.path.join(accent_dir, os.path.splitext(os.path.basename(input_file))[0] + '.wav'))
+
+def _stage_convert(corpus_dir, work_dir, options):
+    import cleaner
+    _each_file(corpus_dir, os.path.join(work_dir, 'converted'), '*.*', cleaner.convert_to_wav)
+
+def _stage_remove_silence(corpus_dir, work_dir, options):
+    import cleaner
+    _each_file(os.path.join(work_dir, 'converted'), os.path.join(work_dir, 'silence_removed'), '*.wav', cleaner.remove_silence)
+
+def _stage_reduce_noise(corpus_dir, work_dir, options):
+    import cleaner
+    _each_file(os.path.join(work_dir, 'silence_removed'), os.path.join(work_dir, 'noise_reduced'), '*.wav',
+               lambda input_file, output_file: cleaner.reduce_noise(input_file, output_file, 0.5))
+
+def _stage_normalize(corpus_dir, work_dir, options):
+    import cleaner
+    _each_file(os.path.join(work_dir, 'noise_reduced'), os.path.join(work_dir, 'normalized'), '*.wav', cleaner.normalize_audio)
+
+def _stage_clean(corpus_dir, work_dir, options):
+    import cleaner
+    cleaner.clean_audio_datasets(corpus_dir, os.path.join(work_dir, 'cleaned'), workers=options['workers'])
+
+def _stage_clean_noise_profiles(corpus_dir, work_dir, options):
+    import cleaner
+    cleaner.clean_audio_datasets(corpus_dir, os.path.join(work_dir, 'cleaned_noise_profiles'), workers=options['workers'],
+                                 noise_profile='silence')
+
+def _stage_split(corpus_dir, work_dir, options):
+    split_audio = load_script('split-audio.py')
+    cleaned_dir = os.path.join(work_dir, 'cleaned')
+    for accent_type in sorted(os.listdir(cleaned_dir)):
+        split_audio.split_audio_files(os.path.join(cleaned_dir, accent_type), accent_type, output_dir=os.path.join(work_dir, 'segments'),
+                                      tail='pad')
+
+def _stage_mfcc(corpus_dir, work_dir, options):
+    mfcc_extraction = load_script('mfcc-feature-extraction.py')
+    mfcc_extraction.extract_and_save_mfcc(os.path.join(work_dir, 'segments'), os.path.join(work_dir, 'features'),
+                                          batch_size=options['batch_size'])
+
+def _stage_features(corpus_dir, work_dir, options):
+    import features
+    mfcc_extraction = load_script('mfcc-feature-extraction.py')
+    mfcc_extraction.extract_and_save_mfcc(os.path.join(work_dir, 'segments'), os.path.join(work_dir, 'all_features'),
+                                          batch_size=options['batch_size'], features=features.FEATURES, cmvn=True)
+
+def _stage_frames(corpus_dir, work_dir, options):
+    mfcc_extraction = load_script('mfcc-feature-extraction.py')
+    mfcc_extraction.extract_and_save_frames(os.path.join(work_dir, 'cleaned'), os.path.join(work_dir, 'frames'))
+
+def _stage_pipeline(corpus_dir, work_dir, options):
+    import pipeline
+    pipeline.run_pipeline(corpus_dir, features_base_dir=os.path.join(work_dir, 'pipeline_features'), workers=options['workers'],
+                          tail='pad')
+
+# Stage name -> (function, input files of the stage relative to the corpus or the work folder). The file-based steps of cleaner.py
+# run one after the other on the outputs of the previous one, like clean_audio_file_on_disk does.
+STAGES = {
+    'convert_to_wav': (_stage_convert, ('corpus', '*/*.*')),
+    'remove_silence': (_stage_remove_silence, ('work', 'converted/*/*.wav')),
+    'reduce_noise': (_stage_reduce_noise, ('work', 'silence_removed/*/*.wav')),
+    'normalize_audio': (_stage_normalize, ('work', 'noise_reduced/*/*.wav')),
+    'clean_audio_datasets': (_stage_clean, ('corpus', '*/*.*')),
+    'clean_noise_profiles': (_stage_clean_noise_profiles, ('corpus', '*/*.*')),
+    'split_audio_files': (_stage_split, ('work', 'cleaned/*/*.wav')),
+    'extract_and_save_mfcc': (_stage_mfcc, ('work', 'segments/*/*.wav')),
+    'extract_all_features': (_stage_features, ('work', 'segments/*/*.wav')),
+    'extract_frames': (_stage_frames, ('work', 'cleaned/*/*.wav')),
+    'run_pipeline': (_stage_pipeline, ('corpus', '*/*.*')),
+}
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS. RUSAGE_CHILDREN is the largest of the worker processes.
+    scale = 1 if platform.system() == 'Darwin' else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * scale / (1 << 20)
+
+def _measure(name, corpus_dir, work_dir, options):
+    # Runs in a new process for every stage.
+    function = STAGES[name][0]
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    function(corpus_dir, work_dir, options)
+    return time.perf_counter() - start, time.process_time() - cpu_start, _peak_rss_mb()
+
+def _input_audio(corpus_dir, work_dir, name, corpus_durations):
+    # Number of input files of the stage and their total duration.
+    base, pattern = STAGES[name][1]
+    files = sorted(glob.glob(os.path.join(corpus_dir if base == 'corpus' else work_dir, pattern)))
+    seconds = 0.0
+    for file in files:
+        if os.path.abspath(file) in corpus_durations:
+            seconds += corpus_durations[os.path.abspath(file)]
+        else:
+            seconds += sf.info(file).duration
+    return len(files), seconds
+
+def run_benchmark(output_file, work_dir='benchmark_work', files=8, duration=30.0, seed=0, workers=None, batch_size=64, stages=None,
+                  keep=False):
+    """
+    Generates the corpus, runs the stages and saves the results.
+
+    Parameters:
+    - output_file: Path to the results json file.
+    - work_dir: Folder for the corpus and the stage outputs, deleted at the end unless keep is True.
+    - files: Number of corpus files.
+    - duration: Length of each corpus file in seconds.
+    - seed: Seed of the corpus.
+    - workers: Number of worker processes for the parallel stages, os.cpu_count() by default.
+    - batch_size: Batch size of the MFCC extraction.
+    - stages: Names of the stages to run, all of STAGES by default, in the order of STAGES. A stage needs the outputs of the
+      stages before it.
+    - keep: Keep the work folder.
+
+    Returns:
+    - The results dictionary.
+    """
+
+    if stages is None:
+        stages = list(STAGES)
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages: {sorted(unknown)}, must be some of {list(STAGES)}")
+
+    if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+    corpus_dir = os.path.join(work_dir, 'corpus')
+    print(f"Generating {files} files of {duration} seconds...")
+    corpus_durations = {os.path.abspath(path): seconds for path, seconds in make_corpus(corpus_dir, files, duration, seed=seed).items()}
+
+    options = {'workers': workers, 'batch_size': batch_size}
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'files': files, 'duration': duration, 'seed': seed, 'workers': workers, 'batch_size': batch_size},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'stages': {},
+    }
+
+    # spawn: every stage starts from an empty process, fork would share the parent's memory and imports.
+    context = get_context('spawn')
+    try:
+        for name in STAGES:
+            if name not in stages:
+                continue
+            stage_files, audio_seconds = _input_audio(corpus_dir, work_dir, name, corpus_durations)
+            # An executor and not a multiprocessing.Pool, Pool processes can't start the worker processes of the parallel stages.
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                seconds, cpu_seconds, peak_rss_mb = executor.submit(_measure, name, corpus_dir, work_dir, options).result()
+
+            results['stages'][name] = {
+                'files': stage_files,
+                'audio_seconds': round(audio_seconds, 3),
+                'seconds': round(seconds, 4),
+                'cpu_seconds': round(cpu_seconds, 4),
+                'realtime_factor': round(audio_seconds / seconds, 2) if seconds > 0 else None,
+                'files_per_second': round(stage_files / seconds, 3) if seconds > 0 else None,
+                'peak_rss_mb': round(peak_rss_mb, 1) if peak_rss_mb is not None else None,
+            }
+            print(f"{name}: {seconds:.2f} s, {results['stages'][name]['realtime_factor']}x real-time")
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved the results to {output_file}.")
+    return results
+
+def compare_results(baseline_file, results_file, tolerance=0.1):
+    """
+    Compares two benchmark results and prints the change of every stage.
+
+    Parameters:
+    - baseline_file: Path to the older results json file.
+    - results_file: Path to the newer results json file.
+    - tolerance: A stage that got slower (real-time factor) or bigger (peak memory) by more than this fraction is a regression.
+
+    Returns:
+    - A list of (stage, metric, baseline value, new value) tuples for the regressions.
+    """
+
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)
+    with open(results_file, 'r') as f:
+        results = json.load(f)
+
+    if baseline['config'] != results['config']:
+        print(f"Warning: the runs have different configs, {baseline['config']} and {results['config']}")
+
+    regressions = []
+    print(f"{'stage':<24}{'rtf before':>12}{'rtf after':>12}{'change':>9}{'rss before':>12}{'rss after':>12}")
+    for name, stage in results['stages'].items():
+        before = baseline['stages'].get(name)
+        if before is None:
+            print(f"{name:<24}{'-':>12}{stage['realtime_factor']:>12}")
+            continue
+
+        change = stage['realtime_factor'] / before['realtime_factor'] - 1 if before['realtime_factor'] else 0.0
+        print(f"{name:<24}{before['realtime_factor']:>12}{stage['realtime_factor']:>12}{change:>+9.0%}"
+              f"{str(before['peak_rss_mb']):>12}{str(stage['peak_rss_mb']):>12}")
+
+        if change < -tolerance:
+            regressions.append((name, 'realtime_factor', before['realtime_factor'], stage['realtime_factor']))
+        if before['peak_rss_mb'] and stage['peak_rss_mb'] and stage['peak_rss_mb'] > before['peak_rss_mb'] * (1 + tolerance):
+            regressions.append((name, 'peak_rss_mb', before['peak_rss_mb'], stage['peak_rss_mb']))
+
+    for name, metric, before, after in regressions:
+        print(f"Regression: {name} {metric} {before} -> {after}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the pipeline stages on a synthetic corpus.")
+    parser.add_argument('--output', default='benchmark_results.json', help="Path to save the results json file")
+    parser.add_argument('--compare', help="Path to an older results json file to compare with")
+    parser.add_argument('--files', type=int, default=8, help="Number of corpus files")
+    parser.add_argument('--duration', type=float, default=30.0, help="Length of each corpus file in seconds")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the corpus")
+    parser.add_argument('--workers', type=int, help="Worker processes of the parallel stages")
+    parser.add_argument('--batch-size', type=int, default=64, help="Batch size of the MFCC extraction")
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), help="Stages to run, all of them by default")
+    parser.add_argument('--work-dir', default='benchmark_work', help="Folder for the corpus and the stage outputs")
+    parser.add_argument('--keep', action='store_true', help="Keep the work folder")
+    args = parser.parse_args()
+
+    run_benchmark(args.output, work_dir=args.work_dir, files=args.files, duration=args.duration, seed=args.seed, workers=args.workers,
+                  batch_size=args.batch_size, stages=args.stages, keep=args.keep)
+    if args.compare:
+        compare_results(args.compare, args.output)
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+
+# Incremental rebuild cache. Every stage (clean, split, mfcc, pipeline) records, for each input file, a key made of the input's
+# content hash and the stage parameters, plus the output files it wrote. When the script runs again, an input with the same key and
+# all of its outputs still on disk is skipped.
+#
+# Each stage is keyed on the content of its own input, so a parameter change only invalidates the stages that depend on it. Changing
+# noise_reduction_strength changes the cleaned wav files, so the split and mfcc stages run again for them. Changing n_mfcc only
+# changes the key of the mfcc stage, the cleaned and split files are reused.
+#
+# Hashing every file on every run would read the whole corpus again, so the manifest also remembers the hash of each file together
+# with its size and modification time, and the file is hashed again only if one of them changed.
+
+class BuildCache:
+    """
+    Manifest-backed cache of the pipeline stages. Use it as a context manager, the manifest is saved when it's closed.
+
+    Parameters:
+    - manifest_path: Path to the manifest json file, it's created if it doesn't exist.
+    - save_every: Save the manifest after this many records, so a crash doesn't lose all the work of a long run.
+    """
+
+    def __init__(self, manifest_path, save_every=100):
+        self.manifest_path = manifest_path
+        self.save_every = save_every
+        self._unsaved = 0
+
+        self.manifest = {'hashes': {}, 'stages': {}}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+
+    def file_hash(self, path):
+        """
+        Returns the sha256 of the file content, computed again only if the file's size or modification time changed.
+
+        Parameters:
+        - path: Path to the file.
+
+        Returns:
+        - Hex digest of the file content.
+        """
+
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.manifest['hashes'].get(path)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+
+        self.manifest['hashes'][path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def key(self, stage, input_file, params):
+        """
+        Returns the cache key of a stage run: the input's content hash plus the stage parameters.
+
+        Parameters:
+        - stage: Name of the stage.
+        - input_file: Path to the input file of the stage.
+        - params: Dictionary of the parameters that change the stage's output.
+
+        Returns:
+        - Hex digest of the key.
+        """
+
+        payload = json.dumps([stage, self.file_hash(input_file), params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def is_fresh(self, stage, input_file, params):
+        """
+        Checks if a stage already processed this input with these parameters and its outputs are still there.
+
+        Parameters:
+        - stage: Name of the stage.
+        - input_file: Path to the input file of the stage.
+        - params: Dictionary of the parameters that change the stage's output.
+
+        Returns:
+        - True or False.
+        """
+
+        entry = self.manifest['stages'].get(stage, {}).get(os.path.abspath(input_file))
+        if entry is None or entry['key'] != self.key(stage, input_file, params):
+            return False
+        return all(os.path.exists(output) for output in entry['outputs'])
+
+    def record(self, stage, input_file, params, outputs):
+        """
+        Records a finished stage run. Only call it after the outputs are completely written.
+
+        Parameters:
+        - stage: Name of the stage.
+        - input_file: Path to the input file of the stage.
+        - params: Dictionary of the parameters that change the stage's output.
+        - outputs: List of the output files of the stage run.
+        """
+
+        self.manifest['stages'].setdefault(stage, {})[os.path.abspath(input_file)] = {
+            'key': self.key(stage, input_file, params),
+            'outputs': [os.path.abspath(output) for output in outputs],
+        }
+
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    def save(self):
+        """
+        Saves the manifest. It's written to a temp file first so a crash never leaves a half written manifest behind.
+        """
+
+        directory = os.path.dirname(os.path.abspath(self.manifest_path))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+        self._unsaved = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.save()
+
+def open_cache(manifest_path):
+    """
+    Opens the build cache, or returns None if manifest_path is None so the callers can keep a single code path.
+
+    Parameters:
+    - manifest_path: Path to the manifest json file, or None.
+
+    Returns:
+    - A BuildCache or None.
+    """
+
+    return BuildCache(manifest_path) if manifest_path is not None else None
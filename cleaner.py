@@ -1,17 +1,35 @@
 from pydub import AudioSegment
-from pydub import silence
+from pydub.utils import mediainfo_json
 import noisereduce as nr
 import librosa
 import soundfile as sf
 from scipy.signal import butter, lfilter
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from cache import open_cache
+from state_store import open_state, source_name
+from resampler import DEFAULT_ENGINE, iter_resample, resample
+from noise_profile import NoiseProfileCache, estimate_noise_profile, silent_samples, spectral_gate
+from metrics import get_logger, log_event
+import metrics
+import logging
+import subprocess
+import tempfile
 import glob
 import os
 
+# Same fallback as pydub, audioop is removed from the standard library in Python 3.13.
+try:
+    import audioop
+except ImportError:
+    import pyaudioop as audioop
+
+logger = get_logger('cleaner')
+
 # What is the point of doing this, the original mp3 file has more sampling rate and therefore the audio quality is much better, also
 # the size is smaller. For feature extraction maybe ? ( wav files are more compatible with feature extraction for model, so it's faster
 # to process. )
-def convert_to_wav(input_file, output_file, sample_rate=16000):
+def convert_to_wav(input_file, output_file, sample_rate=16000, resampler=DEFAULT_ENGINE):
     """
     Converts the mp3 file to wav format.
     
@@ -19,10 +37,11 @@ def convert_to_wav(input_file, output_file, sample_rate=16000):
     - input_file: Path to the input audio file
     - output_file: Path to save the output file
     - sample_rate: Sampling rate of the wav file ( 16Khz by default. )
+    - resampler: Resampler engine (resampler.py), 'audioop' is pydub's set_frame_rate
     """
 
     # Load the mp3 file
-    print(f"Converting {input_file} to {output_file}...")
+    logger.debug("Converting %s to %s...", input_file, output_file)
     audio = AudioSegment.from_file(input_file)
 
     #print(audio.frame_rate)
@@ -30,11 +49,11 @@ def convert_to_wav(input_file, output_file, sample_rate=16000):
     # Set sample rate and convert to mono. Default sr is 44.1Khz, when we reduce it to 16Khz it also reduces the audio file's quality and size.
     # By reducing the number of channels from 2 (stereo) to 1 (mono), it decreases the amount of data to be processed, which increases efficiency.
     # https://cloud.google.com/speech-to-text/docs/best-practices-provide-speech-data
-    audio = audio.set_frame_rate(sample_rate).set_channels(1)
+    samples = _resample_segment(audio, sample_rate, resampler)
 
     # Export as wav file
-    audio.export(output_file, format="wav")
-    print(f"Converted {input_file} to {output_file}.")
+    sf.write(output_file, samples, sample_rate, subtype='PCM_16')
+    logger.debug("Converted %s to %s.", input_file, output_file)
 
 def normalize_audio(input_file, output_file, target_dBFS=-20.0):
     """
@@ -45,7 +64,7 @@ def normalize_audio(input_file, output_file, target_dBFS=-20.0):
     - output_file: Path to save the output file
     """
 
-    print(f"Normalizing {input_file}...")
+    logger.debug("Normalizing %s...", input_file)
     audio = AudioSegment.from_file(input_file)
 
     # Average amplitude is -20 dBFS.
@@ -53,7 +72,120 @@ def normalize_audio(input_file, output_file, target_dBFS=-20.0):
     change_in_dBFS = target_dBFS - audio.dBFS
     normalized_audio = audio.apply_gain(change_in_dBFS)
     normalized_audio.export(output_file, format="wav")
-    print(f"Normalized {input_file} and saved to {output_file}.")
+    logger.debug("Normalized %s and saved to %s.", input_file, output_file)
+
+def _pcm_energy(samples):
+    # Energy of every frame on 16-bit PCM, the integers pydub sees. The squares and their sums are exact in int64, so the window
+    # energies are the same as audioop's whatever the order they're added in.
+    pcm = np.clip(np.round(np.asarray(samples, dtype=np.float64) * 32768.0), -32768, 32767).astype(np.int64)
+    energy = np.square(pcm)
+    if energy.ndim == 2:
+        energy = energy.sum(axis=1)
+    return energy
+
+def _is_silent(window_energy, window_samples, silence_thresh):
+    # pydub compares audioop.rms, the square root of the mean energy truncated to an integer, with the threshold in dBFS as an
+    # amplitude of a 16-bit sample. The rounding of the comparison is exactly the same, so are the windows on the edge of it.
+    rms = np.floor(np.sqrt(window_energy.astype(np.float64) / np.maximum(window_samples, 1)))
+    return rms <= 10 ** (silence_thresh / 20) * 32768.0
+
+def detect_silence_array(samples, sample_rate, silence_thresh=-55, min_silence_len=1000):
+    """
+    Detects the silent parts of an in-memory audio buffer, same result as pydub.silence.detect_silence with seek_step=1 on the
+    buffer as 16-bit PCM.
+    
+    Parameters:
+    - samples: Audio buffer scaled to [-1.0, 1.0], (frames,) or (frames, channels)
+    - sample_rate: Sampling rate of the buffer
+    - silence_thresh: The silence threshold (in dBFS)
+    - min_silence_len: Minimum length of silence (in milliseconds)
+
+    Returns:
+    - A (n, 2) array of [start, end] silent intervals in milliseconds.
+    """
+
+    # pydub slices the audio at millisecond boundaries, so we do the same. boundaries[i] is the first frame of millisecond i.
+    total_ms = int(round(len(samples) * 1000 / sample_rate))
+    if total_ms < min_silence_len:
+        return np.empty((0, 2), dtype=np.int64)
+    boundaries = np.arange(total_ms + 1, dtype=np.int64) * sample_rate // 1000
+
+    # The channels are interleaved for audioop.rms, it divides by the number of samples of all the channels.
+    energy = _pcm_energy(samples)
+    channels = 1 if np.ndim(samples) == 1 else np.shape(samples)[1]
+
+    # With a cumulative sum, the energy of every min_silence_len window (one window per millisecond, seek_step=1) is a single
+    # subtraction instead of a separate rms computation for each window.
+    cumulative = np.concatenate(([0], np.cumsum(energy)))
+    window_starts = boundaries[:total_ms - min_silence_len + 1]
+    window_ends = boundaries[min_silence_len:total_ms + 1]
+    # pydub pads the last window with silence when the rounded length in milliseconds goes past the end, it still divides by
+    # the whole window.
+    window_energy = cumulative[np.minimum(window_ends, len(samples))] - cumulative[np.minimum(window_starts, len(samples))]
+    is_silent = _is_silent(window_energy, (window_ends - window_starts) * channels, silence_thresh)
+
+    # Runs of consecutive silent windows are one silent interval, from the first window's start to the last window's end.
+    edges = np.diff(np.concatenate(([0], is_silent.astype(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1) - 1 + min_silence_len
+    if len(run_starts) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+
+    # Like pydub, two silent runs that overlap (a short blip between them) are combined into one interval.
+    new_interval = np.concatenate(([True], run_starts[1:] > run_ends[:-1]))
+    last_of_interval = np.concatenate((new_interval[1:], [True]))
+    return np.stack([run_starts[new_interval], run_ends[last_of_interval]], axis=1).astype(np.int64)
+
+def detect_nonsilent_array(samples, sample_rate, silence_thresh=-55, min_silence_len=1000, silent_intervals=None):
+    """
+    Detects the non-silent parts of an in-memory audio buffer, same result as pydub.silence.detect_nonsilent with seek_step=1 on the
+    buffer as 16-bit PCM.
+    
+    Parameters:
+    - samples: Audio buffer scaled to [-1.0, 1.0], (frames,) or (frames, channels)
+    - sample_rate: Sampling rate of the buffer
+    - silence_thresh: The silence threshold (in dBFS)
+    - min_silence_len: Minimum length of silence (in milliseconds)
+    - silent_intervals: Output of detect_silence_array, it is computed if it's None
+
+    Returns:
+    - A (n, 2) array of [start, end] non-silent intervals in milliseconds.
+    """
+
+    if silent_intervals is None:
+        silent_intervals = detect_silence_array(samples, sample_rate, silence_thresh, min_silence_len)
+
+    total_ms = int(round(len(samples) * 1000 / sample_rate))
+
+    # No silence, the whole audio is non-silent.
+    if len(silent_intervals) == 0:
+        return np.array([[0, total_ms]], dtype=np.int64)
+
+    # Everything is silent.
+    if silent_intervals[0, 0] == 0 and silent_intervals[0, 1] >= total_ms:
+        return np.empty((0, 2), dtype=np.int64)
+
+    # The gaps between the silent intervals, plus the parts before the first and after the last one.
+    starts = np.concatenate(([0], silent_intervals[:, 1]))
+    ends = np.concatenate((silent_intervals[:, 0], [total_ms]))
+    keep = ends > starts
+    return np.stack([starts[keep], ends[keep]], axis=1)
+
+def join_intervals(samples, sample_rate, intervals):
+    """
+    Joins the given parts of an audio buffer with a single concatenation.
+    
+    Parameters:
+    - samples: Audio buffer, (frames,) or (frames, channels)
+    - sample_rate: Sampling rate of the buffer
+    - intervals: A (n, 2) array of [start, end] intervals in milliseconds
+
+    Returns:
+    - The joined buffer.
+    """
+
+    bounds = np.asarray(intervals, dtype=np.int64) * sample_rate // 1000
+    return np.concatenate([samples[start:end] for start, end in bounds])
 
 def remove_silence(input_file, output_file, silence_thresh=-55, min_silence_len=1000):
     """
@@ -66,7 +198,7 @@ def remove_silence(input_file, output_file, silence_thresh=-55, min_silence_len=
     - min_silence_len: Minimum length of silence (in milliseconds) to be considered for trimming
     """
 
-    print(f"Processing {input_file} to remove silence...")
+    logger.debug("Processing %s to remove silence...", input_file)
     
     # Load the audio file
     audio = AudioSegment.from_file(input_file)
@@ -77,27 +209,32 @@ def remove_silence(input_file, output_file, silence_thresh=-55, min_silence_len=
     # to 1/10th of full volume, -20dB is 1/100th of full volume, -30 is 1/1000th, and so on.
     # As the value goes up, the parts that will be considered as 'silent' will be much more.
 
+    # pydub gives us interleaved integer PCM samples, one row for each frame.
+    samples = np.array(audio.get_array_of_samples()).reshape(-1, audio.channels)
+    scale = float(1 << (8 * audio.sample_width - 1))
+
     # Detect non-silent chunks
-    nonsilent_chunks = silence.detect_nonsilent(
-        audio, 
+    nonsilent_chunks = detect_nonsilent_array(
+        samples / scale,
+        audio.frame_rate,
         min_silence_len=min_silence_len,
         silence_thresh=silence_thresh
     )
     
     # If no nonsilent chunks are detected, keep the original audio
-    if not nonsilent_chunks:
-        print(f"No silence detected in {input_file}. Saving the original audio.")
+    if len(nonsilent_chunks) == 0:
+        logger.debug("No silence detected in %s. Saving the original audio.", input_file)
         audio.export(output_file, format="wav")
         return
     
-    # Combine the non-silent chunks
-    processed_audio = AudioSegment.empty()
-    for start, end in nonsilent_chunks:
-        processed_audio += audio[start:end]
+    # Combine the non-silent chunks with a single copy.
+    processed = join_intervals(samples, audio.frame_rate, nonsilent_chunks)
+    processed_audio = AudioSegment(processed.tobytes(), frame_rate=audio.frame_rate, sample_width=audio.sample_width,
+                                   channels=audio.channels)
     
     # Save the processed audio
     processed_audio.export(output_file, format="wav")
-    print(f"Silence removed and audio saved to {output_file}.")
+    logger.debug("Silence removed and audio saved to %s.", output_file)
 
 def reduce_noise(input_file, output_file, noise_reduction_strength=1):
     """
@@ -109,48 +246,796 @@ def reduce_noise(input_file, output_file, noise_reduction_strength=1):
     - noise_reduction_strength: The proportion to reduce the noise by (1.0 = 100%), by default 1.0
     """
 
-    print(f"Reducing noise in {input_file}...")
+    logger.debug("Reducing noise in %s...", input_file)
     audio, sr = librosa.load(input_file, sr=None)
 
     # Default value for prop_decrease is 1.
     reduced_noise = nr.reduce_noise(y=audio, sr=sr, prop_decrease=noise_reduction_strength)
     sf.write(output_file, reduced_noise, sr)
-    print(f"Noise reduced in {input_file} and saved to {output_file}.")
+    logger.debug("Noise reduced in %s and saved to %s.", input_file, output_file)
+
+def _resample_segment(audio, sample_rate, resampler=DEFAULT_ENGINE):
+    """
+    Downmixes and resamples a decoded AudioSegment.
+
+    Parameters:
+    - audio: The AudioSegment
+    - sample_rate: Target sampling rate
+    - resampler: Resampler engine (resampler.py)
+
+    Returns:
+    - Mono float32 samples at sample_rate, scaled to [-1.0, 1.0].
+    """
+
+    scale = float(1 << (8 * audio.sample_width - 1))
+    if resampler == 'audioop':
+        # pydub's own resampling, before the resampler engine.
+        audio = audio.set_frame_rate(sample_rate).set_channels(1)
+        return np.array(audio.get_array_of_samples(), dtype=np.float32) / scale
 
-def clean_audio_dataset(input_dir, output_dir):
+    # Downmix first (like set_channels(1), the mean of the channels), so only one channel is resampled.
+    samples = np.array(audio.get_array_of_samples(), dtype=np.float32).reshape(-1, audio.channels).mean(axis=1, dtype=np.float32)
+    return resample(samples / scale, audio.frame_rate, sample_rate, resampler)
+
+def load_audio(input_file, sample_rate=16000, resampler=DEFAULT_ENGINE):
     """
-    Cleans the audio data-set with .mp3 files and saves the files into output_dir.
+    Decodes the audio file once into a mono float32 NumPy buffer.
     
     Parameters:
-    - input_dir: Path to the input audio dataset (Only mp3 files.)
-    - output_dir: Path to the output audio dataset (Converts it into .wav format)
+    - input_file: Path to the input audio file
+    - sample_rate: Sampling rate of the returned buffer ( 16Khz by default. )
+    - resampler: Resampler engine (resampler.py)
+
+    Returns:
+    - A tuple of (samples, sample_rate). Samples are scaled to [-1.0, 1.0].
     """
 
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    audio = AudioSegment.from_file(input_file)
 
-    # Look for .mp3 files
-    for file in glob.glob(os.path.join(input_dir, "*.mp3")):  
-        base_name = os.path.basename(file)
-        
-        # Defining the output wav file with the original mp3 file's name.
-        wav_file = os.path.join(output_dir, base_name.replace('.mp3', '.wav'))
-        
-        # Create a temp wav file and save the original mp3 audio to this.
-        # Process the temp.wav file.
-        # Finally, save the temp.wav as wav_file with the original mp3 file's name.
-        temp_file = os.path.join(output_dir, "temp.wav")
-        
+    # Same resampling and downmixing as convert_to_wav, but we keep the result in memory instead of exporting it.
+    return _resample_segment(audio, sample_rate, resampler), sample_rate
+
+def remove_silence_array(samples, sample_rate, silence_thresh=-55, min_silence_len=1000, return_silent=False):
+    """
+    Removes silence from an in-memory audio buffer.
+    
+    Parameters:
+    - samples: Mono float32 audio buffer
+    - sample_rate: Sampling rate of the buffer
+    - silence_thresh: The silence threshold (in dBFS)
+    - min_silence_len: Minimum length of silence (in milliseconds) to be considered for trimming
+    - return_silent: Also return the silent intervals, so the other steps can reuse them
+
+    Returns:
+    - The buffer without the silent parts, or a tuple of (buffer, silent_intervals) if return_silent is True. The intervals are in
+      milliseconds of the input buffer.
+    """
+
+    silent_intervals = detect_silence_array(samples, sample_rate, silence_thresh, min_silence_len)
+    nonsilent_chunks = detect_nonsilent_array(samples, sample_rate, silence_thresh, min_silence_len,
+                                              silent_intervals=silent_intervals)
+
+    # If no nonsilent chunks are detected, keep the original audio
+    if len(nonsilent_chunks) == 0:
+        processed = samples
+    else:
+        processed = join_intervals(samples, sample_rate, nonsilent_chunks)
+
+    if return_silent:
+        return processed, silent_intervals
+    return processed
+
+def reduce_noise_array(samples, sample_rate, noise_reduction_strength=1, noise_profile=None):
+    """
+    Reduces the noise in an in-memory audio buffer.
+    
+    Parameters:
+    - samples: Mono float32 audio buffer
+    - sample_rate: Sampling rate of the buffer
+    - noise_reduction_strength: The proportion to reduce the noise by (1.0 = 100%), by default 1.0
+    - noise_profile: NoiseProfile of the recording (noise_profile.py). If it's given, the noise is gated with it instead of being
+      estimated over the whole buffer.
+
+    Returns:
+    - The denoised buffer.
+    """
+
+    if noise_profile is not None:
+        return spectral_gate(samples, sample_rate, noise_profile, prop_decrease=noise_reduction_strength)
+
+    reduced_noise = nr.reduce_noise(y=samples, sr=sample_rate, prop_decrease=noise_reduction_strength)
+    return reduced_noise.astype(np.float32, copy=False)
+
+def normalize_array(samples, target_dBFS=-20.0):
+    """
+    Normalizes an in-memory audio buffer to the target loudness.
+    
+    Parameters:
+    - samples: Mono float32 audio buffer
+    - target_dBFS: Target average loudness (in dBFS)
+
+    Returns:
+    - The normalized buffer.
+    """
+
+    # Same as AudioSegment.dBFS, the buffer is already relative to full scale.
+    rms = np.sqrt(np.mean(np.square(samples, dtype=np.float64)))
+    if rms == 0:
+        return samples
+
+    change_in_dBFS = target_dBFS - 20 * np.log10(rms)
+    normalized = samples * np.float32(10 ** (change_in_dBFS / 20))
+
+    # apply_gain clips to the sample range as well.
+    return np.clip(normalized, -1.0, 1.0)
+
+def clean_audio_file(input_file, output_file, sample_rate=16000, silence_thresh=-55, min_silence_len=1000,
+                     noise_reduction_strength=0.5, target_dBFS=-20.0, noise_profile=None, resampler=DEFAULT_ENGINE):
+    """
+    Cleans a single audio file in memory. The file is decoded once, all the steps run on the same buffer and only the final wav
+    file is written.
+    
+    Parameters:
+    - input_file: Path to the input audio file
+    - output_file: Path to save the output file
+    - sample_rate: Sampling rate of the wav file ( 16Khz by default. )
+    - silence_thresh: The silence threshold (in dBFS)
+    - min_silence_len: Minimum length of silence (in milliseconds) to be considered for trimming
+    - noise_reduction_strength: The proportion to reduce the noise by (1.0 = 100%)
+    - target_dBFS: Target average loudness (in dBFS)
+    - noise_profile: How the noise is estimated. None: by noisereduce over the whole file. 'silence': from the silent parts found by
+      the silence removal (noisereduce is used if there isn't enough silence). A NoiseProfile: that profile, usually the cached
+      profile of the file's source.
+    - resampler: Resampler engine (resampler.py)
+
+    Returns:
+    - The NoiseProfile the noise was reduced with, or None if noisereduce estimated the noise.
+    """
+
+    logger.debug("Cleaning %s in memory...", input_file)
+    with metrics.timer('clean.decode'):
+        samples, sr = load_audio(input_file, sample_rate=sample_rate, resampler=resampler)
+    metrics.count('audio_seconds', len(samples) / sr, stage='clean')
+    with metrics.timer('clean.remove_silence'):
+        decoded = samples
+        samples, silent_intervals = remove_silence_array(samples, sr, silence_thresh=silence_thresh, min_silence_len=min_silence_len,
+                                                         return_silent=True)
+    if isinstance(noise_profile, str):
+        if noise_profile != 'silence':
+            raise ValueError(f"Unknown noise_profile: {noise_profile}, must be 'silence', a NoiseProfile or None")
+        # The silent parts are thrown away by the silence removal, but they're exactly the noise of the recording.
+        with metrics.timer('clean.noise_profile'):
+            noise_profile = estimate_noise_profile(silent_samples(decoded, sr, silent_intervals), sr)
+    del decoded
+    with metrics.timer('clean.reduce_noise'):
+        samples = reduce_noise_array(samples, sr, noise_reduction_strength=noise_reduction_strength, noise_profile=noise_profile)
+    with metrics.timer('clean.normalize'):
+        samples = normalize_array(samples, target_dBFS=target_dBFS)
+
+    # 16 bit PCM, same as the exports of the file based steps.
+    with metrics.timer('clean.write'):
+        sf.write(output_file, samples, sr, subtype='PCM_16')
+    metrics.count('bytes_written', os.path.getsize(output_file), stage='clean')
+    logger.debug("Cleaned %s and saved to %s.", input_file, output_file)
+    return noise_profile
+
+# Streaming mode. Some of the sources are 2-3 hours long, and the whole-file functions above keep several copies of the full signal in
+# memory. Here the file goes through a chain of generators, one block at a time: decode -> resample -> remove silence -> reduce noise.
+# Each step keeps only the state it needs across block boundaries, so the peak memory depends on the block size, not on the duration
+# of the file. Normalization needs the loudness of the whole result, so the denoised signal goes to a float32 scratch file first
+# and the gain is applied in a second pass over it.
+
+def _iter_decoded_blocks(input_file, block_seconds):
+    """
+    Decodes the audio file with ffmpeg (the same converter pydub uses) and yields it block by block.
+
+    Parameters:
+    - input_file: Path to the input audio file
+    - block_seconds: Length of each block (in seconds)
+
+    Returns:
+    - A tuple of (frame_rate, channels, blocks). blocks is a generator of interleaved 16 bit PCM bytes.
+    """
+
+    stream = next(stream for stream in mediainfo_json(input_file)['streams'] if stream.get('codec_type') == 'audio')
+    frame_rate = int(stream['sample_rate'])
+    # More than 2 channels are downmixed by ffmpeg, the rest is done like set_channels(1).
+    channels = min(int(stream['channels']), 2)
+
+    command = [AudioSegment.converter, '-v', 'error', '-i', input_file, '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', str(channels), '-']
+
+    def blocks():
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            block_bytes = int(block_seconds * frame_rate) * channels * 2
+            while True:
+                block = process.stdout.read(block_bytes)
+                if not block:
+                    break
+                yield block
+        finally:
+            process.stdout.close()
+            error = process.stderr.read().decode('utf-8', 'ignore')
+            process.stderr.close()
+            if process.wait() != 0:
+                raise RuntimeError(f"Decoding {input_file} failed: {error}")
+
+    return frame_rate, channels, blocks()
+
+def _iter_resampled(blocks, frame_rate, channels, sample_rate, resampler=DEFAULT_ENGINE):
+    """
+    Resamples and downmixes 16 bit PCM blocks, exactly like load_audio does with the whole file.
+
+    Parameters:
+    - blocks: Generator of interleaved 16 bit PCM bytes
+    - frame_rate: Sampling rate of the blocks
+    - channels: Number of channels of the blocks
+    - sample_rate: Target sampling rate
+    - resampler: Resampler engine (resampler.py)
+
+    Returns:
+    - A generator of mono float32 blocks, scaled to [-1.0, 1.0].
+    """
+
+    if resampler != 'audioop':
+        mono = (np.frombuffer(block, dtype=np.int16).reshape(-1, channels).mean(axis=1, dtype=np.float32) / 32768.0
+                for block in blocks)
+        yield from iter_resample(mono, frame_rate, sample_rate, resampler)
+        return
+
+    # ratecv keeps its filter state between calls, passing the state on makes the blocks join seamlessly.
+    state = None
+    for block in blocks:
+        if frame_rate != sample_rate:
+            block, state = audioop.ratecv(block, 2, channels, frame_rate, sample_rate, state)
+        if channels == 2:
+            block = audioop.tomono(block, 2, 0.5, 0.5)
+        yield np.frombuffer(block, dtype=np.int16).astype(np.float32) / 32768.0
+
+def _iter_without_silence(blocks, sample_rate, silence_thresh=-55, min_silence_len=1000, stats=None):
+    """
+    Removes silence from a stream of blocks, same result as detect_nonsilent_array on the whole signal.
+
+    A millisecond is removed if a silent min_silence_len window covers it. A window is known only when all of its milliseconds are
+    read, so the output lags min_silence_len behind the input; the energies and window flags carried from block to block are bounded
+    by min_silence_len as well.
+
+    Parameters:
+    - blocks: Generator of mono float32 blocks
+    - sample_rate: Sampling rate of the blocks, must be a multiple of 1000
+    - silence_thresh: The silence threshold (in dBFS)
+    - min_silence_len: Minimum length of silence (in milliseconds) to be considered for trimming
+    - stats: Optional dictionary, 'kept' and 'total' are set to the number of kept and read samples
+
+    Returns:
+    - A generator of mono float32 blocks without the silent parts.
+    """
+
+    if sample_rate % 1000:
+        raise ValueError(f"Streaming silence removal needs a sampling rate that is a multiple of 1000, not {sample_rate}")
+    ms_frames = sample_rate // 1000
+    length = min_silence_len
+
+    # Same comparison as detect_silence_array, on the integer energies of 16-bit PCM.
+    window_samples = length * ms_frames
+
+    partial = np.empty(0, dtype=np.float32)      # samples of the millisecond that isn't complete yet
+    undecided = np.empty(0, dtype=np.float32)    # samples from millisecond `decided` on
+    energy = np.empty(0, dtype=np.int64)         # energies of the complete milliseconds from `energy_base` on
+    energy_base = 0
+    silent = np.empty(0, dtype=bool)             # silence flags of the windows starting from `silent_base` on
+    silent_base = 0
+    decided = 0                                  # first millisecond that isn't kept or removed yet
+    complete = 0                                 # number of complete milliseconds read
+    kept = 0
+    total = 0
+
+    def decide(upto):
+        # Keep millisecond m if no silent window starts in [m - length + 1, m].
+        nonlocal undecided, decided, kept
+        counts = np.concatenate(([0], np.cumsum(silent)))
+        ms = np.arange(decided, upto)
+        low = np.maximum(ms - length + 1, silent_base) - silent_base
+        high = np.minimum(ms + 1 - silent_base, len(silent))
+        keep = counts[high] - counts[np.minimum(low, high)] == 0
+
+        frames = (upto - decided) * ms_frames
+        chunk = undecided[:frames]
+        undecided = undecided[frames:]
+        decided = upto
+
+        # A shorter last millisecond at the end of the stream.
+        keep = np.repeat(keep, ms_frames)[:len(chunk)]
+        output = chunk[keep]
+        kept += len(output)
+        return output
+
+    for block in blocks:
+        total += len(block)
+        undecided = np.concatenate((undecided, block))
+        partial = np.concatenate((partial, block))
+
+        count = len(partial) // ms_frames
+        if count:
+            new_energy = _pcm_energy(partial[:count * ms_frames]).reshape(count, ms_frames).sum(axis=1)
+            partial = partial[count * ms_frames:]
+            energy = np.concatenate((energy, new_energy))
+            complete += count
+
+        # Windows that have all of their milliseconds read now.
+        first = silent_base + len(silent)
+        last = complete - length
+        if last >= first:
+            cumulative = np.concatenate(([0], np.cumsum(energy)))
+            starts = np.arange(first, last + 1) - energy_base
+            silent = np.concatenate((silent, _is_silent(cumulative[starts + length] - cumulative[starts], window_samples,
+                                                        silence_thresh)))
+
+        # Milliseconds whose covering windows are all known.
+        upto = silent_base + len(silent)
+        if upto > decided:
+            output = decide(upto)
+            if len(output):
+                yield output
+
+        # Only the last length - 1 energies and flags are needed for the next windows and decisions.
+        if len(energy) >= length:
+            drop = len(energy) - (length - 1)
+            energy = energy[drop:]
+            energy_base += drop
+        if len(silent) >= length:
+            drop = len(silent) - (length - 1)
+            silent = silent[drop:]
+            silent_base += drop
+
+    # There are no windows after the last complete one, the rest of the stream is decided with what we have.
+    end = -(-total // ms_frames)
+    if end > decided:
+        output = decide(end)
+        if len(output):
+            yield output
+
+    if stats is not None:
+        stats['kept'] = kept
+        stats['total'] = total
+
+def _iter_denoised(blocks, sample_rate, noise_reduction_strength=1, block_seconds=30, overlap_seconds=1, padding_seconds=2,
+                   noise_profile=None):
+    """
+    Reduces the noise of a stream of blocks with overlap-add.
+
+    The stream is cut into windows of block_seconds + overlap_seconds that start every block_seconds. Each window is denoised with
+    padding_seconds of extra context on both sides (thrown away afterwards, so the edge effects of the spectral gating fall outside
+    of it), and consecutive windows are crossfaded over their overlap with complementary linear ramps.
+
+    Parameters:
+    - blocks: Generator of mono float32 blocks
+    - sample_rate: Sampling rate of the blocks
+    - noise_reduction_strength: The proportion to reduce the noise by (1.0 = 100%)
+    - block_seconds: Hop between the windows (in seconds)
+    - overlap_seconds: Crossfade length between the windows (in seconds)
+    - padding_seconds: Extra context on both sides of each window (in seconds)
+    - noise_profile: NoiseProfile to gate the noise with, noisereduce estimates it for every window if it's None
+
+    Returns:
+    - A generator of denoised mono float32 blocks.
+    """
+
+    hop = int(block_seconds * sample_rate)
+    overlap = int(overlap_seconds * sample_rate)
+    padding = int(padding_seconds * sample_rate)
+    window = hop + overlap
+
+    ramp_up = ((np.arange(overlap) + 0.5) / overlap).astype(np.float32)
+    ramp_down = ramp_up[::-1]
+
+    buffer = np.empty(0, dtype=np.float32)   # samples from `buffer_start` on
+    buffer_start = 0
+    start = 0                                # start of the next window
+    carry = np.empty(0, dtype=np.float32)    # ramped down end of the previous window
+    ended = False
+    blocks = iter(blocks)
+
+    while True:
+        # Read until the next window and its padding are available, or the stream ends.
+        while not ended and buffer_start + len(buffer) < start + window + padding:
+            block = next(blocks, None)
+            if block is None:
+                ended = True
+            else:
+                buffer = np.concatenate((buffer, block))
+
+        stream_end = buffer_start + len(buffer)
+        if start >= stream_end:
+            break
+
+        context_start = max(start - padding, buffer_start)
+        context = buffer[context_start - buffer_start:]
+        denoised = reduce_noise_array(context, sample_rate, noise_reduction_strength=noise_reduction_strength,
+                                      noise_profile=noise_profile)
+
+        # Throw the padding away.
+        output = denoised[start - context_start:start - context_start + window].copy()
+        is_last = ended and start + window >= stream_end
+
+        if start > 0:
+            output[:overlap] *= ramp_up[:len(output)]
+            output[:len(carry)] += carry
+        if is_last:
+            yield output
+            break
+
+        output[hop:] *= ramp_down
+        carry = output[hop:]
+        yield output[:hop]
+
+        start += hop
+        # Keep only the samples the next window's padding needs.
+        drop = max(start - padding - buffer_start, 0)
+        buffer = buffer[drop:]
+        buffer_start += drop
+
+def _stream_pass(input_file, scratch_file, sample_rate, block_seconds, remove_silence_step, silence_thresh, min_silence_len,
+                 noise_reduction_strength, noise_profile=None, resampler=DEFAULT_ENGINE):
+    """
+    Runs the decode -> resample -> (remove silence) -> reduce noise chain and writes the result to a float32 scratch file.
+
+    Returns:
+    - A tuple of (kept samples, written samples, sum of squares of the written samples). Kept samples is the output of the silence
+      removal, 0 means everything was silent.
+    """
+
+    frame_rate, channels, blocks = _iter_decoded_blocks(input_file, block_seconds)
+    stream = _iter_resampled(blocks, frame_rate, channels, sample_rate, resampler)
+
+    stats = {'kept': 0}
+    if remove_silence_step:
+        stream = _iter_without_silence(stream, sample_rate, silence_thresh, min_silence_len, stats=stats)
+    stream = _iter_denoised(stream, sample_rate, noise_reduction_strength=noise_reduction_strength, block_seconds=block_seconds,
+                            noise_profile=noise_profile)
+
+    written = 0
+    square_sum = 0.0
+    with sf.SoundFile(scratch_file, 'w', samplerate=sample_rate, channels=1, subtype='FLOAT', format='WAV') as scratch:
+        for block in stream:
+            scratch.write(block)
+            written += len(block)
+            square_sum += float(np.square(block, dtype=np.float64).sum())
+
+    return (stats['kept'] if remove_silence_step else written), written, square_sum
+
+def clean_audio_streaming(input_file, output_file, sample_rate=16000, silence_thresh=-55, min_silence_len=1000,
+                          noise_reduction_strength=0.5, target_dBFS=-20.0, block_seconds=30, noise_profile=None,
+                          resampler=DEFAULT_ENGINE):
+    """
+    Cleans a single audio file block by block with constant memory. The result is close to clean_audio_file, only the noise
+    reduction can differ slightly around the block edges.
+    
+    Parameters:
+    - input_file: Path to the input audio file
+    - output_file: Path to save the output file
+    - sample_rate: Sampling rate of the wav file ( 16Khz by default. )
+    - silence_thresh: The silence threshold (in dBFS)
+    - min_silence_len: Minimum length of silence (in milliseconds) to be considered for trimming
+    - noise_reduction_strength: The proportion to reduce the noise by (1.0 = 100%)
+    - target_dBFS: Target average loudness (in dBFS)
+    - block_seconds: Length of the blocks (in seconds), the peak memory grows with it
+    - noise_profile: NoiseProfile to gate the noise with, usually the cached profile of the file's source. noisereduce estimates
+      the noise of every block if it's None. The silent parts are dropped block by block here, so a profile can't be estimated
+      from them like in clean_audio_file.
+    - resampler: Resampler engine (resampler.py)
+    """
+
+    logger.debug("Cleaning %s in blocks of %s seconds...", input_file, block_seconds)
+    scratch_file = make_temp_file(os.path.dirname(os.path.abspath(output_file)))
+    try:
+        kept, written, square_sum = _stream_pass(input_file, scratch_file, sample_rate, block_seconds, True, silence_thresh,
+                                                 min_silence_len, noise_reduction_strength, noise_profile, resampler)
+
+        # Everything is silent. Like remove_silence, keep the original audio, which means going over the input once more.
+        if kept == 0:
+            kept, written, square_sum = _stream_pass(input_file, scratch_file, sample_rate, block_seconds, False, silence_thresh,
+                                                     min_silence_len, noise_reduction_strength, noise_profile, resampler)
+
+        # Second pass: apply the normalization gain, same as normalize_array.
+        gain = np.float32(1.0)
+        if written and square_sum > 0:
+            rms = np.sqrt(square_sum / written)
+            gain = np.float32(10 ** ((target_dBFS - 20 * np.log10(rms)) / 20))
+
+        with sf.SoundFile(output_file, 'w', samplerate=sample_rate, channels=1, subtype='PCM_16', format='WAV') as output:
+            for block in sf.blocks(scratch_file, blocksize=int(block_seconds * sample_rate), dtype='float32'):
+                output.write(np.clip(block * gain, -1.0, 1.0))
+    finally:
+        if os.path.exists(scratch_file):
+            os.remove(scratch_file)
+
+    metrics.count('bytes_written', os.path.getsize(output_file), stage='clean')
+    logger.debug("Cleaned %s and saved to %s.", input_file, output_file)
+
+def clean_audio_file_on_disk(input_file, output_file, temp_file, noise_reduction_strength=0.5):
+    """
+    Cleans a single audio file through the file based steps, using temp_file as scratch.
+    
+    Parameters:
+    - input_file: Path to the input audio file
+    - output_file: Path to save the output file
+    - temp_file: Path of the scratch wav file, it is removed after processing
+    - noise_reduction_strength: The proportion to reduce the noise by (1.0 = 100%)
+    """
+
+    try:
         # Change to .wav format, resample, remove silence, reduce noise, normalize audio, split the audio into 5 second segments (split-audio.py),
         # MFCC feature extraciton (mfcc-feature-extraction.py)
         # This will do.
-        convert_to_wav(file, temp_file)
+        convert_to_wav(input_file, temp_file)
         remove_silence(temp_file, temp_file)
-        reduce_noise(temp_file, temp_file, noise_reduction_strength=0.5)
-        normalize_audio(temp_file, wav_file)
-        
+        reduce_noise(temp_file, temp_file, noise_reduction_strength=noise_reduction_strength)
+        normalize_audio(temp_file, output_file)
+    finally:
         # Remove temp file after processing
-        os.remove(temp_file)
-        print(f"Finished processing {file}.\n")
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def make_temp_file(output_dir):
+    """
+    Creates a unique scratch wav file in output_dir, so different files and different runs never share the same temp file.
+
+    Returns:
+    - Path of the scratch file.
+    """
+
+    fd, temp_file = tempfile.mkstemp(prefix="temp_", suffix=".wav", dir=output_dir)
+    os.close(fd)
+    return temp_file
+
+# Parameters the dataset cleaning runs with. They are part of the cache key (cache.py), if one of them changes the files are
+# cleaned again.
+CLEAN_PARAMS = {
+    'sample_rate': 16000,
+    'silence_thresh': -55,
+    'min_silence_len': 1000,
+    'noise_reduction_strength': 0.5,
+    'target_dBFS': -20.0,
+    'resampler': DEFAULT_ENGINE,
+}
+
+# Downloaded audio files: mp3 files, or 16 kHz mono wav files when the crawler decodes the streams while downloading (downloader.py).
+AUDIO_PATTERNS = ('*.mp3', '*.wav')
+
+def list_audio_files(input_dir):
+    """
+    Lists the downloaded audio files of a folder.
+
+    Parameters:
+    - input_dir: Path to the folder
+
+    Returns:
+    - A sorted list of the mp3 and wav files.
+    """
+
+    return sorted(file for pattern in AUDIO_PATTERNS for file in glob.glob(os.path.join(input_dir, pattern)))
+
+def clean_audio_dataset(input_dir, output_dir, in_memory=False, manifest=None):
+    """
+    Cleans the audio data-set with .mp3 (or downloaded .wav) files and saves the files into output_dir.
+    
+    Parameters:
+    - input_dir: Path to the input audio dataset (mp3 or wav files.)
+    - output_dir: Path to the output audio dataset (Converts it into .wav format)
+    - in_memory: Decode each file once and clean it in memory instead of going through temp.wav
+    - manifest: Path to the build cache manifest (cache.py). Files that are already cleaned with the same content and parameters
+      are skipped.
+    """
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    cache = open_cache(manifest)
+
+    # Look for .mp3 and .wav files
+    for file in list_audio_files(input_dir):
+        base_name = os.path.basename(file)
+        
+        # Defining the output wav file with the original file's name.
+        wav_file = os.path.join(output_dir, os.path.splitext(base_name)[0] + '.wav')
+
+        if cache is not None and cache.is_fresh('clean', file, CLEAN_PARAMS):
+            logger.debug("Skipping %s, already cleaned.", file)
+            continue
+
+        # Skip the four decode/encode round-trips on temp.wav.
+        if in_memory:
+            clean_audio_file(file, wav_file)
+        else:
+            # Create a temp wav file and save the original mp3 audio to this.
+            # Process the temp wav file.
+            # Finally, save the temp wav as wav_file with the original mp3 file's name.
+            clean_audio_file_on_disk(file, wav_file, make_temp_file(output_dir))
+
+        if cache is not None:
+            cache.record('clean', file, CLEAN_PARAMS, [wav_file])
+        logger.debug("Finished processing %s.", file)
+
+    if cache is not None:
+        cache.save()
+
+def _clean_task(task):
+    """
+    Worker of clean_audio_datasets. Cleans one file and returns its error instead of raising it.
+
+    Parameters:
+    - task: A tuple of (input_file, output_file, in_memory, streaming, noise_profile), noise_profile as in clean_audio_file. The file
+      based steps and the streaming mode always use noisereduce.
+
+    Returns:
+    - A tuple of (input_file, error, noise profile, collected metrics). error is None if the file is cleaned successfully, the noise
+      profile is the one the file was cleaned with (clean_audio_file), or None.
+    """
+
+    input_file, output_file, in_memory, streaming, noise_profile = task
+    profile = None
+    try:
+        with metrics.timer('clean'):
+            if streaming:
+                clean_audio_streaming(input_file, output_file)
+            elif in_memory:
+                profile = clean_audio_file(input_file, output_file, noise_profile=noise_profile)
+            else:
+                clean_audio_file_on_disk(input_file, output_file, make_temp_file(os.path.dirname(output_file)))
+        return input_file, None, profile, metrics.collect()
+    except Exception as e:
+        # Don't leave a half written wav file behind.
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        return input_file, f"{type(e).__name__}: {e}", None, metrics.collect()
+
+def clean_audio_datasets(input_base_dir, output_base_dir, accent_types=None, workers=None, in_memory=True, manifest=None,
+                         streaming=False, state_db=None, skip_duplicates=False, fingerprint_index=None, noise_profile=None,
+                         noise_profiles=None):
+    """
+    Cleans every accent folder of the audio data-set in parallel with a pool of worker processes.
+    
+    Parameters:
+    - input_base_dir: Path to the input audio dataset, one folder for each accent type (mp3 or wav files.)
+    - output_base_dir: Path to the output audio dataset, same folder structure as input_base_dir
+    - accent_types: List of accent folders to clean, all of them by default
+    - workers: Number of worker processes, os.cpu_count() by default
+    - in_memory: Decode each file once and clean it in memory instead of going through a temp wav file
+    - manifest: Path to the build cache manifest (cache.py). Files that are already cleaned with the same content and parameters
+      are skipped.
+    - streaming: Clean each file block by block with constant memory (clean_audio_streaming), for long sources or many workers
+    - state_db: Path to the crawl state database (state_store.py). The clean stage of every file is recorded as done or failed.
+    - skip_duplicates: Fingerprint the input files first (fingerprint.py) and skip the ones with the same content as an earlier file,
+      in any accent folder
+    - fingerprint_index: Path to the fingerprint index file, so the unchanged files aren't fingerprinted again on the next run
+    - noise_profile: None to reduce the noise with noisereduce, 'silence' to gate it with a profile estimated from the silent parts
+      of the same file (clean_audio_file), or 'origin' to share one profile between the videos of the same channel or playlist,
+      the origin the crawler recorded in state_db. The profile of an origin is estimated from its first file and reused for the
+      others, the videos with no known origin (search results) estimate their own. It's never shared over an accent folder, which
+      holds the videos of many unrelated searches, channels and playlists. Only the in-memory mode uses it.
+    - noise_profiles: With noise_profile='origin', path to the noise profile cache (noise_profile.py), so the profiles are reused
+      on the next run as well. They're kept only in memory if it's None.
+
+    Returns:
+    - A list of (input_file, error) tuples for the files that couldn't be cleaned, sorted by input_file.
+    """
+
+    if noise_profile not in (None, 'silence', 'origin'):
+        raise ValueError(f"Unknown noise_profile: {noise_profile}, must be 'silence', 'origin' or None")
+    if noise_profile == 'origin' and state_db is None:
+        raise ValueError("noise_profile='origin' needs the state_db the crawler recorded the origins in")
+
+    cache = open_cache(manifest)
+    # The profiles change the output, so they're part of the cache key. Without them the key stays the same as before.
+    params = CLEAN_PARAMS if noise_profile is None else dict(CLEAN_PARAMS, noise_profile=noise_profile)
+
+    if accent_types is None:
+        accent_types = [name for name in os.listdir(input_base_dir) if os.path.isdir(os.path.join(input_base_dir, name))]
+
+    # Duplicates are found over the whole dataset, so a copy in another accent folder is caught as well.
+    duplicates = set()
+    if skip_duplicates:
+        # Imported here, fingerprint.py uses list_audio_files of this module.
+        from fingerprint import find_duplicates
+        duplicates = {file for file, _, _ in find_duplicates(input_base_dir, workers=workers, index_path=fingerprint_index)}
+
+    # Sort the tasks so the work, and the report, is the same whatever the order the workers finish in.
+    tasks = []
+    skipped = 0
+    skipped_duplicates = 0
+    for accent_type in sorted(accent_types):
+        output_dir = os.path.join(output_base_dir, accent_type)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        for file in list_audio_files(os.path.join(input_base_dir, accent_type)):
+            if file in duplicates:
+                skipped_duplicates += 1
+                continue
+            if cache is not None and cache.is_fresh('clean', file, params):
+                skipped += 1
+                continue
+            wav_file = os.path.join(output_dir, os.path.splitext(os.path.basename(file))[0] + '.wav')
+            tasks.append((file, wav_file, in_memory, streaming, noise_profile))
+
+    state = open_state(state_db)
+
+    profiles = None
+    origins = {}
+    if noise_profile == 'origin':
+        profiles = NoiseProfileCache(noise_profiles)
+        origins = state.origins()
+
+    def origin_of(input_file):
+        return origins.get((os.path.basename(os.path.dirname(input_file)), source_name(input_file)))
+
+    # Without shared profiles all the files run at once. With them, the first file of every origin that has no profile yet runs
+    # first and estimates it from its silent parts, then the other files run with the profile of their origin.
+    rounds = [tasks]
+    if profiles is not None:
+        first = {}
+        for task in tasks:
+            origin = origin_of(task[0])
+            if origin is not None and origin not in first and profiles.get(origin, CLEAN_PARAMS['sample_rate']) is None:
+                first[origin] = task[0]
+        first_files = set(first.values())
+        rounds = [[task for task in tasks if task[0] in first_files], [task for task in tasks if task[0] not in first_files]]
+
+    def noise_profile_of(input_file):
+        if profiles is None:
+            return noise_profile
+        # 'silence': no known origin, or no profile yet (the first file had no silence), the file estimates its own.
+        origin = origin_of(input_file)
+        profile = profiles.get(origin, CLEAN_PARAMS['sample_rate']) if origin is not None else None
+        return profile if profile is not None else 'silence'
+
+    failures = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=metrics.init_worker, initargs=(metrics.is_enabled(),)) as executor:
+        for round_tasks in rounds:
+            round_tasks = [task[:4] + (noise_profile_of(task[0]),) for task in round_tasks]
+            # Small chunks keep the long and short files balanced between the workers.
+            results = executor.map(_clean_task, round_tasks, chunksize=1)
+            for (input_file, error, profile, collected), (_, wav_file, _, _, _) in zip(results, round_tasks):
+                metrics.merge(collected)
+                accent_type = os.path.basename(os.path.dirname(input_file))
+                origin = origin_of(input_file) if profiles is not None else None
+                if origin is not None and profile is not None and profiles.get(origin, profile.sample_rate) is None:
+                    profiles.add(origin, profile)
+                    log_event(logger, logging.DEBUG, "noise profile", origin=origin, file=input_file, seconds=round(profile.seconds, 1))
+                if error is not None:
+                    failures.append((input_file, error))
+                    metrics.count('failures', stage='clean')
+                    log_event(logger, logging.WARNING, "clean failed", file=input_file, error=error.splitlines()[0])
+                    if state is not None:
+                        state.set_stage('clean', input_file, 'failed', error=error, accent_type=accent_type)
+                    continue
+
+                metrics.count('files', stage='clean')
+                log_event(logger, logging.DEBUG, "cleaned", file=input_file, output=wav_file)
+                if cache is not None:
+                    # Only the main process writes the manifest.
+                    cache.record('clean', input_file, params, [wav_file])
+                if state is not None:
+                    state.set_stage('clean', input_file, 'done', accent_type=accent_type)
+
+    failures.sort()
+    if cache is not None:
+        cache.save()
+    if profiles is not None:
+        profiles.save()
+    if state is not None:
+        state.close()
+
+    metrics.count('skipped', skipped + skipped_duplicates, stage='clean')
+    # ffmpeg errors are long, the first line of each is logged when it fails.
+    log_event(logger, logging.INFO, "clean finished", cleaned=len(tasks) - len(failures), files=len(tasks), failed=len(failures),
+              unchanged=skipped, duplicates=skipped_duplicates)
+    return failures
 
-clean_audio_dataset("audio_files/Australian", "cleaned_audio_files/Australian")
\ No newline at end of file
+if __name__ == "__main__":
+    metrics.configure(level='INFO', textfile="pipeline_metrics.prom")
+    clean_audio_datasets("audio_files", "cleaned_audio_files", manifest="build_manifest.json", state_db="crawler_state.db",
+                         skip_duplicates=True, fingerprint_index="audio_fingerprints.npz", noise_profile='origin',
+                         noise_profiles="noise_profiles.npz")
+    metrics.report()
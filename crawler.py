@@ -3,15 +3,30 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from bs4 import BeautifulSoup
-#from pytube import YouTube -- NOT WORKING, USE PYTUBEFIX INSTEAD.
-from pytubefix import YouTube
-from pytubefix.cli import on_progress
 from pydub import AudioSegment
+from pydub.utils import mediainfo
+from downloader import download_all
+from http_discovery import search_filter
+import http_discovery
+import metrics
+from state_store import StateStore
+from metrics import get_logger
 import time
 import os
 import re
 
+# lxml is optional, it's only used to parse the page source when the results can't be read in the page. BeautifulSoup with
+# html.parser is used without it.
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+logger = get_logger('crawler')
+
 # Set up Chrome options for Selenium
 chrome_options = Options()
 
@@ -24,96 +39,329 @@ chrome_options = Options()
 #chrome_options.add_argument("--no-sandbox")
 #chrome_options.add_argument("--disable-dev-shm-usage")
 
-# Save the downloaded video file's URL into a txt file for duplicate fix.
+# How long to wait (in seconds) for the results to show up after opening a page and after scrolling. These are upper limits, the
+# waits return as soon as new results are on the page.
+page_load_timeout = 10
+scroll_timeout = 5
+
+# How the listing pages are read: 'browser' scrolls them in Chrome, 'http' reads the results over plain HTTP without a browser (see
+# http_discovery.py), which is much lighter when many discovery jobs run on the same machine.
+discovery_backend = 'browser'
+
+# The crawl state (downloaded and failed videos, finished processing stages) is kept in a SQLite database, see state_store.py. The
+# URLs of the old downloaded_videos.txt are imported into it once.
+state_db_file = 'crawler_state.db'
 downloaded_videos_file = 'downloaded_videos.txt'
 
-def load_downloaded_videos():
+def open_state_store():
     """
-    Loads the downloaded YouTube video URLs.
+    Opens the crawl state store, importing downloaded_videos.txt the first time.
 
     Returns:
-    - A set of links.
+    - A StateStore.
     """
 
-    # If there is no txt file including the video URLs in the working directory, return an empty set. Otherwise, return a set of URLs
-    # included in the txt file with each line as an element.
-    if not os.path.exists(downloaded_videos_file):
-        return set()
-    with open(downloaded_videos_file, 'r') as f:
-        return set(line.strip() for line in f)
+    state = StateStore(state_db_file)
+    state.import_txt(downloaded_videos_file)
+    return state
 
-def save_downloaded_video(video_url):
+def load_downloaded_videos(state):
     """
-    Saves the downloaded YouTube video URLs.
+    Loads the downloaded YouTube video URLs.
+
+    Parameters:
+    - state: The StateStore.
+
+    Returns:
+    - A set of links.
     """
 
-    with open(downloaded_videos_file, 'a') as f:
-        f.write(video_url + '\n')
+    return state.downloaded_urls()
 
-def check_title_for_nationality(title, target_nationality):
+def save_downloaded_video(state, video_url, accent_type=None, file_path=None, origin=None):
     """
-    Checks video title for nationality.
+    Saves a downloaded YouTube video with its accent type, file and duration.
 
     Parameters:
-    - title: The title of the YouTube video.
-    - target_nationality: The nationality filter to apply to video titles.
+    - state: The StateStore.
+    - video_url: The URL of the YouTube video.
+    - accent_type: Accent type of the video.
+    - file_path: Path of the downloaded audio file.
+    - origin: URL of the channel or playlist the video was found on, None for search results. The cleaner shares a noise profile
+      between the videos of the same origin.
+    """
 
-    Returns:
-    - True or False.
+    title = None
+    duration = None
+    if file_path is not None:
+        title = os.path.splitext(os.path.basename(file_path))[0]
+        try:
+            duration = float(mediainfo(file_path)['duration'])
+        except (KeyError, ValueError):
+            # No duration if ffprobe can't read it, the video is still downloaded.
+            pass
+    state.record_download(video_url, accent_type=accent_type, title=title, file_path=file_path, duration=duration, origin=origin)
+
+# Runs in the page. Returns the number of result nodes and [href, title, view count text] of the nodes from arguments[1] on. The
+# view count is in the first span with the inline-metadata-item class of the parent div with id="meta", null if there isn't one.
+EXTRACT_ENTRIES_SCRIPT = """
+const nodes = document.querySelectorAll('[id="' + arguments[0] + '"]');
+const entries = [];
+for (let i = arguments[1]; i < nodes.length; i++) {
+    const meta = nodes[i].closest('#meta');
+    const span = meta ? meta.querySelector('span.inline-metadata-item') : null;
+    entries.push([nodes[i].getAttribute('href'), nodes[i].getAttribute('title') || '', span ? span.textContent : null]);
+}
+return [nodes.length, entries];
+"""
+
+def extract_entries(html, link_id):
     """
+    Extracts the video entries from the HTML of a listing page, same result as EXTRACT_ENTRIES_SCRIPT from the start. Uses lxml
+    if it's installed, it's many times faster than BeautifulSoup with html.parser on pages with thousands of results.
 
-    # List of nationalities to skip
-    nationality_words = ['American', 'Australian', 'British', 'Scottish', 'Indian', 'Irish', 'Canadian']
+    Parameters:
+    - html: Page source.
+    - link_id: id attribute of the video links on the page.
 
-    # No more than 1 nationality word on the title.
-    # If 'American' and 'British' words are concurrently included, return false.
-    for nationality in nationality_words:
-        if nationality in title and nationality != target_nationality:
-            return False
-    return True
+    Returns:
+    - A list of (href, title, view count text or None) tuples, in page order.
+    """
 
-def clean_title(title):
+    entries = []
+    if not html.strip():
+        return entries
+
+    if lxml is not None:
+        tree = lxml.html.fromstring(html)
+        for video in tree.iter():
+            if video.get('id') != link_id:
+                continue
+            view_count_text = None
+            meta = next((parent for parent in video.iterancestors() if parent.get('id') == 'meta'), None)
+            if meta is not None:
+                span = next((span for span in meta.iter('span') if 'inline-metadata-item' in span.get('class', '').split()), None)
+                if span is not None:
+                    view_count_text = span.text_content()
+            entries.append((video.get('href'), video.get('title', ''), view_count_text))
+        return entries
+
+    soup = BeautifulSoup(html, 'html.parser')
+    for video in soup.find_all(id=link_id):
+        parent_div = video.find_parent(id="meta")
+        span = parent_div.find('span', class_='inline-metadata-item') if parent_div else None
+        entries.append((video.get('href'), video.get('title', ''), span.text if span else None))
+    return entries
+
+def benchmark_extraction(html_file, link_id='video-title', item_tag='ytd-video-renderer', scrolls=20, repeat=3):
     """
-    Removes invalid characters from the title to download the audio with no special character errors.
+    Compares full re-parsing with incremental extraction on a saved listing page. The page is cut into scrolls parts at the result
+    elements to simulate the results loading in while scrolling: the old way parses the whole page so far with html.parser after
+    every scroll, the new way extracts only the results that came in with the scroll.
 
     Parameters:
-    - title: The title of the YouTube video.
+    - html_file: Path to a saved listing page (Save Page As after scrolling, or a generated fixture).
+    - link_id: id attribute of the video links on the page.
+    - item_tag: Tag name of one result on the page, ytd-video-renderer for search results, ytd-rich-item-renderer for channels.
+    - scrolls: Number of scroll steps to simulate.
+    - repeat: Number of runs, the best one is reported.
 
     Returns:
-    - Cleaned title.
+    - A dictionary of results, full_parse_seconds and incremental_seconds.
     """
-    
-    # Replace the special characters with '' in the title.
-    cleaned_title = re.sub(r'[<>:"/\\|?*]', '', title)
-    return cleaned_title
 
-def parse_view_count(view_count_text):
+    with open(html_file, 'r', encoding='utf-8') as f:
+        html = f.read()
+
+    # The page after each scroll ends right before the first result of the next scroll.
+    starts = [m.start() for m in re.finditer(f'<{re.escape(item_tag)}[\\s>]', html)]
+    if not starts:
+        raise ValueError(f"No <{item_tag}> elements in {html_file}")
+    cuts = sorted({starts[len(starts) * i // scrolls] for i in range(1, scrolls)} | {len(html)})
+    pages = [html[:cut] for cut in cuts]
+
+    def full_parse():
+        for page in pages:
+            soup = BeautifulSoup(page, 'html.parser')
+            for video in soup.find_all(id=link_id):
+                parent_div = video.find_parent(id="meta")
+                if parent_div:
+                    parent_div.find('span', class_='inline-metadata-item')
+
+    def incremental():
+        # In the browser the DOM is already there and only the new nodes are read. Without a browser, the part of the page that
+        # came in with each scroll is parsed on its own.
+        entries = []
+        previous = 0
+        for page in pages:
+            entries.extend(extract_entries(page[previous:], link_id))
+            previous = len(page)
+        return entries
+
+    results = len(incremental())
+    timings = {}
+    for name, run in (('full_parse_seconds', full_parse), ('incremental_seconds', incremental)):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+
+    return {'results': results, **timings}
+
+class DiscoverySession:
+    """
+    A Chrome session that stays on a listing page (search results, channel or playlist). Every call continues scrolling from
+    where the previous one stopped, so asking for more links only scrolls for the new ones instead of starting over.
+
+    Parameters:
+    - url: The URL of the listing page.
+    - link_id: id attribute of the video links on the page ('video-title' or 'video-title-link').
+    - accept: Function that takes a video entry (see extract_entries) and returns True if the video should be used, all videos by
+      default.
+    - search_query: If given, typed into the search box of the page.
+    """
+
+    def __init__(self, url, link_id, accept=None, search_query=None):
+        self.link_id = link_id
+        self.accept = accept
+        # Accepted video URLs in page order, and the hrefs that are already handled (accepted or not).
+        self.links = []
+        self.link_set = set()
+        self.seen = set()
+        self.exhausted = False
+        # Number of result nodes on the page that are already extracted.
+        self.watermark = 0
+
+        self.driver = webdriver.Chrome(options=chrome_options)
+        self.driver.get(url)
+
+        if search_query is not None:
+            # Get the input element with name attribute set to 'search_query', send the query, press enter.
+            search_box = self.driver.find_element(By.NAME, 'search_query')
+            search_box.send_keys(search_query)
+            search_box.send_keys(Keys.RETURN)
+
+        # Wait for the first results instead of a fixed sleep.
+        if not self._wait_for_results(0, page_load_timeout):
+            logger.info("No results on the page.")
+            self.exhausted = True
+
+    def _result_count(self):
+        return len(self.driver.find_elements(By.ID, self.link_id))
+
+    def _wait_for_results(self, count, timeout):
+        # Returns as soon as there are more than count results on the page, False if none came in time.
+        try:
+            WebDriverWait(self.driver, timeout).until(lambda driver: self._result_count() > count)
+            return True
+        except TimeoutException:
+            return False
+
+    def _new_entries(self):
+        # Only the result nodes after the watermark are read, the ones before it were already handled by an earlier call. The
+        # entries are built in the page, so only a few strings per new result come back instead of the whole page source.
+        try:
+            count, entries = self.driver.execute_script(EXTRACT_ENTRIES_SCRIPT, self.link_id, self.watermark)
+        except WebDriverException:
+            # Fallback: parse the page source with the fastest available parser and skip the nodes before the watermark.
+            entries = extract_entries(self.driver.page_source, self.link_id)
+            count = len(entries)
+            entries = entries[self.watermark:]
+
+        if count < self.watermark:
+            # The page replaced its result list, start over. Already seen hrefs are skipped in _collect anyway.
+            self.watermark = 0
+            return self._new_entries()
+
+        self.watermark = count
+        return [{'href': href, 'title': title, 'view_count_text': view_count_text} for href, title, view_count_text in entries]
+
+    def _collect(self):
+        for video in self._new_entries():
+            # Raw: Href: /watch?v=82oJt2enz8A&pp=ygUPdmlkZW9nYW1lZHVua2V5"
+            href = video['href']
+            if not href or href in self.seen:
+                continue
+            self.seen.add(href)
+
+            # We don't need to check this but just making sure that we are getting a video's href. (For most cases, but sometimes the
+            # href value can be a YouTube short's link.)
+            if '/watch?v=' not in href:
+                continue
+
+            # Extract video ID and ignore timestamps or extra params like pp.
+            video_id = href.split('=')[1].split('&')[0]
+            full_url = f"https://www.youtube.com/watch?v={video_id}"
+            if full_url in self.link_set:
+                continue
+
+            if self.accept is None or self.accept(video):
+                self.links.append(full_url)
+                self.link_set.add(full_url)
+
+    def fetch(self, max_results):
+        """
+        Returns the first max_results video links of the page, scrolling only as far as needed.
+
+        Parameters:
+        - max_results: Max. number of videos to fetch
+
+        Returns:
+        - A set of video links.
+        """
+
+        self._collect()
+        while len(self.links) < max_results and not self.exhausted:
+            count = self._result_count()
+
+            # Go to bottom of the page and wait for new results to load.
+            self.driver.execute_script("window.scrollTo(0, document.documentElement.scrollHeight);")
+            if not self._wait_for_results(count, scroll_timeout):
+                logger.info("Reached the bottom of the page, no more results.")
+                self.exhausted = True
+            self._collect()
+
+        return set(self.links[:max_results])
+
+    def close(self):
+        self.driver.quit()
+
+# Open sessions by (kind, target), so the same query, channel or playlist is never loaded and scrolled twice in a run.
+_sessions = {}
+
+def get_session(key, create):
     """
-    Parses view count into integer from the search page.
+    Returns the pooled session for key, creating it with create() the first time.
 
     Parameters:
-    - view_count_text: View count of the video in text format.
+    - key: A tuple of (kind, target), like ('playlist', playlist_url).
+    - create: Function that creates the session.
 
     Returns:
-    - Parsed view_count_text(int).
+    - A DiscoverySession.
     """
 
-    # view_count_text: 15K views, 1M views, 947 views etc...
-    # Replace the 'views' part with '' and remove any left spaces with strip.
-    try:
-        view_count_text = view_count_text.replace('views', '').strip()
-        if 'K' in view_count_text:
-            return int(float(view_count_text.replace('K', '')) * 1000)
-        elif 'M' in view_count_text:
-            return int(float(view_count_text.replace('M', '')) * 1000000)
-        else:
-            return int(view_count_text)
-    except ValueError:
-        return 0
+    if key not in _sessions:
+        _sessions[key] = create()
+    return _sessions[key]
+
+def close_sessions():
+    """
+    Closes every pooled discovery session, browser and HTTP.
+    """
+
+    for session in _sessions.values():
+        session.close()
+    _sessions.clear()
+    http_discovery.close_sessions()
 
 def get_video_links(search_query, target_nationality, max_results=5, min_view_count=1000):
     """
-    Gets the video links from YouTube search page.
+    Gets the video links from YouTube search page. The browser session is kept open, calling it again with a bigger max_results
+    continues from where it stopped.
 
     Parameters:
     - search_query: Search query for Youtube
@@ -124,89 +372,22 @@ def get_video_links(search_query, target_nationality, max_results=5, min_view_co
     - A set of video links.
     """
 
-    # Initialize the WebDriver
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.get('https://www.youtube.com')
-
-    # Get the input element with name attribute set to 'search_query', send the query, press enter.
-    search_box = driver.find_element(By.NAME, 'search_query')
-    search_box.send_keys(search_query)
-    search_box.send_keys(Keys.RETURN)
+    if discovery_backend == 'http':
+        return http_discovery.get_video_links(search_query, target_nationality, max_results=max_results, min_view_count=min_view_count)
 
-    # Wait for the page to load
-    time.sleep(5)  
-
-    video_links = set()
-    last_height = driver.execute_script("return document.documentElement.scrollHeight")
-
-    while len(video_links) < max_results:
-        # Extract video links from the current page using soup, default usage.
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-
-        # Find video links on the current page
-        # Find all the elements with id="video-title".
-        # Or use this as id=media-item-metadata (only available if you use the mobile version m.youtube.com )
-        # a tags that have thumbnail or video-title id are useful.
-        for video in soup.find_all(id="video-title"):
-            # Raw: Href: /watch?v=82oJt2enz8A&pp=ygUPdmlkZW9nYW1lZHVua2V5"
-            # Get the href attribute's value.
-            href = video['href']
-            print(f'Href: {href}')
-            
-            # We don't need to check this but just making sure that we are getting a video's href. (For most cases, but sometimes the
-            # href value can be a YouTube short's link.)
-            if '/watch?v=' in href:
-                # Extract video ID and ignore timestamps or extra params like pp.
-                video_id = href.split('=')[1].split('&')[0]  
-                full_url = f"https://www.youtube.com/watch?v={video_id}"
-
-                # Check the title for the target nationality
-                # If there's no title, title=''
-                title = video.get('title', '')
-                print(f'Title: {title}')
-                if check_title_for_nationality(title, target_nationality):
-                    # To check the view count of the video, we first find the parent div element that have 'meta' as id. This div elements 
-                    # includes the span element that we can get the view count from.
-                    parent_div = video.find_parent(id="meta")
-                    if parent_div:
-                        view_count_span = parent_div.find('span', class_='inline-metadata-item')
-                        print(f'View count span: {view_count_span}')
-                        print(f'View count span text: {view_count_span.text}')
-                        if view_count_span:
-                            # Output:
-                            # Href: /watch?v=PUBnqS1qcvk&pp=ygUPdmlkZW9nYW1lZHVua2V5
-                            # Title: San Andreas
-                            # View count span: <span class="inline-metadata-item style-scope ytd-video-meta-block">12M views</span>
-                            # View count span text: 12M views
-                            view_count = parse_view_count(view_count_span.text)
-                            # Only getting the videos that have at least 1K views.
-                            if view_count >= min_view_count:
-                                video_links.add(full_url)
-                                if len(video_links) >= max_results:
-                                    break
-
-        # If there are enough video links founded, stop scrolling.
-        if len(video_links) >= max_results:
-            break
-        else:
-            # Go to bottom of the page.
-            driver.execute_script("window.scrollTo(0, document.documentElement.scrollHeight);")
-            # Wait for new results to load
-            time.sleep(3)  
-
-            # Get new height and check if it's changed.
-            new_height = driver.execute_script("return document.documentElement.scrollHeight")
-            if new_height == last_height:
-                print("Reached the bottom of the page, no more results.")
-                break
-            last_height = new_height
-
-    driver.quit()
-    return video_links
+    # Find all the elements with id="video-title".
+    # Or use this as id=media-item-metadata (only available if you use the mobile version m.youtube.com )
+    session = get_session(
+        ('search', search_query, target_nationality, min_view_count),
+        lambda: DiscoverySession('https://www.youtube.com', 'video-title', accept=search_filter(target_nationality, min_view_count),
+                                 search_query=search_query)
+    )
+    return session.fetch(max_results)
 
 def get_videos_from_channel(channel_url, max_results=5):
     """
-    Fetches video links from a specific YouTube channel.
+    Fetches video links from a specific YouTube channel. The browser session is kept open, calling it again with a bigger
+    max_results continues from where it stopped.
 
     Parameters:
     - channel_url: The URL of the YouTube channel.
@@ -214,49 +395,19 @@ def get_videos_from_channel(channel_url, max_results=5):
     Return:
     - Set of video URLs.
     """
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.get(channel_url)
-
-    time.sleep(5)
-
-    video_links = set()
-    last_height = driver.execute_script("return document.documentElement.scrollHeight")
-
-    while len(video_links) < max_results:
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-
-        for video in soup.find_all(id="video-title-link"):
-            href = video['href']
-            print(f'Href: {href}')
-            # Output:
-            # Href: /watch?v=ZlxIMlaQxww
-            if '/watch?v=' in href:
-                video_id = href.split('=')[1].split('&')[0]
-                full_url = f"https://www.youtube.com/watch?v={video_id}"
-                
-                video_links.add(full_url)
-                if len(video_links) >= max_results:
-                    break
-
-        
-        if len(video_links) >= max_results:
-            break
-        else:
-            driver.execute_script("window.scrollTo(0, document.documentElement.scrollHeight);")
-            time.sleep(3)
 
-            new_height = driver.execute_script("return document.documentElement.scrollHeight")
-            if new_height == last_height:
-                print("Reached the bottom of the page, no more results.")
-                break
-            last_height = new_height
+    if discovery_backend == 'http':
+        return http_discovery.get_videos_from_channel(channel_url, max_results=max_results)
 
-    driver.quit()
-    return video_links
+    # Output:
+    # Href: /watch?v=ZlxIMlaQxww
+    session = get_session(('channel', channel_url), lambda: DiscoverySession(channel_url, 'video-title-link'))
+    return session.fetch(max_results)
 
 def get_videos_from_playlist(playlist_url, max_results=5):
     """
-    Fetches video links from a specific YouTube playlist.
+    Fetches video links from a specific YouTube playlist. The browser session is kept open, calling it again with a bigger
+    max_results continues from where it stopped.
 
     Parameters:
     - channel_url: The URL of the YouTube playlist.
@@ -265,69 +416,18 @@ def get_videos_from_playlist(playlist_url, max_results=5):
     - Set of video URLs.
     """
 
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.get(playlist_url)
-
-    time.sleep(5)
+    if discovery_backend == 'http':
+        return http_discovery.get_videos_from_playlist(playlist_url, max_results=max_results)
 
-    video_links = set()
-    last_height = driver.execute_script("return document.documentElement.scrollHeight")
-
-    while len(video_links) < max_results:
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-
-        for video in soup.find_all(id="video-title"):
-            href = video['href']
-            print(f'Href: {href}')
-            # Output:
-            # Href: /watch?v=KuvDsT4sRzU&list=PLMBTl5yXyrGRl2_kwa3tB2imqkb08_KvD&index=1&pp=iAQB
-            if '/watch?v=' in href:
-                video_id = href.split('=')[1].split('&')[0]
-                full_url = f"https://www.youtube.com/watch?v={video_id}"
-                
-                video_links.add(full_url)
-                if len(video_links) >= max_results:
-                    break
-
-        if len(video_links) >= max_results:
-            break
-        else:
-            driver.execute_script("window.scrollTo(0, document.documentElement.scrollHeight);")
-            time.sleep(3)
-
-            new_height = driver.execute_script("return document.documentElement.scrollHeight")
-            if new_height == last_height:
-                print("Reached the bottom of the page, no more results.")
-                break
-            last_height = new_height
-
-    driver.quit()
-    return video_links
-
-
-def download_audio(video_url, accent_type, output_base_dir='audio_files'):
-    # Create a folder with the accent type if it doesn't exist
-    output_dir = os.path.join(output_base_dir, accent_type)
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    # Using pytubefix, pytube is not working for some reason. (Default usage)
-    try:
-        yt = YouTube(video_url, on_progress_callback=on_progress)
-        stream = yt.streams.get_audio_only()
-
-        cleaned_title = clean_title(yt.title)
-
-        file_path = stream.download(mp3=True, output_path=output_dir, filename=cleaned_title)
-        print(f"Downloaded and saved audio to: {file_path}")
-        return file_path
-    except Exception as e:
-        print(f"Error downloading audio: {e}")
-        return None
+    # Output:
+    # Href: /watch?v=KuvDsT4sRzU&list=PLMBTl5yXyrGRl2_kwa3tB2imqkb08_KvD&index=1&pp=iAQB
+    session = get_session(('playlist', playlist_url), lambda: DiscoverySession(playlist_url, 'video-title'))
+    return session.fetch(max_results)
 
 def main():
-     # Load previously downloaded videos
-    downloaded_videos = load_downloaded_videos()
+    # Load previously downloaded videos
+    state = open_state_store()
+    downloaded_videos = load_downloaded_videos(state)
     
     # Search term for the videos
     accent_type = "Scottish"
@@ -341,6 +441,10 @@ def main():
     playlist_url = 'https://www.youtube.com/playlist?list=PLCb8I5QEcjJWkanzPMWnyoxSICelVHnsa'
     # Max. number of new videos to download.
     max_new_videos = 1
+    # Max. number of downloads at the same time.
+    max_downloads = 4
+    # Decode the downloads straight into 16 kHz mono wav files, the cleaner takes them as they are. 'mp3' saves the streams instead.
+    ingest = 'wav'
     # Initial max. results to fetch.
     max_results = 5
     # Video count for each run until we reach the max_nex_videos.
@@ -350,33 +454,47 @@ def main():
     while new_videos_count < max_new_videos:
         # Fetch a new set of video links
         video_links = get_videos_from_playlist(playlist_url, max_results=max_results)
-        print(f"Found {len(video_links)} video links.")
+        logger.info("Found %d video links.", len(video_links))
         
-        # Process each video URL
-        for video_url in video_links:
-            if video_url not in downloaded_videos:
-                print(f"Processing new video: {video_url}")
-
-                # Download audio for the video
-                download_audio(video_url, accent_type)
-
-                # Save the video URL
-                save_downloaded_video(video_url)
-                # Add the video URL to the set, to use on this runtime.
-                downloaded_videos.add(video_url)  
-                new_videos_count += 1
-                
-                if new_videos_count >= max_new_videos:
-                    break
+        # Only the new videos, no more than we still need.
+        new_links = [video_url for video_url in sorted(video_links) if video_url not in downloaded_videos]
+        new_links = new_links[:max_new_videos - new_videos_count]
+
+        # Add the video URLs to the set, to use on this runtime. A failed download isn't tried again on this run, it's saved as
+        # failed with its reason, so the next run tries it again.
+        downloaded_videos.update(new_links)
+
+        # Download audio for the videos, only the completed downloads are saved. They're saved with the playlist they were found
+        # on, so the cleaner can reuse one noise profile for all of them.
+        results = download_all(new_links, accent_type, max_workers=max_downloads, ingest=ingest,
+                               on_success=lambda video_url, file_path: save_downloaded_video(state, video_url, accent_type, file_path,
+                                                                                             origin=playlist_url))
+        for video_url, (file_path, error) in results.items():
+            if error is not None:
+                state.record_failure(video_url, error, accent_type=accent_type)
+                metrics.count('failures', stage='download')
+            else:
+                metrics.count('files', stage='download')
+        new_videos_count += sum(1 for file_path, error in results.values() if error is None)
         
+        # The page has no more results, asking again wouldn't find anything new.
+        if new_videos_count < max_new_videos and len(video_links) < max_results:
+            logger.info("No more videos on the page. (New videos founded on this run: %d)", new_videos_count)
+            break
+
         if new_videos_count < max_new_videos:
-            print(f"Not enough new videos found, trying again... (New videos founded on this run: {new_videos_count})")
-            time.sleep(5)
+            logger.info("Not enough new videos found, trying again... (New videos founded on this run: %d)", new_videos_count)
 
-            # Increase max_results for the next iteration to fetch more videos.
+            # Increase max_results for the next iteration to fetch more videos. The session continues scrolling from where it
+            # stopped, only the new results are loaded.
             max_results += 10
         else:
-            print(f"Downloaded {new_videos_count} new videos.")
+            logger.info("Downloaded %d new videos.", new_videos_count)
+
+    close_sessions()
+    state.close()
+    metrics.report()
 
 if __name__ == "__main__":
+    metrics.configure(level='INFO', textfile="pipeline_metrics.prom")
     main()
\ No newline at end of file
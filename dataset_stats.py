@@ -0,0 +1,348 @@
+from concurrent.futures import ProcessPoolExecutor
+from feature_store import FeatureStore, FRAMES_INDEX, INDEX_FILE
+from metrics import get_logger, log_event
+import metrics
+import logging
+import argparse
+import json
+import numpy as np
+import pandas as pd
+import os
+
+# Statistics of the extracted features, computed in one pass over the segments without loading them all: the number of segments
+# and the duration of every accent type, the mean, variance, min and max of every feature row (MFCC coefficient) over all the
+# frames, and a histogram of the frame counts of the segments.
+#
+# The mean and the variance are running aggregates (Welford): every segment is reduced to its own count, mean and sum of squared
+# differences, and added to the totals with the parallel update of Chan et al. The same update merges the aggregates of two
+# shards, so the statistics can be computed by several processes (or machines, with --shard and --merge) and merged afterwards, and
+# only one segment is ever in memory.
+#
+# The input is either the csv output of extract_and_save_mfcc (one folder for each accent type) or a feature store.
+#
+# python dataset_stats.py features --output dataset_stats.json --workers 4
+# python dataset_stats.py features --output stats_0.json --shard 0 --shards 2
+# python dataset_stats.py --merge stats_0.json stats_1.json --output dataset_stats.json
+
+logger = get_logger('dataset_stats')
+
+class FeatureStats:
+    """
+    Running statistics of the features of one accent type.
+
+    Parameters:
+    - rows: Number of feature rows (MFCC coefficients), None until the first segment is added.
+    """
+
+    def __init__(self, rows=None):
+        self.segments = 0
+        self.frames = 0
+        # Frame count -> number of segments
+        self.frame_counts = {}
+        self.rows = None
+        self.mean = self.m2 = self.min = self.max = None
+        if rows is not None:
+            self._allocate(rows)
+
+    def _allocate(self, rows):
+        self.rows = rows
+        self.mean = np.zeros(rows)
+        # Sum of the squared differences from the mean of every row.
+        self.m2 = np.zeros(rows)
+        self.min = np.full(rows, np.inf)
+        self.max = np.full(rows, -np.inf)
+
+    def _combine(self, frames, mean, m2):
+        # Parallel Welford update, the totals and a batch of frames with its own mean and m2.
+        total = self.frames + frames
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (frames / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.frames * frames / total)
+        self.frames = total
+
+    def add(self, features):
+        """
+        Adds the features of one segment.
+
+        Parameters:
+        - features: 2D array (rows x frames)
+        """
+
+        features = np.asarray(features, dtype=np.float64)
+        rows, frames = features.shape
+        if self.rows is None:
+            self._allocate(rows)
+        elif rows != self.rows:
+            raise ValueError(f"Segment has {rows} feature rows, the others have {self.rows}")
+
+        self.segments += 1
+        self.frame_counts[frames] = self.frame_counts.get(frames, 0) + 1
+        if frames == 0:
+            return
+
+        mean = features.mean(axis=1)
+        self._combine(frames, mean, np.square(features - mean[:, None]).sum(axis=1))
+        self.min = np.minimum(self.min, features.min(axis=1))
+        self.max = np.maximum(self.max, features.max(axis=1))
+
+    def merge(self, other):
+        """
+        Adds the statistics of another shard of the same accent type.
+        """
+
+        if other.rows is None:
+            return
+        if self.rows is None:
+            self._allocate(other.rows)
+        elif other.rows != self.rows:
+            raise ValueError(f"Can't merge statistics of {other.rows} and {self.rows} feature rows")
+
+        self.segments += other.segments
+        for frames, segments in other.frame_counts.items():
+            self.frame_counts[frames] = self.frame_counts.get(frames, 0) + segments
+        if other.frames:
+            self._combine(other.frames, other.mean, other.m2)
+            self.min = np.minimum(self.min, other.min)
+            self.max = np.maximum(self.max, other.max)
+
+    @property
+    def variance(self):
+        # Population variance over all the frames.
+        return self.m2 / self.frames if self.frames else np.zeros_like(self.m2)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def seconds(self, sample_rate=16000, hop_length=512):
+        """
+        Returns the total duration of the segments (in seconds), from their frame counts. With librosa's centered frames a segment
+        of n samples has 1 + n // hop_length frames, so it's exact to one hop.
+        """
+
+        return sum(max(frames - 1, 0) * segments for frames, segments in self.frame_counts.items()) * hop_length / sample_rate
+
+    def to_dict(self):
+        return {
+            'segments': self.segments,
+            'frames': self.frames,
+            'rows': self.rows,
+            'mean': None if self.mean is None else self.mean.tolist(),
+            'm2': None if self.m2 is None else self.m2.tolist(),
+            'min': None if self.min is None else self.min.tolist(),
+            'max': None if self.max is None else self.max.tolist(),
+            'frame_counts': {str(frames): segments for frames, segments in sorted(self.frame_counts.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(data['rows'])
+        stats.segments = data['segments']
+        stats.frames = data['frames']
+        if stats.rows is not None:
+            stats.mean, stats.m2, stats.min, stats.max = (np.array(data[key], dtype=np.float64) for key in ('mean', 'm2', 'min', 'max'))
+        stats.frame_counts = {int(frames): segments for frames, segments in data['frame_counts'].items()}
+        return stats
+
+class DatasetStats:
+    """
+    Statistics of the features of every accent type.
+
+    Parameters:
+    - sample_rate: Sampling rate the features were extracted at, for the durations.
+    - hop_length: Number of samples between frames, for the durations.
+    """
+
+    def __init__(self, sample_rate=16000, hop_length=512):
+        self.sample_rate = sample_rate
+        self.hop_length = hop_length
+        self.classes = {}
+
+    def add(self, accent_type, features):
+        """
+        Adds the features of one segment.
+
+        Parameters:
+        - accent_type: Accent type of the segment
+        - features: 2D array (rows x frames)
+        """
+
+        self.classes.setdefault(accent_type, FeatureStats()).add(features)
+
+    def merge(self, other):
+        """
+        Adds the statistics of another shard.
+        """
+
+        if (other.sample_rate, other.hop_length) != (self.sample_rate, self.hop_length):
+            raise ValueError("Can't merge statistics of features extracted with different sampling rates or hop lengths")
+        for accent_type, stats in other.classes.items():
+            self.classes.setdefault(accent_type, FeatureStats()).merge(stats)
+        return self
+
+    def total(self):
+        """
+        Returns:
+        - The FeatureStats of all the accent types together.
+        """
+
+        total = FeatureStats()
+        for accent_type in sorted(self.classes):
+            total.merge(self.classes[accent_type])
+        return total
+
+    def normalization(self, accent_type=None):
+        """
+        Returns the mean and the standard deviation of every feature row, to normalize the features with (x - mean) / std.
+
+        Parameters:
+        - accent_type: Statistics of this accent type only, all of them by default.
+
+        Returns:
+        - A tuple of (mean, std), 1D arrays.
+        """
+
+        stats = self.total() if accent_type is None else self.classes[accent_type]
+        return stats.mean, stats.std
+
+    def balance_report(self):
+        """
+        Returns:
+        - A DataFrame with the number of segments, the share of the segments, the duration in hours and the frame counts of every
+          accent type, the README table.
+        """
+
+        segments = sum(stats.segments for stats in self.classes.values())
+        rows = []
+        for accent_type in sorted(self.classes):
+            stats = self.classes[accent_type]
+            frame_counts = sorted(stats.frame_counts)
+            rows.append({
+                'accent_type': accent_type,
+                'segments': stats.segments,
+                'share': round(stats.segments / segments, 4) if segments else 0.0,
+                'hours': round(stats.seconds(self.sample_rate, self.hop_length) / 3600, 3),
+                'min_frames': frame_counts[0] if frame_counts else 0,
+                'max_frames': frame_counts[-1] if frame_counts else 0,
+            })
+        return pd.DataFrame(rows, columns=['accent_type', 'segments', 'share', 'hours', 'min_frames', 'max_frames'])
+
+    def save(self, path):
+        """
+        Saves the statistics as a json file. It's written to a temp file first so a crash never leaves a half written file behind.
+        """
+
+        data = {'sample_rate': self.sample_rate, 'hop_length': self.hop_length,
+                'classes': {accent_type: self.classes[accent_type].to_dict() for accent_type in sorted(self.classes)}}
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        stats = cls(data['sample_rate'], data['hop_length'])
+        stats.classes = {accent_type: FeatureStats.from_dict(item) for accent_type, item in data['classes'].items()}
+        return stats
+
+def list_segments(input_dir):
+    """
+    Lists the segments of a feature folder, sorted so every shard sees the same order.
+
+    Parameters:
+    - input_dir: Path to the csv output of extract_and_save_mfcc, or to a feature store.
+
+    Returns:
+    - A list of (accent_type, item) tuples, item is the path of the csv file or the key in the store. The frame sequences of whole
+      files (FRAMES_INDEX) are left out, their frames are the same as the segments'.
+    """
+
+    if os.path.exists(os.path.join(input_dir, INDEX_FILE)):
+        return [(key[0], key) for key in sorted(FeatureStore(input_dir).keys()) if key[2] != FRAMES_INDEX]
+
+    segments = []
+    for accent_type in sorted(os.listdir(input_dir)):
+        accent_dir = os.path.join(input_dir, accent_type)
+        if not os.path.isdir(accent_dir):
+            continue
+        segments += [(accent_type, os.path.join(accent_dir, file)) for file in sorted(os.listdir(accent_dir)) if file.endswith('.csv')]
+    return segments
+
+def _stats_task(task):
+    input_dir, shard, shards, sample_rate, hop_length = task
+    stats = DatasetStats(sample_rate, hop_length)
+    store = FeatureStore(input_dir) if os.path.exists(os.path.join(input_dir, INDEX_FILE)) else None
+
+    for accent_type, item in list_segments(input_dir)[shard::shards]:
+        with metrics.timer('stats.read'):
+            # Only one segment is loaded at a time, the store's are views of the memory-mapped file.
+            features = store.get(*item) if store is not None else pd.read_csv(item).to_numpy(dtype=np.float64)
+        with metrics.timer('stats.aggregate'):
+            stats.add(accent_type, features)
+        metrics.count('segments', stage='stats')
+
+    return stats, metrics.collect()
+
+def compute_stats(input_dir, shard=0, shards=1, workers=None, sample_rate=16000, hop_length=512):
+    """
+    Computes the statistics of a feature folder in one pass.
+
+    Parameters:
+    - input_dir: Path to the csv output of extract_and_save_mfcc, or to a feature store.
+    - shard: Index of the shard to compute, the segments shard, shard + shards, shard + 2 * shards... of list_segments.
+    - shards: Number of shards the segments are split into, to run on several machines and merge with DatasetStats.merge.
+    - workers: Number of worker processes, the shard is split between them. os.cpu_count() by default, 1 runs in this process.
+    - sample_rate: Sampling rate the features were extracted at.
+    - hop_length: Number of samples between frames.
+
+    Returns:
+    - A DatasetStats.
+    """
+
+    workers = workers or os.cpu_count() or 1
+    # Shard k of n split between w workers is shards k, k + n, ..., k + (w - 1) * n of n * w.
+    tasks = [(input_dir, shard + worker * shards, shards * workers, sample_rate, hop_length) for worker in range(workers)]
+
+    stats = DatasetStats(sample_rate, hop_length)
+    if workers == 1:
+        results = map(_stats_task, tasks)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=metrics.init_worker, initargs=(metrics.is_enabled(),))
+        results = executor.map(_stats_task, tasks)
+    try:
+        for worker_stats, collected in results:
+            metrics.merge(collected)
+            stats.merge(worker_stats)
+    finally:
+        if workers > 1:
+            executor.shutdown()
+
+    log_event(logger, logging.INFO, "stats computed", input=input_dir, shard=shard, shards=shards,
+              segments=sum(item.segments for item in stats.classes.values()), classes=len(stats.classes))
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Computes per-class statistics of the extracted features in one pass.")
+    parser.add_argument('input_dir', nargs='?', default='features', help="Feature csv folder or feature store")
+    parser.add_argument('--output', default='dataset_stats.json', help="Path to save the statistics json file")
+    parser.add_argument('--workers', type=int, help="Worker processes")
+    parser.add_argument('--shard', type=int, default=0, help="Index of the shard to compute")
+    parser.add_argument('--shards', type=int, default=1, help="Number of shards")
+    parser.add_argument('--merge', nargs='+', help="Merge these statistics json files instead of reading the features")
+    parser.add_argument('--sample-rate', type=int, default=16000, help="Sampling rate the features were extracted at")
+    parser.add_argument('--hop-length', type=int, default=512, help="Number of samples between frames")
+    args = parser.parse_args()
+
+    metrics.configure(level='INFO', textfile="pipeline_metrics.prom")
+    if args.merge:
+        stats = DatasetStats.load(args.merge[0])
+        for path in args.merge[1:]:
+            stats.merge(DatasetStats.load(path))
+    else:
+        stats = compute_stats(args.input_dir, shard=args.shard, shards=args.shards, workers=args.workers,
+                              sample_rate=args.sample_rate, hop_length=args.hop_length)
+    stats.save(args.output)
+
+    print(stats.balance_report().to_string(index=False))
+    metrics.report()
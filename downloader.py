@@ -0,0 +1,316 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.error import HTTPError, URLError
+import urllib.request
+import http.client
+import subprocess
+import logging
+import socket
+import time
+import os
+import re
+from metrics import get_logger, log_event
+import metrics
+
+logger = get_logger('downloader')
+
+# Concurrent audio downloader. Each video is resolved to its audio stream URL with pytubefix and the stream is downloaded with plain
+# HTTP range requests:
+# - The bytes go to {file}.part first, the file gets its real name (atomic rename) only when it's complete, so a crash never leaves a
+#   half file that looks finished.
+# - If a .part file is already there, the download continues from its size instead of starting over.
+# - Network errors are retried with exponential backoff, the stream URL is resolved again on each attempt since it expires.
+# Downloads run on a thread pool, they spend their time waiting on the network so threads are enough.
+#
+# resolve is a parameter everywhere, so the engine can be run against a local HTTP server that serves fixture audio files instead of
+# YouTube.
+#
+# With ingest='wav' the stream isn't saved at all: the bytes are piped into ffmpeg as they arrive, and ffmpeg writes the 16 kHz mono
+# wav file that cleaner.py would otherwise make from the mp3. That's one decode instead of download -> decode -> resample, and no
+# full-rate source file on disk. The source can still be kept next to it (keep_source). A decode can't continue from the middle of
+# a stream, so a failed wav download starts over on the next attempt.
+
+def clean_title(title):
+    """
+    Removes invalid characters from the title to download the audio with no special character errors.
+
+    Parameters:
+    - title: The title of the YouTube video.
+
+    Returns:
+    - Cleaned title.
+    """
+
+    # Replace the special characters with '' in the title.
+    cleaned_title = re.sub(r'[<>:"/\\|?*]', '', title)
+    return cleaned_title
+
+def resolve_audio_stream(video_url):
+    """
+    Resolves a YouTube video to its audio-only stream.
+
+    Parameters:
+    - video_url: The URL of the YouTube video.
+
+    Returns:
+    - A tuple of (cleaned title, stream URL, file size in bytes or None).
+    """
+
+    # Imported here so the download engine can be used (and tested) without pytubefix.
+    from pytubefix import YouTube
+
+    yt = YouTube(video_url)
+    stream = yt.streams.get_audio_only()
+    return clean_title(yt.title), stream.url, stream.filesize
+
+class IncompleteDownload(Exception):
+    """
+    The connection was closed before the whole file was received.
+    """
+
+def is_retryable(error):
+    """
+    Checks if a download error is worth another attempt.
+
+    Parameters:
+    - error: The exception raised by the download.
+
+    Returns:
+    - True or False.
+    """
+
+    # Client errors (404, 403...) won't go away by themselves, except timeouts and rate limiting.
+    if isinstance(error, HTTPError):
+        return error.code >= 500 or error.code in (408, 429)
+    return isinstance(error, (URLError, socket.timeout, ConnectionError, http.client.HTTPException, IncompleteDownload))
+
+def download_file(url, destination, expected_size=None, chunk_size=1 << 16, timeout=30):
+    """
+    Downloads a URL to destination, resuming from destination.part if it exists.
+
+    Parameters:
+    - url: The URL of the file.
+    - destination: Path to save the file.
+    - expected_size: Size of the file in bytes, if it's known.
+    - chunk_size: Number of bytes read at a time.
+    - timeout: Socket timeout in seconds.
+
+    Returns:
+    - destination.
+    """
+
+    part_file = destination + '.part'
+    offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+
+    if expected_size is None or offset < expected_size:
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        try:
+            response = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout)
+        except HTTPError as e:
+            # 416: nothing left after offset. The .part file is either complete or bigger than the file, size check below decides.
+            if e.code != 416 or not offset:
+                raise
+            response = None
+
+        if response is not None:
+            with response:
+                # The server may ignore the range and send the whole file, then we start over.
+                if offset and response.status != 206:
+                    offset = 0
+
+                # Total size from Content-Range (bytes start-end/total) or Content-Length.
+                content_range = response.headers.get('Content-Range', '')
+                if expected_size is None and '/' in content_range and not content_range.endswith('*'):
+                    expected_size = int(content_range.rsplit('/', 1)[1])
+                elif expected_size is None and response.headers.get('Content-Length') is not None:
+                    expected_size = offset + int(response.headers['Content-Length'])
+
+                with open(part_file, 'ab' if offset else 'wb') as f:
+                    while True:
+                        chunk = response.read(chunk_size)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+
+    size = os.path.getsize(part_file)
+    if expected_size is not None and size != expected_size:
+        if size > expected_size:
+            # The .part file doesn't belong to this file, start over on the next attempt.
+            os.remove(part_file)
+        raise IncompleteDownload(f"Received {size} of {expected_size} bytes for {destination}")
+
+    os.replace(part_file, destination)
+    return destination
+
+def download_to_wav(url, destination, sample_rate=16000, source_file=None, chunk_size=1 << 16, timeout=30):
+    """
+    Downloads a URL and decodes it on the fly into a mono wav file, without saving the stream itself.
+
+    Parameters:
+    - url: The URL of the audio stream.
+    - destination: Path to save the wav file.
+    - sample_rate: Sampling rate of the wav file ( 16Khz by default, same as cleaner.py. )
+    - source_file: If given, the downloaded bytes are saved to this path as well.
+    - chunk_size: Number of bytes read at a time.
+    - timeout: Socket timeout in seconds.
+
+    Returns:
+    - destination.
+    """
+
+    # Imported here, like pytubefix, so the mp3 downloads don't need pydub. pydub's converter is the ffmpeg cleaner.py uses.
+    from pydub import AudioSegment
+
+    part_file = destination + '.part'
+    source_part_file = source_file + '.part' if source_file is not None else None
+    command = [AudioSegment.converter, '-v', 'error', '-y', '-i', 'pipe:0', '-ac', '1', '-ar', str(sample_rate), '-acodec', 'pcm_s16le',
+               '-f', 'wav', part_file]
+
+    process = None
+    completed = False
+    try:
+        response = urllib.request.urlopen(url, timeout=timeout)
+        with response:
+            expected_size = response.headers.get('Content-Length')
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+            source = open(source_part_file, 'wb') if source_file is not None else None
+            received = 0
+            try:
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                    process.stdin.write(chunk)
+                    if source is not None:
+                        source.write(chunk)
+            except BrokenPipeError:
+                # ffmpeg stopped reading, its error message is read below.
+                pass
+            finally:
+                if source is not None:
+                    source.close()
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+            error = process.stderr.read().decode('utf-8', 'ignore')
+            returncode = process.wait()
+
+        if expected_size is not None and received != int(expected_size):
+            raise IncompleteDownload(f"Received {received} of {expected_size} bytes for {destination}")
+        if returncode != 0:
+            raise RuntimeError(f"Decoding {url} failed: {error}")
+
+        os.replace(part_file, destination)
+        if source_file is not None:
+            os.replace(source_part_file, source_file)
+        completed = True
+        return destination
+    finally:
+        if process is not None:
+            # ffmpeg is still running if the download failed while it was reading, it's stopped so it doesn't outlive the attempt.
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stderr.close()
+        if not completed:
+            # A decode can't continue from the middle of a stream, so nothing of a failed attempt is kept.
+            for path in (part_file, source_part_file):
+                if path is not None and os.path.exists(path):
+                    os.remove(path)
+
+def download_with_retries(video_url, output_dir, retries=3, backoff=1.0, resolve=resolve_audio_stream, sleep=time.sleep, ingest='mp3',
+                          keep_source=False):
+    """
+    Downloads the audio of a video, retrying the network errors with exponential backoff.
+
+    Parameters:
+    - video_url: The URL of the YouTube video.
+    - output_dir: Path to save the audio file.
+    - retries: Number of retries after the first attempt.
+    - backoff: Delay before the first retry in seconds, it doubles for every retry.
+    - resolve: Function that resolves video_url to (title, stream URL, size), resolve_audio_stream by default.
+    - sleep: Function used to wait between the attempts.
+    - ingest: 'mp3' saves the stream as it is, 'wav' decodes it on the fly into a 16 kHz mono wav file (download_to_wav).
+    - keep_source: With ingest='wav', also save the stream into {output_dir}/source, where the cleaner doesn't look for files.
+
+    Returns:
+    - Path of the downloaded file.
+    """
+
+    for attempt in range(retries + 1):
+        try:
+            title, stream_url, size = resolve(video_url)
+
+            if ingest == 'wav':
+                destination = os.path.join(output_dir, f"{title}.wav")
+                if os.path.exists(destination):
+                    return destination
+                source_file = None
+                if keep_source:
+                    os.makedirs(os.path.join(output_dir, 'source'), exist_ok=True)
+                    source_file = os.path.join(output_dir, 'source', f"{title}.mp3")
+                return download_to_wav(stream_url, destination, source_file=source_file)
+
+            # Same name as stream.download(mp3=True, filename=cleaned_title), so cleaner.py finds the files.
+            destination = os.path.join(output_dir, f"{title}.mp3")
+            if os.path.exists(destination):
+                return destination
+            return download_file(stream_url, destination, expected_size=size)
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            delay = backoff * 2 ** attempt
+            log_event(logger, logging.WARNING, "download retry", url=video_url, error=str(e), delay=round(delay, 1))
+            metrics.count('retries', stage='download')
+            sleep(delay)
+
+def download_all(video_urls, accent_type, output_base_dir='audio_files', max_workers=4, retries=3, backoff=1.0,
+                 resolve=resolve_audio_stream, on_success=None, ingest='mp3', keep_source=False):
+    """
+    Downloads the audio of many videos concurrently.
+
+    Parameters:
+    - video_urls: The URLs of the YouTube videos.
+    - accent_type: Accent type of the videos, the files are saved into {output_base_dir}/{accent_type}.
+    - output_base_dir: Path to the audio dataset.
+    - max_workers: Maximum number of downloads at the same time.
+    - retries: Number of retries for each video.
+    - backoff: Delay before the first retry in seconds, it doubles for every retry.
+    - resolve: Function that resolves a video URL to (title, stream URL, size), resolve_audio_stream by default.
+    - on_success: Called as on_success(video_url, file_path) for every completed download, from the calling thread, so it doesn't
+      need to be thread-safe.
+    - ingest: 'mp3' saves the streams as they are, 'wav' decodes them on the fly into 16 kHz mono wav files.
+    - keep_source: With ingest='wav', also save the streams into {output_base_dir}/{accent_type}/source.
+
+    Returns:
+    - A dictionary of video_url -> (file_path, error). file_path is None if the download failed, error is None if it succeeded.
+    """
+
+    # Create a folder with the accent type if it doesn't exist
+    output_dir = os.path.join(output_base_dir, accent_type)
+    os.makedirs(output_dir, exist_ok=True)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(download_with_retries, video_url, output_dir, retries=retries, backoff=backoff, resolve=resolve,
+                            ingest=ingest, keep_source=keep_source): video_url
+            for video_url in video_urls
+        }
+        for future in as_completed(futures):
+            video_url = futures[future]
+            try:
+                file_path = future.result()
+            except Exception as e:
+                results[video_url] = (None, f"{type(e).__name__}: {e}")
+                log_event(logger, logging.WARNING, "download failed", url=video_url, error=str(e))
+                continue
+
+            results[video_url] = (file_path, None)
+            metrics.count('bytes_written', os.path.getsize(file_path), stage='download')
+            logger.info("Downloaded and saved audio to: %s", file_path)
+            if on_success is not None:
+                on_success(video_url, file_path)
+
+    return results
@@ -0,0 +1,311 @@
+from features import frame_windows, window_frames
+import numpy as np
+import pandas as pd
+import os
+
+# Binary feature store. Instead of one csv file for every segment, the features of each accent type are appended to one contiguous
+# float32 file ({accent_type}.f32) and index.csv maps every (accent_type, source_file, segment_index) key to its offset and shape
+# in that file. The files are memory-mapped when reading, so a lookup is a view into the file, nothing is parsed or copied.
+#
+# Writing a source again replaces all of its segments (or its frame sequence), so a file that is split into fewer segments than
+# before doesn't keep its old ones. The replaced features stay in the data files until compact_store rewrites them.
+#
+# store_dir/
+#     index.csv
+#     American.f32
+#     Australian.f32
+#     ...
+
+INDEX_FILE = 'index.csv'
+INDEX_COLUMNS = ['accent_type', 'source_file', 'segment_index', 'offset', 'n_mfcc', 'frames']
+
+# Segment index of the frame sequence of a whole file (features.feature_frames). Windows of any length are cut from it when it's
+# read, see FeatureStore.windows.
+FRAMES_INDEX = -1
+
+def split_segment_name(segment_name):
+    """
+    Splits a segment name of split-audio.py into its source file and segment index.
+
+    Parameters:
+    - segment_name: Segment file name without the extension, like {file_name}_segment_{segment_count}
+
+    Returns:
+    - A tuple of (source_file, segment_index).
+    """
+
+    source_file, segment_index = segment_name.rsplit('_segment_', 1)
+    return source_file, int(segment_index)
+
+def _load_index(store_dir):
+    index_path = os.path.join(store_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return pd.DataFrame(columns=INDEX_COLUMNS)
+
+    # Source file names are titles of YouTube videos, they must stay strings whatever they look like.
+    return pd.read_csv(index_path, dtype={'accent_type': str, 'source_file': str}, keep_default_na=False)
+
+class FeatureStoreWriter:
+    """
+    Appends features to a feature store. Use it as a context manager, the index is written when it's closed.
+
+    Parameters:
+    - store_dir: Path to the feature store, it's created if it doesn't exist.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self._files = {}
+        self._rows = []
+        # (accent_type, source_file, frame sequence or not) of the sources written again.
+        self._replaced = set()
+
+    def replace(self, accent_type, source_file, frames=False):
+        """
+        Marks a source as written again: its segments that are already in the store are dropped when the writer is closed, even if
+        no new segment is added (a file that has no segments any more). add() marks the source of every segment it writes.
+
+        Parameters:
+        - accent_type: Accent type of the source
+        - source_file: Name of the source audio file
+        - frames: The frame sequence of the source (FRAMES_INDEX) instead of its segments
+        """
+
+        self._replaced.add((accent_type, source_file, bool(frames)))
+
+    def add(self, accent_type, source_file, segment_index, features):
+        """
+        Appends the features of one segment to the store.
+
+        Parameters:
+        - accent_type: Accent type of the segment
+        - source_file: Name of the source audio file of the segment
+        - segment_index: Index of the segment in the source file
+        - features: 2D array (n_mfcc x frames)
+        """
+
+        features = np.ascontiguousarray(features, dtype=np.float32)
+
+        if accent_type not in self._files:
+            self._files[accent_type] = open(os.path.join(self.store_dir, f"{accent_type}.f32"), 'ab')
+        data_file = self._files[accent_type]
+
+        # Offsets are in float32 elements, not bytes.
+        offset = data_file.tell() // 4
+        data_file.write(features.tobytes())
+
+        n_mfcc, frames = features.shape
+        self._rows.append((accent_type, source_file, int(segment_index), offset, n_mfcc, frames))
+        self.replace(accent_type, source_file, frames=int(segment_index) == FRAMES_INDEX)
+
+    def close(self):
+        """
+        Flushes the data files and writes the index. The sources written again replace all of their old segments.
+        """
+
+        for data_file in self._files.values():
+            data_file.close()
+        self._files = {}
+
+        if not self._rows and not self._replaced:
+            return
+
+        index = _load_index(self.store_dir)
+        # The frame sequence and the segments of a source are written by different stages, one doesn't replace the other.
+        keys = index[['accent_type', 'source_file', 'segment_index']].itertuples(index=False)
+        replaced = [(accent_type, source_file, int(segment_index) == FRAMES_INDEX) in self._replaced
+                    for accent_type, source_file, segment_index in keys]
+        index = index[~np.array(replaced, dtype=bool)]
+        index = pd.concat([index, pd.DataFrame(self._rows, columns=INDEX_COLUMNS)], ignore_index=True)
+        index = index.drop_duplicates(subset=['accent_type', 'source_file', 'segment_index'], keep='last')
+        index = index.sort_values(['accent_type', 'source_file', 'segment_index'])
+
+        # Write to a temp file first so a crash never leaves a half written index behind.
+        index_path = os.path.join(self.store_dir, INDEX_FILE)
+        index.to_csv(index_path + '.tmp', index=False)
+        os.replace(index_path + '.tmp', index_path)
+        self._rows = []
+        self._replaced = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def compact_store(store_dir):
+    """
+    Rewrites the data files of a feature store with only the features in the index, in index order. The features replaced by later
+    writes are appended, not overwritten, so the data files only grow until they're compacted. Don't run it while the store is
+    being written or read.
+
+    Parameters:
+    - store_dir: Path to the feature store.
+
+    Returns:
+    - Number of bytes freed.
+    """
+
+    index = _load_index(store_dir)
+    if index.empty:
+        return 0
+    index['offset'] = index['offset'].astype(np.int64)
+
+    freed = 0
+    data_files = []
+    for accent_type, rows in index.groupby('accent_type', sort=True):
+        data_path = os.path.join(store_dir, f"{accent_type}.f32")
+        data = np.memmap(data_path, dtype=np.float32, mode='r')
+        offsets = []
+        # Copied one key at a time, the data file is never in memory at once.
+        with open(data_path + '.tmp', 'wb') as f:
+            for offset, n_mfcc, frames in rows[['offset', 'n_mfcc', 'frames']].itertuples(index=False):
+                offsets.append(f.tell() // 4)
+                f.write(data[offset:offset + n_mfcc * frames].tobytes())
+            freed += data.nbytes - f.tell()
+        del data
+        index.loc[rows.index, 'offset'] = offsets
+        data_files.append(data_path)
+
+    # All the new files are complete before anything is replaced, and the index is replaced last. A crash between the renames
+    # leaves the index and the data files out of step, the features must be extracted again then.
+    index_path = os.path.join(store_dir, INDEX_FILE)
+    index.to_csv(index_path + '.tmp', index=False)
+    for data_path in data_files:
+        os.replace(data_path + '.tmp', data_path)
+    os.replace(index_path + '.tmp', index_path)
+    return freed
+
+class FeatureStore:
+    """
+    Reads features from a feature store with random access by key.
+
+    Parameters:
+    - store_dir: Path to the feature store.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.index = _load_index(store_dir)
+        # Key -> (offset, n_mfcc, frames), a dict lookup is much cheaper than going through the DataFrame for every read.
+        self._locations = {
+            (accent_type, source_file, int(segment_index)): (int(offset), int(n_mfcc), int(frames))
+            for accent_type, source_file, segment_index, offset, n_mfcc, frames in self.index[INDEX_COLUMNS].itertuples(index=False)
+        }
+        self._data = {}
+
+    def _array(self, accent_type):
+        # Memory-map the data file of the accent type once, the OS loads only the pages we read.
+        if accent_type not in self._data:
+            self._data[accent_type] = np.memmap(os.path.join(self.store_dir, f"{accent_type}.f32"), dtype=np.float32, mode='r')
+        return self._data[accent_type]
+
+    def keys(self):
+        """
+        Returns:
+        - A list of the (accent_type, source_file, segment_index) keys of the segments, in index order. The frame sequences aren't
+          segments, see frame_sources.
+        """
+
+        return [key for key in self._locations if key[2] != FRAMES_INDEX]
+
+    def frame_sources(self):
+        """
+        Returns:
+        - A list of the (accent_type, source_file) of the files that have a frame sequence, in index order.
+        """
+
+        return [key[:2] for key in self._locations if key[2] == FRAMES_INDEX]
+
+    def accent_types(self):
+        """
+        Returns:
+        - A sorted list of the accent types in the store.
+        """
+
+        return sorted(self.index['accent_type'].unique())
+
+    def get(self, accent_type, source_file, segment_index):
+        """
+        Reads the features of one segment without copying them.
+
+        Parameters:
+        - accent_type: Accent type of the segment
+        - source_file: Name of the source audio file of the segment
+        - segment_index: Index of the segment in the source file
+
+        Returns:
+        - Read-only 2D array (n_mfcc x frames), a view of the memory-mapped data file.
+        """
+
+        offset, n_mfcc, frames = self._locations[(accent_type, source_file, int(segment_index))]
+        return self._array(accent_type)[offset:offset + n_mfcc * frames].reshape(n_mfcc, frames)
+
+    def frames(self, accent_type, source_file):
+        """
+        Reads the frame sequence of a whole file, saved under FRAMES_INDEX, without copying it.
+
+        Parameters:
+        - accent_type: Accent type of the file
+        - source_file: Name of the source audio file
+
+        Returns:
+        - Read-only 2D array (n_mfcc x frames), a view of the memory-mapped data file.
+        """
+
+        return self.get(accent_type, source_file, FRAMES_INDEX)
+
+    def windows(self, accent_type, source_file, window_seconds=5.0, hop_seconds=1.024, sample_rate=16000, hop_length=512):
+        """
+        Cuts overlapping windows from the frame sequence of a file, saved under FRAMES_INDEX. Nothing is read or copied, the windows
+        are strided views of the memory-mapped data file.
+
+        Parameters:
+        - accent_type: Accent type of the file
+        - source_file: Name of the source audio file
+        - window_seconds: Length of the windows (in seconds)
+        - hop_seconds: Time between the starts of two windows (in seconds), a whole number of frames (see features.window_frames)
+        - sample_rate: Sampling rate the frames were extracted at
+        - hop_length: Number of samples between frames
+
+        Returns:
+        - Read-only 3D view (windows x n_mfcc x frames), see features.frame_windows.
+        """
+
+        length, hop = window_frames(window_seconds, hop_seconds, sample_rate=sample_rate, hop_length=hop_length)
+        return frame_windows(self.frames(accent_type, source_file), length, hop)
+
+    def __getitem__(self, key):
+        return self.get(*key)
+
+    def __contains__(self, key):
+        return key in self._locations
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __iter__(self):
+        """
+        Iterates over the segments of the store in index order, without the frame sequences.
+
+        Returns:
+        - A generator of ((accent_type, source_file, segment_index), features) tuples.
+        """
+
+        for key in self.keys():
+            yield key, self.get(*key)
+
+    def export_csv(self, output_base_dir):
+        """
+        Writes the features as one csv file for each segment, same layout as extract_and_save_mfcc. The frame sequences have no
+        segment file, they're left out.
+
+        Parameters:
+        - output_base_dir: Path to the output audio features.
+        """
+
+        for (accent_type, source_file, segment_index), features in self:
+            output_dir = os.path.join(output_base_dir, accent_type)
+            os.makedirs(output_dir, exist_ok=True)
+            pd.DataFrame(features).to_csv(os.path.join(output_dir, f"{source_file}_segment_{segment_index}.csv"), index=False)
@@ -0,0 +1,353 @@
+from functools import lru_cache
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import savgol_filter
+import scipy.fft
+import numpy as np
+import librosa
+
+# Batched MFCC extraction. librosa.feature.mfcc builds the window, the mel filterbank and the DCT again for every call and runs
+# one STFT per segment. Here the equal-length segments are stacked into a 2D array and STFT -> mel -> log -> DCT runs once for the
+# whole batch, in float32, with the filterbank and the DCT matrix cached.
+# The defaults are the same as librosa.feature.mfcc, so the output matches extract_and_save_mfcc.
+#
+# feature_batch derives several features from the same power spectrogram: MFCC, log-mel, the deltas of the MFCCs, spectral
+# centroid and rolloff, stacked into one 2D array for each segment (rows x frames) in the order of FEATURES, optionally with
+# per-utterance CMVN. The STFT is the expensive part, every extra feature only costs its own math on top of it. feature_rows tells
+# which rows are which feature.
+
+FEATURES = ('mfcc', 'delta', 'delta2', 'log_mel', 'centroid', 'rolloff')
+
+@lru_cache(maxsize=None)
+def _window(n_fft):
+    return librosa.filters.get_window('hann', n_fft, fftbins=True).astype(np.float32)
+
+@lru_cache(maxsize=None)
+def _mel_filterbank(sample_rate, n_fft, n_mels):
+    # (n_fft // 2 + 1, n_mels), transposed so we can multiply the spectrogram frames with it directly.
+    return np.ascontiguousarray(librosa.filters.mel(sr=sample_rate, n_fft=n_fft, n_mels=n_mels).T.astype(np.float32))
+
+@lru_cache(maxsize=None)
+def _dct_matrix(n_mels, n_mfcc):
+    # Orthonormal DCT-II over the mel axis, only the first n_mfcc coefficients. (n_mels, n_mfcc)
+    return np.ascontiguousarray(scipy.fft.dct(np.eye(n_mels, dtype=np.float32), type=2, norm='ortho', axis=0)[:n_mfcc].T)
+
+def power_spectrogram_batch(segments, n_fft=2048, hop_length=512):
+    """
+    Computes the power spectrogram of a batch of equal-length segments, same framing as librosa.stft (center=True).
+
+    Parameters:
+    - segments: 2D array of segments (batch x samples)
+    - n_fft: FFT window size
+    - hop_length: Number of samples between frames
+
+    Returns:
+    - Power spectrogram (3D array, batch x frames x (n_fft // 2 + 1))
+    """
+
+    segments = np.asarray(segments, dtype=np.float32)
+
+    # Zero padding on both sides so the frames are centered, like librosa.
+    padded = np.pad(segments, ((0, 0), (n_fft // 2, n_fft // 2)))
+
+    # Frames are strided views of the padded segments, the only copy is the windowed frames.
+    frames = sliding_window_view(padded, n_fft, axis=-1)[:, ::hop_length] * _window(n_fft)
+
+    # scipy keeps float32 input as complex64, numpy.fft would upcast it to complex128.
+    spectrum = scipy.fft.rfft(frames, axis=-1)
+    return spectrum.real ** 2 + spectrum.imag ** 2
+
+def mfcc_batch(segments, sample_rate, n_mfcc=20, n_fft=2048, hop_length=512, n_mels=128, top_db=80.0):
+    """
+    Extracts the MFCC features of a batch of equal-length segments in one vectorized pass.
+
+    Parameters:
+    - segments: 2D array of segments (batch x samples)
+    - sample_rate: Sampling rate of the segments
+    - n_mfcc: Number of MFCC coefficients
+    - n_fft: FFT window size
+    - hop_length: Number of samples between frames
+    - n_mels: Number of mel bands
+    - top_db: Dynamic range of the log-mel spectrogram, per segment like librosa.power_to_db
+
+    Returns:
+    - MFCC features (3D array, batch x n_mfcc x frames)
+    """
+
+    power = power_spectrogram_batch(segments, n_fft=n_fft, hop_length=hop_length)
+    mfcc = _log_mel(power, sample_rate, n_fft, n_mels, top_db) @ _dct_matrix(n_mels, n_mfcc)
+    return mfcc.transpose(0, 2, 1)
+
+def _log_mel(power, sample_rate, n_fft, n_mels, top_db):
+    # batch x frames x n_mels
+    mel = power @ _mel_filterbank(sample_rate, n_fft, n_mels)
+
+    # librosa.power_to_db with ref=1.0 and amin=1e-10, the top_db floor is applied per segment.
+    log_mel = 10.0 * np.log10(np.maximum(mel, 1e-10))
+    if top_db is not None:
+        log_mel = np.maximum(log_mel, log_mel.max(axis=(1, 2), keepdims=True) - top_db)
+    return log_mel
+
+def _delta(data, order, width=9):
+    # Same as librosa.feature.delta (Savitzky-Golay, mode='interp') along the frames. Short segments get a narrower window, and
+    # no delta at all below 3 frames.
+    frames = data.shape[-1]
+    width = min(width, frames if frames % 2 else frames - 1)
+    if width < 3:
+        return np.zeros_like(data)
+    return savgol_filter(data, width, polyorder=order, deriv=order, axis=-1, mode='interp').astype(np.float32, copy=False)
+
+def feature_rows(features=('mfcc',), n_mfcc=20, n_mels=128):
+    """
+    Tells which rows of the output of feature_batch belong to which feature.
+
+    Parameters:
+    - features: Names of the features, some of FEATURES
+    - n_mfcc: Number of MFCC coefficients
+    - n_mels: Number of mel bands
+
+    Returns:
+    - A dictionary of feature name -> slice of its rows, in the order of FEATURES.
+    """
+
+    unknown = set(features) - set(FEATURES)
+    if unknown:
+        raise ValueError(f"Unknown features: {sorted(unknown)}, must be some of {FEATURES}")
+
+    sizes = {'mfcc': n_mfcc, 'delta': n_mfcc, 'delta2': n_mfcc, 'log_mel': n_mels, 'centroid': 1, 'rolloff': 1}
+    rows = {}
+    start = 0
+    for name in FEATURES:
+        if name in features:
+            rows[name] = slice(start, start + sizes[name])
+            start += sizes[name]
+    return rows
+
+def feature_batch(segments, sample_rate, features=('mfcc',), n_mfcc=20, n_fft=2048, hop_length=512, n_mels=128, top_db=80.0,
+                  roll_percent=0.85, cmvn=False):
+    """
+    Extracts several features of a batch of equal-length segments from one shared power spectrogram.
+
+    Parameters:
+    - segments: 2D array of segments (batch x samples)
+    - sample_rate: Sampling rate of the segments
+    - features: Names of the features, some of FEATURES. They're stacked in the order of FEATURES, see feature_rows.
+      'mfcc', 'log_mel': same as mfcc_batch and librosa.power_to_db(melspectrogram). 'delta', 'delta2': first and second order
+      deltas of the MFCCs, like librosa.feature.delta. 'centroid', 'rolloff': like librosa.feature.spectral_centroid and
+      spectral_rolloff, in Hz.
+    - n_mfcc: Number of MFCC coefficients
+    - n_fft: FFT window size
+    - hop_length: Number of samples between frames
+    - n_mels: Number of mel bands
+    - top_db: Dynamic range of the log-mel spectrogram, per segment like librosa.power_to_db
+    - roll_percent: Share of the spectral energy below the rolloff frequency
+    - cmvn: Per-utterance cepstral mean and variance normalization, every row of every segment is scaled to zero mean and unit
+      variance over its frames
+
+    Returns:
+    - Features (3D array, batch x rows x frames)
+    """
+
+    rows = feature_rows(features, n_mfcc, n_mels)
+    power = power_spectrogram_batch(segments, n_fft=n_fft, hop_length=hop_length)
+
+    parts = _spectral_parts(power, sample_rate, n_fft, roll_percent, rows)
+    if rows.keys() & {'mfcc', 'delta', 'delta2', 'log_mel'}:
+        parts.update(_cepstral_parts(_log_mel(power, sample_rate, n_fft, n_mels, top_db), n_mels, n_mfcc, rows))
+
+    stacked = np.concatenate([parts[name] for name in rows], axis=1).astype(np.float32, copy=False)
+    if cmvn:
+        mean = stacked.mean(axis=-1, keepdims=True)
+        std = stacked.std(axis=-1, keepdims=True)
+        stacked = (stacked - mean) / np.maximum(std, 1e-8)
+    return stacked
+
+def _cepstral_parts(log_mel, n_mels, n_mfcc, rows):
+    # log_mel: batch x frames x n_mels, with the top_db floor. Returns the log-mel based features, batch x rows x frames each.
+    parts = {'log_mel': log_mel.transpose(0, 2, 1)}
+    if rows.keys() & {'mfcc', 'delta', 'delta2'}:
+        parts['mfcc'] = (log_mel @ _dct_matrix(n_mels, n_mfcc)).transpose(0, 2, 1)
+        if 'delta' in rows:
+            parts['delta'] = _delta(parts['mfcc'], 1)
+        if 'delta2' in rows:
+            parts['delta2'] = _delta(parts['mfcc'], 2)
+    return parts
+
+def _spectral_parts(power, sample_rate, n_fft, roll_percent, rows):
+    # power: batch x frames x bins. Returns the spectral shape features, batch x 1 x frames each.
+    parts = {}
+    if not rows.keys() & {'centroid', 'rolloff'}:
+        return parts
+
+    # librosa's spectral features are computed on the magnitude, not the power.
+    magnitude = np.sqrt(power)
+    frequencies = np.fft.rfftfreq(n_fft, 1.0 / sample_rate).astype(np.float32)
+    if 'centroid' in rows:
+        total = magnitude.sum(axis=-1)
+        parts['centroid'] = ((magnitude @ frequencies) / np.where(total > 0, total, 1.0))[:, None, :]
+    if 'rolloff' in rows:
+        energy = np.cumsum(magnitude, axis=-1)
+        # The first bin where the cumulative energy reaches roll_percent of the total.
+        first = np.argmax(energy >= roll_percent * energy[..., -1:], axis=-1)
+        parts['rolloff'] = frequencies[first][:, None, :]
+    return parts
+
+def feature_frames(samples, sample_rate, features=('mfcc',), n_mfcc=20, n_fft=2048, hop_length=512, n_mels=128, top_db=None,
+                   roll_percent=0.85, block_frames=4096):
+    """
+    Extracts the frame sequence of a whole file once, so windows of any length and hop can be cut from it with frame_windows
+    instead of extracting every window again.
+
+    The frames are the ones of librosa.stft(center=True) over the whole file. A window that starts at a multiple of hop_length
+    samples has the same frames as the segment cut at that sample, except the first and last n_fft // (2 * hop_length) frames,
+    which see the neighbouring audio instead of the zero padding of the segment (4 more frames for the deltas, their filter is 9
+    frames wide). There is no top_db floor by default: a floor would be relative to the loudest bin of the whole file instead of
+    each segment, and the windows of a segment much quieter than the loudest part of the file would differ. Compare them with the
+    segments extracted with top_db=None too.
+
+    Parameters:
+    - samples: Mono float32 audio buffer of the whole file
+    - sample_rate: Sampling rate of the buffer
+    - features: Names of the features, some of FEATURES, stacked like feature_batch
+    - n_mfcc: Number of MFCC coefficients
+    - n_fft: FFT window size
+    - hop_length: Number of samples between frames
+    - n_mels: Number of mel bands
+    - top_db: Dynamic range of the log-mel spectrogram over the whole file, None for no floor
+    - roll_percent: Share of the spectral energy below the rolloff frequency
+    - block_frames: Number of frames whose spectrum is computed at a time, the spectrum of a long file is never in memory at once
+
+    Returns:
+    - Features (2D array, rows x frames)
+    """
+
+    rows = feature_rows(features, n_mfcc, n_mels)
+    samples = np.asarray(samples, dtype=np.float32)
+
+    # Centered frames like power_spectrogram_batch, the padding is added once to the whole file.
+    padded = np.pad(samples, n_fft // 2)
+    frame_count = 1 + len(samples) // hop_length
+
+    log_mels = []
+    spectral = []
+    for start in range(0, frame_count, block_frames):
+        end = min(start + block_frames, frame_count)
+        # The samples of frames start..end-1, the frames of the block are the frames of the whole file.
+        block = padded[start * hop_length:(end - 1) * hop_length + n_fft]
+        spectrum = scipy.fft.rfft(sliding_window_view(block, n_fft)[::hop_length] * _window(n_fft), axis=-1)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2)[None]
+
+        spectral.append(_spectral_parts(power, sample_rate, n_fft, roll_percent, rows))
+        if rows.keys() & {'mfcc', 'delta', 'delta2', 'log_mel'}:
+            log_mels.append(_log_mel(power, sample_rate, n_fft, n_mels, None))
+
+    parts = {name: np.concatenate([block[name] for block in spectral], axis=-1) for name in spectral[0]}
+    if log_mels:
+        log_mel = np.concatenate(log_mels, axis=1)
+        del log_mels
+        # The floor needs the loudest bin of the whole file, so it's applied after all the blocks.
+        if top_db is not None:
+            log_mel = np.maximum(log_mel, log_mel.max() - top_db)
+        parts.update(_cepstral_parts(log_mel, n_mels, n_mfcc, rows))
+
+    return np.concatenate([parts[name][0] for name in rows], axis=0).astype(np.float32, copy=False)
+
+def window_frames(window_seconds, hop_seconds, sample_rate=16000, hop_length=512):
+    """
+    Converts a window length and hop in seconds to frames. The frame count of a window is the one of a segment of window_seconds
+    (librosa.stft, center=True). The windows can only start on the frame grid, so the hop must be a whole number of frames: at
+    16 kHz with hop_length=512 a frame is 32 ms, 1.024 s is 32 frames but 1 s is not a whole number of frames.
+
+    Parameters:
+    - window_seconds: Length of the windows (in seconds)
+    - hop_seconds: Time between the starts of two windows (in seconds)
+    - sample_rate: Sampling rate the frames were extracted at
+    - hop_length: Number of samples between frames
+
+    Returns:
+    - A tuple of (window length, hop) in frames.
+    """
+
+    length = 1 + int(round(window_seconds * sample_rate)) // hop_length
+    hop = int(round(hop_seconds * sample_rate / hop_length))
+    # Rounding would move every window a bit further away from the time it should start at.
+    if hop < 1 or abs(hop * hop_length - hop_seconds * sample_rate) > 1e-6 * sample_rate:
+        raise ValueError(f"A hop of {hop_seconds} s is not a whole number of frames of {hop_length / sample_rate * 1000:g} ms, the "
+                         f"windows wouldn't start at their time")
+    return length, hop
+
+def frame_windows(frames, length, hop):
+    """
+    Cuts overlapping windows from a frame sequence. Nothing is copied, the windows are strided views of frames.
+
+    Parameters:
+    - frames: Features of a whole file (2D array, rows x frames), see feature_frames
+    - length: Number of frames of a window
+    - hop: Number of frames between the starts of two windows
+
+    Returns:
+    - Read-only 3D view (windows x rows x length). Only whole windows, it's empty if the file is shorter than one window.
+    """
+
+    if frames.shape[1] < length:
+        return np.empty((0, frames.shape[0], length), dtype=frames.dtype)
+    return sliding_window_view(frames, length, axis=1)[:, ::hop].transpose(1, 0, 2)
+
+def iter_mfcc_batched(items, sample_rate, batch_size=256, n_mfcc=20):
+    """
+    Extracts the MFCC features of (key, segment) pairs in batches. Segments with the same length are stacked together, segments
+    with different lengths (like the last segment of a file) go into their own batch.
+
+    Parameters:
+    - items: Iterable of (key, segment) tuples, segments are 1D arrays
+    - sample_rate: Sampling rate of the segments
+    - batch_size: Maximum number of segments kept in memory before they are processed
+    - n_mfcc: Number of MFCC coefficients
+
+    Returns:
+    - A generator of (key, mfcc) tuples, in the same order as items.
+    """
+
+    yield from iter_features_batched(items, sample_rate, batch_size=batch_size,
+                                     extract=lambda batch: mfcc_batch(batch, sample_rate, n_mfcc=n_mfcc))
+
+def iter_features_batched(items, sample_rate, batch_size=256, extract=None, **options):
+    """
+    Extracts the features of (key, segment) pairs in batches, like iter_mfcc_batched, with feature_batch.
+
+    Parameters:
+    - items: Iterable of (key, segment) tuples, segments are 1D arrays
+    - sample_rate: Sampling rate of the segments
+    - batch_size: Maximum number of segments kept in memory before they are processed
+    - extract: Function that extracts the features of a 2D batch of segments, feature_batch with the options by default
+    - options: Keyword arguments passed to feature_batch (features, n_mfcc, cmvn...)
+
+    Returns:
+    - A generator of (key, features) tuples, in the same order as items.
+    """
+
+    if extract is None:
+        extract = lambda batch: feature_batch(batch, sample_rate, **options)
+
+    pending = []
+    for key, segment in items:
+        pending.append((key, segment))
+        if len(pending) >= batch_size:
+            yield from _flush(pending, extract)
+            pending = []
+
+    if pending:
+        yield from _flush(pending, extract)
+
+def _flush(pending, extract):
+    # Group the pending segments by length and run one batch for each length.
+    by_length = {}
+    for position, (key, segment) in enumerate(pending):
+        by_length.setdefault(len(segment), []).append(position)
+
+    results = [None] * len(pending)
+    for positions in by_length.values():
+        extracted = extract(np.stack([pending[position][1] for position in positions]))
+        for position, features in zip(positions, extracted):
+            results[position] = (pending[position][0], features)
+
+    yield from results
@@ -0,0 +1,348 @@
+from concurrent.futures import ProcessPoolExecutor
+from scipy.ndimage import maximum_filter
+from pydub import AudioSegment
+from features import power_spectrogram_batch
+from cleaner import list_audio_files
+import numpy as np
+import subprocess
+import logging
+import os
+from metrics import get_logger, log_event
+import metrics
+
+logger = get_logger('fingerprint')
+
+# Acoustic fingerprints of the downloaded audio, to find the same content uploaded under different video ids before it's cleaned,
+# split and extracted twice (or ends up in two accent classes).
+#
+# - The audio is decoded to 8 kHz mono with ffmpeg, block by block, so long files are never fully in memory.
+# - Spectral peaks (local maxima of the log spectrogram) are paired with the next few peaks, and every pair (f1, f2, dt) is packed
+#   into one integer, like the landmark hashes of Shazam. They only depend on the time difference of the peaks, so they're the same
+#   wherever the audio starts, and they survive re-encoding.
+# - The set of landmark hashes of a file is compressed into a MinHash signature of NUM_PERM integers. The share of equal values of
+#   two signatures estimates the Jaccard similarity of the two hash sets.
+# - The signatures are cut into bands and indexed by band (LSH), two files are compared only if at least one of their bands is equal.
+#   A lookup touches only these candidates instead of every file in the corpus.
+
+SAMPLE_RATE = 8000
+N_FFT = 1024
+HOP_LENGTH = 256
+NUM_PERM = 64
+ROWS = 2
+
+# Random hash functions (a * h + b) mod p of the MinHash, fixed so the signatures of different runs can be compared. p is a prime
+# above the largest landmark hash (2^26), and a * h + b stays under 2^64.
+_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.default_rng(20240101)
+_PERM_A = _rng.integers(1, (1 << 31) - 1, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, (1 << 31) - 1, size=NUM_PERM, dtype=np.uint64)
+
+def _iter_blocks(input_file, block_samples):
+    # ffmpeg decodes, downmixes and resamples, only block_samples are read at a time.
+    command = [AudioSegment.converter, '-v', 'error', '-i', input_file, '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1',
+               '-ar', str(SAMPLE_RATE), '-']
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            block = process.stdout.read(block_samples * 2)
+            if not block:
+                break
+            yield np.frombuffer(block, dtype=np.int16).astype(np.float32) / 32768.0
+    finally:
+        process.stdout.close()
+        error = process.stderr.read().decode('utf-8', 'ignore')
+        process.stderr.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"Decoding {input_file} failed: {error}")
+
+def spectral_peaks(input_file, block_seconds=60, peaks_per_second=30, neighborhood=(15, 15)):
+    """
+    Finds the spectral peaks of an audio file.
+
+    Parameters:
+    - input_file: Path to the audio file
+    - block_seconds: Length of the blocks the file is decoded and analysed in
+    - peaks_per_second: Max. number of peaks kept for each second, the strongest ones
+    - neighborhood: (frames, bins) around a peak it must be the maximum of
+
+    Returns:
+    - 2D array of peaks (count x 2), (frame, frequency bin) sorted by frame.
+    """
+
+    # A block is a whole number of hops, so the frames of the blocks line up with the frames of the whole file.
+    frames_per_block = int(block_seconds * SAMPLE_RATE) // HOP_LENGTH
+    block_samples = frames_per_block * HOP_LENGTH
+
+    peaks = []
+    start_frame = 0
+    for block in _iter_blocks(input_file, block_samples):
+        # The last frame of a full block starts the next block, it's left to that block.
+        log_power = 10.0 * np.log10(np.maximum(power_spectrogram_batch(block[None, :], N_FFT, HOP_LENGTH)[0], 1e-10))
+        frames = min(len(log_power), frames_per_block)
+        log_power = log_power[:frames]
+
+        # A peak is the maximum of its neighborhood and not in the silent part of the block.
+        is_peak = (log_power == maximum_filter(log_power, size=neighborhood)) & (log_power > log_power.max() - 60.0)
+        is_peak[:, 0] = False
+        frame, frequency = np.nonzero(is_peak)
+
+        # Only the strongest peaks, the weak ones are the first to change when the audio is re-encoded.
+        keep = int(peaks_per_second * frames * HOP_LENGTH / SAMPLE_RATE) + 1
+        if len(frame) > keep:
+            strongest = np.argpartition(log_power[frame, frequency], -keep)[-keep:]
+            frame, frequency = frame[strongest], frequency[strongest]
+
+        peaks.append(np.stack([frame + start_frame, frequency], axis=1))
+        start_frame += frames
+
+    if not peaks:
+        return np.empty((0, 2), dtype=np.int64)
+    peaks = np.concatenate(peaks).astype(np.int64)
+    return peaks[np.lexsort((peaks[:, 1], peaks[:, 0]))]
+
+def landmark_hashes(peaks, fan_out=5, max_dt=63):
+    """
+    Pairs every peak with the next fan_out peaks and packs each pair into an integer.
+
+    Parameters:
+    - peaks: 2D array of peaks (count x 2), (frame, frequency bin) sorted by frame
+    - fan_out: Number of peaks after a peak it's paired with
+    - max_dt: Max. number of frames between the peaks of a pair
+
+    Returns:
+    - 1D array of the unique hashes, f1 (10 bits) | f2 (10 bits) | dt (6 bits).
+    """
+
+    hashes = []
+    for k in range(1, fan_out + 1):
+        first, second = peaks[:-k], peaks[k:]
+        dt = second[:, 0] - first[:, 0]
+        valid = (dt > 0) & (dt <= max_dt)
+        hashes.append((first[valid, 1] << 16) | (second[valid, 1] << 6) | dt[valid])
+    if not hashes:
+        return np.empty(0, dtype=np.uint64)
+    return np.unique(np.concatenate(hashes)).astype(np.uint64)
+
+def minhash_signature(hashes):
+    """
+    Compresses a set of hashes into a MinHash signature.
+
+    Parameters:
+    - hashes: 1D array of unique hashes
+
+    Returns:
+    - 1D array of NUM_PERM integers.
+    """
+
+    signature = np.full(NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+    # In chunks, so a long file doesn't need a NUM_PERM x hashes matrix.
+    for start in range(0, len(hashes), 65536):
+        chunk = hashes[start:start + 65536]
+        permuted = (np.outer(_PERM_A, chunk) + _PERM_B[:, None]) % _PRIME
+        signature = np.minimum(signature, permuted.min(axis=1))
+    return signature
+
+def fingerprint_file(input_file, min_hashes=100):
+    """
+    Computes the fingerprint of an audio file.
+
+    Parameters:
+    - input_file: Path to the audio file
+    - min_hashes: Files with fewer landmark hashes (silent or very short) get no fingerprint, they would match each other.
+
+    Returns:
+    - The MinHash signature, or None.
+    """
+
+    hashes = landmark_hashes(spectral_peaks(input_file))
+    if len(hashes) < min_hashes:
+        return None
+    return minhash_signature(hashes)
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+class FingerprintIndex:
+    """
+    Locality-sensitive index of MinHash signatures. Signatures are cut into bands of ROWS values, and a lookup only compares the
+    signatures that have at least one equal band.
+
+    Parameters:
+    - rows: Number of values in a band. Fewer rows find less similar files, but compare more candidates.
+    """
+
+    def __init__(self, rows=ROWS):
+        self.rows = rows
+        self.names = []
+        self.signatures = []
+        self.stamps = []
+        self._positions = {}
+        self._buckets = [{} for _ in range(NUM_PERM // rows)]
+
+    def _bands(self, signature):
+        for band in range(len(self._buckets)):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, name, signature, stamp=None):
+        """
+        Adds a signature to the index.
+
+        Parameters:
+        - name: Name of the file, usually its path.
+        - signature: MinHash signature of the file.
+        - stamp: (size, mtime_ns) of the file when it was fingerprinted, so the signature can be reused while the file is the same.
+        """
+
+        position = len(self.names)
+        self.names.append(name)
+        self.signatures.append(signature)
+        self.stamps.append(stamp if stamp is not None else (-1, -1))
+        self._positions[name] = position
+        for band, key in self._bands(signature):
+            self._buckets[band].setdefault(key, []).append(position)
+
+    def query(self, signature, threshold=0.2):
+        """
+        Finds the indexed files that are similar to a signature.
+
+        Parameters:
+        - signature: MinHash signature to look up.
+        - threshold: Min. estimated Jaccard similarity of the landmark hashes.
+
+        Returns:
+        - A list of (name, similarity) tuples, the most similar first.
+        """
+
+        candidates = set()
+        for band, key in self._bands(signature):
+            candidates.update(self._buckets[band].get(key, ()))
+
+        matches = []
+        for position in sorted(candidates):
+            similarity = float(np.mean(self.signatures[position] == signature))
+            if similarity >= threshold:
+                matches.append((self.names[position], similarity))
+        return sorted(matches, key=lambda match: -match[1])
+
+    def get(self, name, stamp=None):
+        """
+        Returns the signature of an indexed file, or None if it's not indexed or it changed since (stamp differs).
+        """
+
+        position = self._positions.get(name)
+        if position is None or (stamp is not None and tuple(self.stamps[position]) != tuple(stamp)):
+            return None
+        return self.signatures[position]
+
+    def __len__(self):
+        return len(self.names)
+
+    def save(self, path):
+        """
+        Saves the index as an npz file. It's written to a temp file first so a crash never leaves a half written index behind.
+        """
+
+        signatures = np.array(self.signatures, dtype=np.uint64).reshape(-1, NUM_PERM)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, names=np.array(self.names, dtype=str), signatures=signatures, stamps=np.array(self.stamps, dtype=np.int64),
+                     rows=self.rows)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index saved with save.
+        """
+
+        with np.load(path) as data:
+            index = cls(rows=int(data['rows']))
+            for name, signature, stamp in zip(data['names'], data['signatures'], data['stamps']):
+                index.add(str(name), signature, tuple(int(value) for value in stamp))
+        return index
+
+def _fingerprint_task(input_file):
+    # Runs in a worker process. Errors are returned instead of raised so one bad file doesn't stop the others.
+    try:
+        return input_file, fingerprint_file(input_file), None
+    except Exception as e:
+        return input_file, None, f"{type(e).__name__}: {e}"
+
+def find_duplicates(input_base_dir, accent_types=None, workers=None, threshold=0.2, index_path=None):
+    """
+    Finds the audio files that have the same content as an earlier file of the dataset, in any accent folder.
+
+    Parameters:
+    - input_base_dir: Path to the input audio dataset, one folder for each accent type (mp3 or wav files.)
+    - accent_types: List of accent folders to check, all of them by default
+    - workers: Number of worker processes, os.cpu_count() by default
+    - threshold: Min. estimated similarity of two files to be duplicates
+    - index_path: Path to an npz file to keep the fingerprints in. Files that didn't change since the last run aren't decoded again.
+
+    Returns:
+    - A list of (file, original_file, similarity) tuples, one for each duplicate. The original is the first copy in sorted order.
+    """
+
+    if accent_types is None:
+        accent_types = [name for name in os.listdir(input_base_dir) if os.path.isdir(os.path.join(input_base_dir, name))]
+
+    files = []
+    for accent_type in sorted(accent_types):
+        files += list_audio_files(os.path.join(input_base_dir, accent_type))
+
+    previous = FingerprintIndex.load(index_path) if index_path is not None and os.path.exists(index_path) else None
+
+    stamps = {file: _file_stamp(file) for file in files}
+    signatures = {}
+    tasks = []
+    for file in files:
+        signature = previous.get(file, stamps[file]) if previous is not None else None
+        if signature is not None:
+            signatures[file] = signature
+        else:
+            tasks.append(file)
+
+    failures = []
+    with ProcessPoolExecutor(max_workers=workers) as executor, metrics.timer('fingerprint'):
+        for file, signature, error in executor.map(_fingerprint_task, tasks, chunksize=4):
+            metrics.count('files', stage='fingerprint')
+            if error is not None:
+                failures.append((file, error))
+            elif signature is not None:
+                signatures[file] = signature
+
+    # The index is built again from the signatures in sorted order, so the same file is always the original.
+    index = FingerprintIndex()
+    original_of = {}
+    duplicates = []
+    for file in files:
+        if file not in signatures:
+            continue
+        matches = index.query(signatures[file], threshold)
+        if matches:
+            # A copy of a copy is a duplicate of the original.
+            match, similarity = matches[0]
+            original = original_of.get(match, match)
+            original_of[file] = original
+            duplicates.append((file, original, similarity))
+        index.add(file, signatures[file], stamps[file])
+
+    if index_path is not None:
+        index.save(index_path)
+
+    log_event(logger, logging.INFO, "fingerprint finished", fingerprinted=len(signatures), files=len(files), decoded=len(tasks),
+              duplicates=len(duplicates))
+    for file, original, similarity in duplicates:
+        # The same audio in two accent folders is a labeling problem, not only wasted work.
+        other_accent = os.path.dirname(file) != os.path.dirname(original)
+        log_event(logger, logging.WARNING if other_accent else logging.INFO,
+                  "duplicate in another accent folder" if other_accent else "duplicate", file=file, original=original,
+                  similarity=round(similarity, 2))
+    for file, error in failures:
+        metrics.count('failures', stage='fingerprint')
+        log_event(logger, logging.WARNING, "fingerprint failed", file=file, error=error.splitlines()[0])
+    return duplicates
+
+if __name__ == "__main__":
+    metrics.configure(level='INFO')
+    find_duplicates("audio_files", index_path="audio_fingerprints.npz")
@@ -0,0 +1,399 @@
+from urllib.parse import urlencode, urlsplit
+import requests
+import json
+import re
+from metrics import get_logger
+
+logger = get_logger('http_discovery')
+
+# Browserless discovery backend. A YouTube listing page (search results, channel videos, playlist) has its first results embedded in
+# the HTML as a JSON object (ytInitialData), and the rest of the list is loaded with continuation tokens: the last item of every
+# batch is a continuation item with a token, POSTing the token to the page's API endpoint returns the next batch and the next token.
+# Reading these directly gives the same video ids, titles and view counts as the rendered page, without starting Chrome, so dozens of
+# discovery jobs can run on one machine.
+#
+# HttpDiscoverySession has the same fetch/close interface as crawler.DiscoverySession, and get_video_links,
+# get_videos_from_channel and get_videos_from_playlist have the same signatures as the ones in crawler.py. All the requests go
+# through one pooled requests.Session, so the connections to the server are reused.
+#
+# The API endpoint is on the same host as the listing page, so the backend can be run against a local server that serves recorded
+# pages, see base_url.
+#
+# The title and view count filters are here and not in crawler.py, so they can be used without selenium. crawler.py imports them.
+
+# Where search results are loaded from. Channel and playlist URLs are used as they are.
+base_url = 'https://www.youtube.com'
+
+# Seconds to wait for a response.
+request_timeout = 10
+
+# Sent with every request. English texts are needed for parse_view_count, and the consent cookie skips the cookie consent page that
+# is shown in the EU instead of the results.
+http_headers = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+http_cookies = {'CONSENT': 'YES+1', 'SOCS': 'CAI'}
+
+def check_title_for_nationality(title, target_nationality):
+    """
+    Checks video title for nationality.
+
+    Parameters:
+    - title: The title of the YouTube video.
+    - target_nationality: The nationality filter to apply to video titles.
+
+    Returns:
+    - True or False.
+    """
+
+    # List of nationalities to skip
+    nationality_words = ['American', 'Australian', 'British', 'Scottish', 'Indian', 'Irish', 'Canadian']
+
+    # No more than 1 nationality word on the title.
+    # If 'American' and 'British' words are concurrently included, return false.
+    for nationality in nationality_words:
+        if nationality in title and nationality != target_nationality:
+            return False
+    return True
+
+def parse_view_count(view_count_text):
+    """
+    Parses view count into integer from the search page.
+
+    Parameters:
+    - view_count_text: View count of the video in text format.
+
+    Returns:
+    - Parsed view_count_text(int).
+    """
+
+    # view_count_text: 15K views, 1M views, 947 views etc...
+    # Replace the 'views' part with '' and remove any left spaces with strip.
+    try:
+        view_count_text = view_count_text.replace('views', '').strip()
+        if 'K' in view_count_text:
+            return int(float(view_count_text.replace('K', '')) * 1000)
+        elif 'M' in view_count_text:
+            return int(float(view_count_text.replace('M', '')) * 1000000)
+        else:
+            return int(view_count_text)
+    except ValueError:
+        return 0
+
+def search_filter(target_nationality, min_view_count=1000):
+    """
+    Creates the filter of the search results: the title has no other nationality and the video has enough views.
+
+    Parameters:
+    - target_nationality: The nationality filter to apply to video titles.
+    - min_view_count: Minimum view count of the videos.
+
+    Returns:
+    - A function that takes a video entry and returns True or False.
+    """
+
+    def accept(video):
+        # Check the title for the target nationality
+        if not check_title_for_nationality(video['title'], target_nationality):
+            return False
+
+        # Output:
+        # View count span: <span class="inline-metadata-item style-scope ytd-video-meta-block">12M views</span>
+        # View count text: 12M views
+        # None if the video has no meta div or no view count span.
+        if video['view_count_text'] is None:
+            return False
+
+        # Only getting the videos that have at least 1K views.
+        return parse_view_count(video['view_count_text']) >= min_view_count
+
+    return accept
+
+def renderer_view_count(renderer):
+    """
+    Reads the view count text of a video renderer, in the same format as the rendered page (12M views, 947 views).
+
+    Parameters:
+    - renderer: A videoRenderer or playlistVideoRenderer object of the page data.
+
+    Returns:
+    - View count text, or None if the video has no view count.
+    """
+
+    # shortViewCountText is what the page shows (12M views), viewCountText is the exact count with commas (12,345,678 views).
+    for key in ('shortViewCountText', 'viewCountText'):
+        text = _text(renderer.get(key))
+        if text:
+            return text.replace(',', '')
+
+    # Playlist videos have the view count in videoInfo: 1.2M views • 3 years ago
+    for run in renderer.get('videoInfo', {}).get('runs', []):
+        if 'view' in run.get('text', ''):
+            return run['text'].replace(',', '')
+    return None
+
+def _text(value):
+    # Texts in the page data are either {'simpleText': ...} or {'runs': [{'text': ...}, ...]}.
+    if not value:
+        return ''
+    if 'simpleText' in value:
+        return value['simpleText']
+    return ''.join(run.get('text', '') for run in value.get('runs', []))
+
+def _walk(value):
+    # Every dictionary in the page data, in document order.
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            yield value
+            stack.extend(reversed(list(value.values())))
+        elif isinstance(value, list):
+            stack.extend(reversed(value))
+
+def parse_listing(data):
+    """
+    Reads the videos and the continuation token from the initial data of a listing page or from a continuation response.
+
+    Parameters:
+    - data: Parsed ytInitialData, or the json response of a continuation request.
+
+    Returns:
+    - A tuple of (entries, continuation token or None). entries is a list of video entries in page order, dictionaries with href,
+      title and view_count_text like crawler.extract_entries returns.
+    """
+
+    entries = []
+    continuation = None
+    for item in _walk(data):
+        renderer = item.get('videoRenderer') or item.get('playlistVideoRenderer') or item.get('gridVideoRenderer')
+        if renderer is not None and 'videoId' in renderer:
+            entries.append({
+                'href': f"/watch?v={renderer['videoId']}",
+                'title': _text(renderer.get('title')),
+                'view_count_text': renderer_view_count(renderer),
+            })
+
+        continuation_item = item.get('continuationItemRenderer')
+        if continuation_item is not None:
+            token = continuation_item.get('continuationEndpoint', {}).get('continuationCommand', {}).get('token')
+            if token:
+                continuation = token
+
+    return entries, continuation
+
+def extract_initial_data(html):
+    """
+    Extracts the ytInitialData object from the HTML of a listing page.
+
+    Parameters:
+    - html: Page source.
+
+    Returns:
+    - The parsed object.
+    """
+
+    match = re.search(r'(?:var ytInitialData|window\["ytInitialData"\])\s*=\s*', html)
+    if match is None:
+        raise ValueError("No ytInitialData on the page.")
+
+    # raw_decode stops at the end of the object, the script goes on after it.
+    data, _ = json.JSONDecoder().raw_decode(html, match.end())
+    return data
+
+def extract_innertube_config(html):
+    """
+    Extracts the API key and client version of the page, they are sent with the continuation requests.
+
+    Parameters:
+    - html: Page source.
+
+    Returns:
+    - A tuple of (api_key or None, client_version).
+    """
+
+    api_key = re.search(r'"INNERTUBE_API_KEY"\s*:\s*"([^"]+)"', html)
+    client_version = re.search(r'"INNERTUBE_CLIENT_VERSION"\s*:\s*"([^"]+)"', html)
+    return (api_key.group(1) if api_key else None), (client_version.group(1) if client_version else '2.20240101.00.00')
+
+# One HTTP session for all discovery sessions, so the connections are reused.
+_http = None
+
+def http_session():
+    """
+    Returns the pooled HTTP session, creating it the first time.
+
+    Returns:
+    - A requests.Session.
+    """
+
+    global _http
+    if _http is None:
+        _http = requests.Session()
+        _http.headers.update(http_headers)
+        _http.cookies.update(http_cookies)
+    return _http
+
+class HttpDiscoverySession:
+    """
+    Discovery of a listing page (search results, channel or playlist) over plain HTTP. Every call continues from the continuation
+    token where the previous one stopped, like crawler.DiscoverySession continues scrolling.
+
+    Parameters:
+    - url: The URL of the listing page.
+    - accept: Function that takes a video entry and returns True if the video should be used, all videos by default.
+    - search_query: If given, the search results of the query on url's host are listed instead of url.
+    - http: HTTP session to use, the pooled one by default.
+    """
+
+    def __init__(self, url, accept=None, search_query=None, http=None):
+        self.accept = accept
+        self.http = http if http is not None else http_session()
+        # Accepted video URLs in page order, and the hrefs that are already handled (accepted or not).
+        self.links = []
+        self.link_set = set()
+        self.seen = set()
+        self.exhausted = False
+
+        # Search results are continued with the search endpoint, channels and playlists with the browse endpoint.
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        if search_query is not None:
+            url = f"{origin}/results?{urlencode({'search_query': search_query})}"
+        self.api_url = f"{origin}/youtubei/v1/{'search' if search_query is not None else 'browse'}"
+
+        response = self.http.get(url, timeout=request_timeout)
+        response.raise_for_status()
+        self.api_key, self.client_version = extract_innertube_config(response.text)
+        self._collect(extract_initial_data(response.text))
+
+        if not self.links and self.exhausted:
+            logger.info("No results on the page.")
+
+    def _collect(self, data):
+        entries, self.continuation = parse_listing(data)
+        if self.continuation is None:
+            self.exhausted = True
+
+        for video in entries:
+            href = video['href']
+            if href in self.seen:
+                continue
+            self.seen.add(href)
+
+            full_url = f"https://www.youtube.com{href}"
+            if self.accept is None or self.accept(video):
+                self.links.append(full_url)
+                self.link_set.add(full_url)
+
+    def _continue(self):
+        # The next batch of results, the same request the page sends when it's scrolled to the bottom.
+        payload = {
+            'context': {'client': {'clientName': 'WEB', 'clientVersion': self.client_version, 'hl': 'en', 'gl': 'US'}},
+            'continuation': self.continuation,
+        }
+        params = {'key': self.api_key} if self.api_key else None
+        response = self.http.post(self.api_url, params=params, json=payload, timeout=request_timeout)
+        response.raise_for_status()
+        self._collect(response.json())
+
+    def fetch(self, max_results):
+        """
+        Returns the first max_results video links of the page, loading only as many continuations as needed.
+
+        Parameters:
+        - max_results: Max. number of videos to fetch
+
+        Returns:
+        - A set of video links.
+        """
+
+        while len(self.links) < max_results and not self.exhausted:
+            self._continue()
+            if self.exhausted:
+                logger.info("Reached the end of the results, no more results.")
+
+        return set(self.links[:max_results])
+
+    def close(self):
+        # Nothing to close, the HTTP session is shared.
+        pass
+
+# Open sessions by (kind, target), so the same query, channel or playlist is never listed twice in a run.
+_sessions = {}
+
+def get_session(key, create):
+    """
+    Returns the pooled session for key, creating it with create() the first time.
+
+    Parameters:
+    - key: A tuple of (kind, target), like ('playlist', playlist_url).
+    - create: Function that creates the session.
+
+    Returns:
+    - An HttpDiscoverySession.
+    """
+
+    if key not in _sessions:
+        _sessions[key] = create()
+    return _sessions[key]
+
+def close_sessions():
+    """
+    Forgets the pooled discovery sessions and closes the HTTP connections.
+    """
+
+    global _http
+    _sessions.clear()
+    if _http is not None:
+        _http.close()
+        _http = None
+
+def get_video_links(search_query, target_nationality, max_results=5, min_view_count=1000):
+    """
+    Gets the video links from YouTube search results. Calling it again with a bigger max_results continues from where it stopped.
+
+    Parameters:
+    - search_query: Search query for Youtube
+    - target_nationality: The nationality filter to apply to video titles.
+    - max_results: Max. number of videos to fetch
+
+    Returns:
+    - A set of video links.
+    """
+
+    session = get_session(
+        ('search', search_query, target_nationality, min_view_count),
+        lambda: HttpDiscoverySession(base_url, accept=search_filter(target_nationality, min_view_count), search_query=search_query)
+    )
+    return session.fetch(max_results)
+
+def get_videos_from_channel(channel_url, max_results=5):
+    """
+    Fetches video links from a specific YouTube channel. Calling it again with a bigger max_results continues from where it stopped.
+
+    Parameters:
+    - channel_url: The URL of the YouTube channel's videos tab.
+    - max_results: The maximum number of videos to fetch.
+    Return:
+    - Set of video URLs.
+    """
+
+    session = get_session(('channel', channel_url), lambda: HttpDiscoverySession(channel_url))
+    return session.fetch(max_results)
+
+def get_videos_from_playlist(playlist_url, max_results=5):
+    """
+    Fetches video links from a specific YouTube playlist. Calling it again with a bigger max_results continues from where it
+    stopped.
+
+    Parameters:
+    - playlist_url: The URL of the YouTube playlist.
+    - max_results: The maximum number of videos to fetch.
+    Return:
+    - Set of video URLs.
+    """
+
+    session = get_session(('playlist', playlist_url), lambda: HttpDiscoverySession(playlist_url))
+    return session.fetch(max_results)
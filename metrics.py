@@ -0,0 +1,260 @@
+from contextlib import contextmanager, nullcontext
+import logging
+import time
+import os
+
+# Instrumentation of the pipeline: leveled logging, counters and timers for each stage, periodic metrics snapshots and a per-stage
+# profile.
+#
+# - Logging goes through the logging module, one logger for each script (cleaner, split_audio, mfcc, pipeline, crawler...). The
+#   per-file messages are DEBUG, the summaries INFO, the failures WARNING. log_event formats 'event key=value ...' lines only if the
+#   level is enabled.
+# - Counters (files, seconds of audio, bytes written, segments, failures...) and timers are kept per stage. They are disabled until
+#   configure(metrics=True), then count() is one global check and timer() returns a shared no-op context, so the instrumented code
+#   costs almost nothing.
+# - With a textfile, a snapshot of the counters is written every interval seconds in the Prometheus text format, for a local
+#   scraper (node_exporter's textfile collector for example). It's written to a temp file and renamed, so it's never read half
+#   written.
+# - The worker processes of the parallel stages keep their own counters. The task functions return collect() with their result, and
+#   the main process merge()s them, so the snapshots and the profile cover the whole run.
+#
+# metrics.configure(level='INFO', metrics=True, textfile='pipeline_metrics.prom')
+# ...
+# metrics.report()
+
+METRIC_PREFIX = 'pipeline'
+
+_enabled = False
+_textfile = None
+_interval = 15.0
+_last_snapshot = 0.0
+
+# (name, stage) -> value
+_counters = {}
+# stage -> [calls, total seconds, max seconds]
+_timers = {}
+
+def configure(level='INFO', metrics=False, textfile=None, interval=15.0):
+    """
+    Sets up logging and the metrics.
+
+    Parameters:
+    - level: Logging level, 'DEBUG' shows a message for every file.
+    - metrics: Enable the counters and timers.
+    - textfile: Path to write the metrics snapshots to, Prometheus text format. Enables the metrics.
+    - interval: Min. number of seconds between two snapshots.
+    """
+
+    global _enabled, _textfile, _interval
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    logging.getLogger().setLevel(level)
+    _enabled = metrics or textfile is not None
+    _textfile = textfile
+    _interval = interval
+
+def is_enabled():
+    return _enabled
+
+def get_logger(name):
+    """
+    Returns the logger of a script.
+
+    Parameters:
+    - name: Name of the script, like 'cleaner'.
+
+    Returns:
+    - A logging.Logger.
+    """
+
+    return logging.getLogger(name)
+
+def log_event(logger, level, event, **fields):
+    """
+    Logs an event with key=value fields. Nothing is formatted if the level is disabled.
+
+    Parameters:
+    - logger: The logger.
+    - level: Logging level, like logging.INFO.
+    - event: Short description of the event.
+    - fields: Values of the event.
+    """
+
+    if logger.isEnabledFor(level):
+        logger.log(level, ' '.join([event] + [f"{key}={value!r}" if isinstance(value, str) else f"{key}={value}"
+                                              for key, value in fields.items()]))
+
+def count(name, value=1, stage=''):
+    """
+    Adds value to a counter.
+
+    Parameters:
+    - name: Name of the counter, like 'files' or 'audio_seconds'.
+    - value: Amount to add.
+    - stage: Stage the counter belongs to.
+    """
+
+    if not _enabled:
+        return
+    key = (name, stage)
+    _counters[key] = _counters.get(key, 0) + value
+    _maybe_snapshot()
+
+@contextmanager
+def _timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timer = _timers.setdefault(stage, [0, 0.0, 0.0])
+        timer[0] += 1
+        timer[1] += elapsed
+        timer[2] = max(timer[2], elapsed)
+        _maybe_snapshot()
+
+_NULL_TIMER = nullcontext()
+
+def timer(stage):
+    """
+    Times a block of code: with metrics.timer('clean.denoise'): ...
+
+    Parameters:
+    - stage: Name of the timed stage, dots separate the steps of a stage.
+
+    Returns:
+    - A context manager.
+    """
+
+    return _timer(stage) if _enabled else _NULL_TIMER
+
+def collect():
+    """
+    Returns the counters and timers of this process and resets them. Called by the worker processes after each task.
+
+    Returns:
+    - A tuple of (counters, timers), or None if the metrics are disabled.
+    """
+
+    global _counters, _timers
+    if not _enabled:
+        return None
+    collected = (_counters, _timers)
+    _counters = {}
+    _timers = {}
+    return collected
+
+def merge(collected):
+    """
+    Adds the counters and timers collected in a worker process to this process.
+
+    Parameters:
+    - collected: The return value of collect(), or None.
+    """
+
+    if collected is None or not _enabled:
+        return
+    counters, timers = collected
+    for key, value in counters.items():
+        _counters[key] = _counters.get(key, 0) + value
+    for stage, (calls, total, longest) in timers.items():
+        timer = _timers.setdefault(stage, [0, 0.0, 0.0])
+        timer[0] += calls
+        timer[1] += total
+        timer[2] = max(timer[2], longest)
+    _maybe_snapshot()
+
+def init_worker(enabled):
+    """
+    Initializer of the worker processes, so the metrics are enabled in them too (spawned workers don't inherit the globals).
+
+    Parameters:
+    - enabled: is_enabled() of the main process.
+    """
+
+    global _enabled, _textfile
+    _enabled = enabled
+    # Only the main process writes snapshots.
+    _textfile = None
+
+def _maybe_snapshot():
+    global _last_snapshot
+    if _textfile is None:
+        return
+    now = time.monotonic()
+    if now - _last_snapshot >= _interval:
+        _last_snapshot = now
+        write_snapshot(_textfile)
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def snapshot_text():
+    """
+    Returns:
+    - The counters and timers in the Prometheus text format.
+    """
+
+    lines = []
+    for name in sorted({name for name, _ in _counters}):
+        metric = f"{METRIC_PREFIX}_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for (counter, stage), value in sorted(_counters.items()):
+            if counter == name:
+                lines.append(f'{metric}{{stage="{_label(stage)}"}} {value}')
+
+    if _timers:
+        for suffix, index, kind in (('calls_total', 0, 'counter'), ('seconds_total', 1, 'counter'), ('seconds_max', 2, 'gauge')):
+            metric = f"{METRIC_PREFIX}_stage_{suffix}"
+            lines.append(f"# TYPE {metric} {kind}")
+            for stage, timer in sorted(_timers.items()):
+                lines.append(f'{metric}{{stage="{_label(stage)}"}} {timer[index]}')
+
+    lines.append(f"# TYPE {METRIC_PREFIX}_snapshot_timestamp_seconds gauge")
+    lines.append(f"{METRIC_PREFIX}_snapshot_timestamp_seconds {time.time()}")
+    return '\n'.join(lines) + '\n'
+
+def write_snapshot(path):
+    """
+    Writes the metrics snapshot. It's written to a temp file first, so the scraper never reads a half written file.
+
+    Parameters:
+    - path: Path to the textfile.
+    """
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        f.write(snapshot_text())
+    os.replace(path + '.tmp', path)
+
+def profile():
+    """
+    Returns the per-stage profile of the run.
+
+    Returns:
+    - A list of (stage, calls, total seconds, mean seconds, max seconds) tuples, the slowest stage first.
+    """
+
+    rows = [(stage, calls, total, total / calls if calls else 0.0, longest) for stage, (calls, total, longest) in _timers.items()]
+    return sorted(rows, key=lambda row: -row[2])
+
+def report(logger=None):
+    """
+    Logs the per-stage profile and the counters, and writes the last snapshot.
+
+    Parameters:
+    - logger: The logger to use, the 'metrics' logger by default.
+    """
+
+    if not _enabled:
+        return
+    logger = logger if logger is not None else get_logger('metrics')
+
+    for stage, calls, total, mean, longest in profile():
+        log_event(logger, logging.INFO, "profile", stage=stage, calls=calls, seconds=round(total, 3), mean=round(mean, 4),
+                  max=round(longest, 4))
+    for (name, stage), value in sorted(_counters.items()):
+        log_event(logger, logging.INFO, "counter", name=name, stage=stage, value=round(value, 3))
+
+    if _textfile is not None:
+        write_snapshot(_textfile)
@@ -2,20 +2,57 @@ import librosa
 import numpy as np
 import pandas as pd
 import os
+from features import feature_batch, feature_frames, iter_features_batched, iter_mfcc_batched
+from resampler import DEFAULT_ENGINE, load_batch, load_resampled
+from feature_store import FeatureStoreWriter, split_segment_name, FRAMES_INDEX, INDEX_FILE
+from cache import open_cache
+from state_store import open_state, source_name
+from metrics import get_logger, log_event
+import metrics
+import logging
 
 # https://www.kaggle.com/code/super13579/mfcc-feature-extraction
 # https://github.com/rctatman/getMFCCs/blob/master/getMFCCs.py
 # https://www.youtube.com/watch?v=WJI-17MNpdE
 
-def extract_and_save_mfcc(input_dir, output_base_dir):
+logger = get_logger('mfcc')
+
+def extract_and_save_mfcc(input_dir, output_base_dir, batch_size=None, store_dir=None, manifest=None, state_db=None, sample_rate=None,
+                          resampler=DEFAULT_ENGINE, features=None, cmvn=False):
     """
     Saves the MFCC features of wav file into a csv file. (2D array)
     
     Parameters:
     - input_dir: Path to the input audio segments folder.
     - output_base_dir: Path to the output audio features.
+    - batch_size: Extract the features of this many segments at once in one vectorized pass (features.py). If it's None, librosa
+      is called for each file.
+    - store_dir: Path to a binary feature store (feature_store.py). If it's given, the features are saved into the store instead of
+      csv files.
+    - manifest: Path to the build cache manifest (cache.py). Segments that are already extracted with the same content and
+      parameters are skipped.
+    - state_db: Path to the crawl state database (state_store.py). The mfcc stage of every source file is recorded as done.
+    - sample_rate: Sampling rate the features are extracted at, the segments at another rate are resampled. By default the rate of
+      each segment (the batched mode: of the first segment of the folder).
+    - resampler: Resampler engine (resampler.py) of the segments that are resampled
+    - features: Names of the features to extract from one shared spectrogram (features.FEATURES: 'mfcc', 'delta', 'delta2',
+      'log_mel', 'centroid', 'rolloff'). They're saved as one array for each segment, the rows in the order of features.FEATURES
+      (see features.feature_rows). Only the MFCCs by default.
+    - cmvn: Normalize every row of every segment to zero mean and unit variance over its frames (per-utterance CMVN)
     """
     
+    writer = FeatureStoreWriter(store_dir) if store_dir is not None else None
+
+    cache = open_cache(manifest)
+    params = {'n_mfcc': 20, 'output': 'csv' if writer is None else 'store'}
+    if sample_rate is not None:
+        params.update(sample_rate=sample_rate, resampler=resampler)
+    if features is not None or cmvn:
+        features = tuple(features) if features is not None else ('mfcc',)
+        params.update(features=list(features), cmvn=cmvn)
+    # (segment file, output files) of the extracted segments, recorded in the cache once their outputs are complete.
+    extracted = []
+
     # Go through each accent type folder
     for accent_type in os.listdir(input_dir):
         accent_dir = os.path.join(input_dir, accent_type)
@@ -24,31 +61,211 @@ def extract_and_save_mfcc(input_dir, output_base_dir):
         
         # Create corresponding output directory
         output_dir = os.path.join(output_base_dir, accent_type)
-        if not os.path.exists(output_dir):
+        if writer is None and not os.path.exists(output_dir):
             os.makedirs(output_dir)
         
+        files = [file for file in os.listdir(accent_dir) if file.endswith('.wav')]
+        if cache is not None:
+            stale = [file for file in files if not cache.is_fresh('mfcc', os.path.join(accent_dir, file), params)]
+            if writer is not None:
+                # The store replaces all the segments of a source that is written again, so a source is extracted as a whole
+                # even if only some of its segments changed.
+                sources = {split_segment_name(os.path.splitext(file)[0])[0] for file in stale}
+                stale = [file for file in files if split_segment_name(os.path.splitext(file)[0])[0] in sources]
+            files = stale
+
+        if batch_size is not None:
+            extracted += extract_and_save_mfcc_batched(accent_dir, output_dir, batch_size, writer=writer, accent_type=accent_type,
+                                                       files=files, sample_rate=sample_rate, resampler=resampler, features=features,
+                                                       cmvn=cmvn)
+            continue
+
         # Process each audio file in the accent directory
-        for file in os.listdir(accent_dir):
+        for file in files:
             if file.endswith('.wav'):
                 file_path = os.path.join(accent_dir, file)
-                print(f"Processing: {file_path}")
+                logger.debug("Processing: %s", file_path)
                 
                 # Load the audio file
-                y, sr = librosa.load(file_path, sr=None)
+                with metrics.timer('mfcc.load'):
+                    y, sr = load_resampled(file_path, sample_rate, resampler)
                 
                 # Extract MFCC features (n_mfcc can be 13 as well)
-                mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=20)
+                with metrics.timer('mfcc.extract'):
+                    if features is None:
+                        mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=20)
+                    else:
+                        mfcc = feature_batch(y[None, :], sr, features=features, n_mfcc=20, cmvn=cmvn)[0]
 
-                print(mfcc.shape)
+                metrics.count('files', stage='mfcc')
+                metrics.count('audio_seconds', len(y) / sr, stage='mfcc')
+                log_event(logger, logging.DEBUG, "mfcc", file=file_path, shape=mfcc.shape)
                 
+                if writer is not None:
+                    writer.add(accent_type, *split_segment_name(os.path.splitext(file)[0]), mfcc)
+                    extracted.append((file_path, [os.path.join(store_dir, f"{accent_type}.f32")]))
+                    continue
+
                 # Convert the MFCC 2D array to dataframe
                 mfcc_df = pd.DataFrame(mfcc)
 
                 # Save the MFCC features as a csv file, {file_name.csv}.
                 mfcc_file_path = os.path.join(output_dir, f"{os.path.splitext(file)[0]}.csv")
                 mfcc_df.to_csv(mfcc_file_path, index=False)
-                print(f"Saved MFCC features to: {mfcc_file_path}")
+                metrics.count('bytes_written', os.path.getsize(mfcc_file_path), stage='mfcc')
+                logger.debug("Saved MFCC features to: %s", mfcc_file_path)
+                extracted.append((file_path, [mfcc_file_path]))
+
+    if writer is not None:
+        writer.close()
+        logger.info("Saved MFCC features to the feature store: %s", store_dir)
+
+    # The store's index is written on close, so the segments are recorded only now.
+    if cache is not None:
+        for file_path, outputs in extracted:
+            if writer is not None:
+                outputs = outputs + [os.path.join(store_dir, INDEX_FILE)]
+            cache.record('mfcc', file_path, params, outputs)
+        cache.save()
+
+    # The stage is recorded for the source files of the segments, (accent type, source name) for each one.
+    state = open_state(state_db)
+    if state is not None:
+        sources = {(os.path.basename(os.path.dirname(file_path)), split_segment_name(os.path.splitext(os.path.basename(file_path))[0])[0])
+                   for file_path, _ in extracted}
+        for accent_type, source_file in sorted(sources):
+            # As the cleaned file the segments were split from, a bare source name would lose everything after a '.' in the title.
+            state.set_stage('mfcc', source_file + '.wav', 'done', accent_type=accent_type)
+        state.close()
+
+def extract_and_save_mfcc_batched(accent_dir, output_dir, batch_size=256, writer=None, accent_type=None, files=None, sample_rate=None,
+                                  resampler=DEFAULT_ENGINE, features=None, cmvn=False):
+    """
+    Saves the MFCC features of the wav files of one accent folder into csv files, extracting them in batches.
+    
+    Parameters:
+    - accent_dir: Path to the input audio segments folder of one accent type.
+    - output_dir: Path to the output audio features of the accent type.
+    - batch_size: Number of segments stacked into one batch.
+    - writer: FeatureStoreWriter to save the features into instead of csv files.
+    - accent_type: Accent type of the folder, used as the key in the feature store.
+    - files: Names of the wav files to process, all the wav files of the folder by default.
+    - sample_rate: Sampling rate the features are extracted at, the rate of the first segment by default.
+    - resampler: Resampler engine (resampler.py) of the segments at another rate.
+    - features: Names of the features to extract (features.FEATURES), only the MFCCs if it's None.
+    - cmvn: Per-utterance mean and variance normalization of the features.
+
+    Returns:
+    - A list of (segment file, output files) tuples.
+    """
+
+    if files is None:
+        files = os.listdir(accent_dir)
+    files = sorted(file for file in files if file.endswith('.wav'))
+    if not files:
+        return []
+
+    # All the segments are resampled to the same rate by cleaner.py, the first one tells us which.
+    if sample_rate is None:
+        sample_rate = librosa.get_samplerate(os.path.join(accent_dir, files[0]))
+
+    def segments():
+        # Segments are loaded lazily, batch_size of them at a time, and the ones at another rate are resampled together.
+        for start in range(0, len(files), batch_size):
+            batch = files[start:start + batch_size]
+            yield from zip(batch, load_batch([os.path.join(accent_dir, file) for file in batch], sample_rate, resampler))
+
+    extracted = []
+    if features is None:
+        extracted_features = iter_mfcc_batched(segments(), sample_rate, batch_size=batch_size, n_mfcc=20)
+    else:
+        # One STFT for each batch, all the features are derived from it.
+        extracted_features = iter_features_batched(segments(), sample_rate, batch_size=batch_size, features=features, n_mfcc=20,
+                                                   cmvn=cmvn)
+
+    for file, mfcc in extracted_features:
+        metrics.count('files', stage='mfcc')
+        if writer is not None:
+            writer.add(accent_type, *split_segment_name(os.path.splitext(file)[0]), mfcc)
+            extracted.append((os.path.join(accent_dir, file), [os.path.join(writer.store_dir, f"{accent_type}.f32")]))
+            continue
+
+        mfcc_file_path = os.path.join(output_dir, f"{os.path.splitext(file)[0]}.csv")
+        pd.DataFrame(mfcc).to_csv(mfcc_file_path, index=False)
+        metrics.count('bytes_written', os.path.getsize(mfcc_file_path), stage='mfcc')
+        extracted.append((os.path.join(accent_dir, file), [mfcc_file_path]))
+
+    log_event(logger, logging.INFO, "Saved MFCC features", folder=accent_dir, segments=len(extracted))
+    return extracted
+
+def extract_and_save_frames(input_dir, store_dir, features=None, sample_rate=None, resampler=DEFAULT_ENGINE, manifest=None,
+                            state_db=None, top_db=None):
+    """
+    Saves the frame sequence of every cleaned file into a feature store, once for the whole file, instead of extracting every
+    segment. Overlapping windows of any length and hop are then cut from it when they're read (FeatureStore.windows), without
+    writing segment files or running the STFT again. See features.feature_frames for how the windows compare to the segments.
+
+    Parameters:
+    - input_dir: Path to the cleaned audio dataset, one folder for each accent type (wav files.)
+    - store_dir: Path to the feature store. The frames of a file are saved under (accent_type, source_file, FRAMES_INDEX).
+    - features: Names of the features (features.FEATURES), only the MFCCs by default
+    - sample_rate: Sampling rate the features are extracted at, the files at another rate are resampled. The rate of each file by
+      default.
+    - resampler: Resampler engine (resampler.py) of the files that are resampled
+    - manifest: Path to the build cache manifest (cache.py). Files that are already extracted with the same content and parameters
+      are skipped.
+    - state_db: Path to the crawl state database (state_store.py). The mfcc stage of every file is recorded as done.
+    - top_db: Dynamic range of the log-mel spectrogram over the whole file, None (no floor) by default. With a floor the windows of a
+      segment much quieter than the loudest part of its file differ from the segment extracted on its own.
+    """
+
+    features = tuple(features) if features is not None else ('mfcc',)
+    cache = open_cache(manifest)
+    params = {'n_mfcc': 20, 'features': list(features), 'sample_rate': sample_rate, 'resampler': resampler, 'top_db': top_db}
+
+    extracted = []
+    with FeatureStoreWriter(store_dir) as writer:
+        for accent_type in sorted(os.listdir(input_dir)):
+            accent_dir = os.path.join(input_dir, accent_type)
+            if not os.path.isdir(accent_dir):
+                continue
+
+            for file in sorted(file for file in os.listdir(accent_dir) if file.endswith('.wav')):
+                file_path = os.path.join(accent_dir, file)
+                if cache is not None and cache.is_fresh('frames', file_path, params):
+                    metrics.count('skipped', stage='frames')
+                    continue
+
+                with metrics.timer('frames.load'):
+                    y, sr = load_resampled(file_path, sample_rate, resampler)
+                with metrics.timer('frames.extract'):
+                    frames = feature_frames(y, sr, features=features, n_mfcc=20, top_db=top_db)
+
+                # Same source name as the segments of split-audio.py.
+                writer.add(accent_type, source_name(file), FRAMES_INDEX, frames)
+                extracted.append((accent_type, file_path))
+                metrics.count('files', stage='frames')
+                metrics.count('audio_seconds', len(y) / sr, stage='frames')
+                log_event(logger, logging.DEBUG, "frames", file=file_path, shape=frames.shape)
+
+    # The store's index is written on close, so the files are recorded only now.
+    if cache is not None:
+        for accent_type, file_path in extracted:
+            cache.record('frames', file_path, params, [os.path.join(store_dir, f"{accent_type}.f32"), os.path.join(store_dir, INDEX_FILE)])
+        cache.save()
+
+    state = open_state(state_db)
+    if state is not None:
+        for accent_type, file_path in extracted:
+            state.set_stage('mfcc', file_path, 'done', accent_type=accent_type)
+        state.close()
+
+    log_event(logger, logging.INFO, "Saved frame sequences", store=store_dir, files=len(extracted))
 
-input_directory = "test_cleaned_audio_segments"
-output_directory = "test_cleaned_audio_features"
-extract_and_save_mfcc(input_directory, output_directory)
+# Only when it's run as a script, so benchmark.py can load the module without extracting anything.
+if __name__ == "__main__":
+    metrics.configure(level='INFO', textfile="pipeline_metrics.prom")
+    input_directory = "test_cleaned_audio_segments"
+    output_directory = "test_cleaned_audio_features"
+    extract_and_save_mfcc(input_directory, output_directory, manifest="build_manifest.json", state_db="crawler_state.db")
+    metrics.report()
@@ -0,0 +1,247 @@
+from functools import lru_cache
+from scipy.signal import fftconvolve, stft, istft
+import numpy as np
+import os
+
+# Noise profiles for the noise reduction. nr.reduce_noise without a noise clip estimates the noise over the whole signal on every
+# call (non-stationary: a smoothed noise floor for every frequency and frame), which makes it the slowest step of the cleaning. But
+# remove_silence_array already finds the silent parts of the file, and they are exactly the noise we want to remove: their spectrum
+# is the noise profile, the mean and the standard deviation of every frequency bin in dB. With a profile, the noise reduction is a
+# stationary spectral gate, a bin is kept where the signal is above mean + n_std * std of the noise, and reduced elsewhere.
+#
+# Recordings made with the same microphone in the same room (the videos of one channel, for example) have the same noise, so a
+# profile can be kept for each such source and reused for all of its files: NoiseProfileCache, saved as an npz file. The key must be
+# a real recording source. An accent folder is not one: the crawler saves the videos of many searches, channels and playlists of an
+# accent into the same folder, and a profile shared over it gates one video's noise out of unrelated recordings and leaves the same
+# artifacts on every file of the class. clean_audio_datasets(noise_profile='origin') keys the profiles by the channel or playlist
+# URL the crawler recorded for each video in the state store (state_store.py), the videos with no known origin estimate their own.
+#
+# The gate is the same as noisereduce's stationary mode (same STFT, threshold, mask and mask smoothing), only the noise statistics
+# are precomputed, and they're kept as sums so the profiles of several files can be merged.
+
+N_FFT = 1024
+HOP_LENGTH = 256
+N_STD_THRESH = 1.5
+FREQ_MASK_SMOOTH_HZ = 500
+TIME_MASK_SMOOTH_MS = 50
+
+# Min. length of the noise (in seconds) a profile must be estimated from, less than that is too noisy to be trusted.
+MIN_NOISE_SECONDS = 2.0
+# Max. length of the noise (in seconds) used for one file, more doesn't change the statistics.
+MAX_NOISE_SECONDS = 30.0
+
+# Same chunks as noisereduce, so the whole STFT of a long file is never in memory. The padding is thrown away after gating.
+CHUNK_SIZE = 600000
+PADDING = 30000
+
+def _stft(samples):
+    return stft(samples, nperseg=N_FFT, noverlap=N_FFT - HOP_LENGTH, padded=False)[2]
+
+def _amp_to_db(spectrum, top_db=80.0):
+    # Same as noisereduce: dB of the magnitude, at most top_db below the loudest frame of each frequency bin.
+    spectrum_db = 20 * np.log10(np.abs(spectrum) + np.finfo(np.float64).eps)
+    return np.maximum(spectrum_db, np.max(spectrum_db, axis=-1, keepdims=True) - top_db)
+
+class NoiseProfile:
+    """
+    Spectrum of the noise of a recording, the dB statistics of every frequency bin. The sums are kept instead of the mean and the
+    standard deviation, so the profiles of several files can be merged.
+
+    Parameters:
+    - sample_rate: Sampling rate of the audio the profile is for.
+    - frames: Number of STFT frames the profile is estimated from.
+    - db_sum: Sum of the dB values of every frequency bin.
+    - db_square_sum: Sum of the squared dB values of every frequency bin.
+    """
+
+    def __init__(self, sample_rate, frames, db_sum, db_square_sum):
+        self.sample_rate = sample_rate
+        self.frames = frames
+        self.db_sum = db_sum
+        self.db_square_sum = db_square_sum
+
+    @property
+    def seconds(self):
+        return self.frames * HOP_LENGTH / self.sample_rate
+
+    def threshold(self, n_std_thresh=N_STD_THRESH):
+        """
+        Returns:
+        - The gate threshold of every frequency bin in dB, mean + n_std_thresh * std of the noise.
+        """
+
+        mean = self.db_sum / self.frames
+        std = np.sqrt(np.maximum(self.db_square_sum / self.frames - mean ** 2, 0.0))
+        return mean + n_std_thresh * std
+
+    def merge(self, other):
+        """
+        Returns the profile of both recordings together.
+        """
+
+        if other.sample_rate != self.sample_rate:
+            raise ValueError(f"Can't merge noise profiles of {self.sample_rate} Hz and {other.sample_rate} Hz")
+        return NoiseProfile(self.sample_rate, self.frames + other.frames, self.db_sum + other.db_sum,
+                            self.db_square_sum + other.db_square_sum)
+
+def silent_samples(samples, sample_rate, silent_intervals, max_seconds=MAX_NOISE_SECONDS):
+    """
+    Joins the silent parts of an audio buffer.
+
+    Parameters:
+    - samples: Mono float32 audio buffer
+    - sample_rate: Sampling rate of the buffer
+    - silent_intervals: [start, end] intervals in milliseconds, as returned by detect_silence_array
+    - max_seconds: Max. length of the result (in seconds)
+
+    Returns:
+    - A mono float32 buffer of the silent parts.
+    """
+
+    limit = int(max_seconds * sample_rate)
+    parts = []
+    length = 0
+    for start, end in silent_intervals:
+        part = samples[int(start * sample_rate / 1000):int(end * sample_rate / 1000)][:limit - length]
+        parts.append(part)
+        length += len(part)
+        if length >= limit:
+            break
+    return np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)
+
+def estimate_noise_profile(noise, sample_rate, min_seconds=MIN_NOISE_SECONDS):
+    """
+    Estimates the noise profile of a recording from its silent parts.
+
+    Parameters:
+    - noise: Mono float32 buffer of noise only, see silent_samples
+    - sample_rate: Sampling rate of the buffer
+    - min_seconds: Min. length of the noise (in seconds)
+
+    Returns:
+    - A NoiseProfile, or None if there is less than min_seconds of noise.
+    """
+
+    if len(noise) < max(int(min_seconds * sample_rate), N_FFT):
+        return None
+
+    noise_db = _amp_to_db(_stft(noise.astype(np.float32, copy=False))).astype(np.float64)
+    return NoiseProfile(sample_rate, noise_db.shape[1], noise_db.sum(axis=1), np.square(noise_db).sum(axis=1))
+
+@lru_cache(maxsize=None)
+def _smoothing_filter(sample_rate):
+    # Same triangular filter as noisereduce: FREQ_MASK_SMOOTH_HZ across the bins, TIME_MASK_SMOOTH_MS across the frames.
+    n_grad_freq = max(int(FREQ_MASK_SMOOTH_HZ / (sample_rate / (N_FFT / 2))), 1)
+    n_grad_time = max(int(TIME_MASK_SMOOTH_MS / (HOP_LENGTH / sample_rate * 1000)), 1)
+    if n_grad_freq == 1 and n_grad_time == 1:
+        return None
+
+    def ramp(n_grad):
+        return np.concatenate([np.linspace(0, 1, n_grad + 1, endpoint=False), np.linspace(1, 0, n_grad + 2)])[1:-1]
+
+    smoothing_filter = np.outer(ramp(n_grad_freq), ramp(n_grad_time))
+    return smoothing_filter / np.sum(smoothing_filter)
+
+def _gate(chunk, threshold, prop_decrease, smoothing_filter):
+    spectrum = _stft(chunk)
+
+    # Bins above the threshold are kept, the others are reduced by prop_decrease.
+    mask = (_amp_to_db(spectrum) > threshold[:, None]) * prop_decrease + (1.0 - prop_decrease)
+    if smoothing_filter is not None:
+        mask = fftconvolve(mask, smoothing_filter, mode='same')
+
+    denoised = istft(spectrum * mask, nperseg=N_FFT, noverlap=N_FFT - HOP_LENGTH)[1]
+    output = np.zeros(len(chunk), dtype=np.float32)
+    output[:min(len(denoised), len(chunk))] = denoised[:len(chunk)]
+    return output
+
+def spectral_gate(samples, sample_rate, profile, prop_decrease=1.0, n_std_thresh=N_STD_THRESH):
+    """
+    Reduces the noise of an audio buffer with a precomputed noise profile (stationary spectral gating).
+
+    Parameters:
+    - samples: Mono float32 audio buffer
+    - sample_rate: Sampling rate of the buffer, must be the one of the profile
+    - profile: NoiseProfile of the recording
+    - prop_decrease: The proportion to reduce the noise by (1.0 = 100%)
+    - n_std_thresh: Number of standard deviations above the mean of the noise a bin must be to be kept
+
+    Returns:
+    - The denoised buffer.
+    """
+
+    if profile.sample_rate != sample_rate:
+        raise ValueError(f"Noise profile is for {profile.sample_rate} Hz, the audio is {sample_rate} Hz")
+
+    threshold = profile.threshold(n_std_thresh)
+    smoothing_filter = _smoothing_filter(sample_rate)
+    samples = samples.astype(np.float32, copy=False)
+
+    output = np.empty(len(samples), dtype=np.float32)
+    for start in range(0, len(samples), CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, len(samples))
+        # Zero padding at the edges of the buffer, like noisereduce.
+        padded = np.zeros(end - start + 2 * PADDING, dtype=np.float32)
+        context_start = max(start - PADDING, 0)
+        context = samples[context_start:min(end + PADDING, len(samples))]
+        offset = context_start - (start - PADDING)
+        padded[offset:offset + len(context)] = context
+        output[start:end] = _gate(padded, threshold, prop_decrease, smoothing_filter)[PADDING:PADDING + end - start]
+    return output
+
+class NoiseProfileCache:
+    """
+    Noise profiles of the sources, reused for all the files of a source. The key of a source is up to the caller, and it must name
+    one recording setup (a channel, for example). Don't key it by the accent folder, which holds the videos of many unrelated
+    searches, channels and playlists.
+
+    Parameters:
+    - path: Path to the npz file the profiles are saved to, or None to keep them only in memory.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.profiles = {}
+        if path is not None and os.path.exists(path):
+            with np.load(path) as data:
+                for key, sample_rate, frames, db_sum, db_square_sum in zip(data['keys'], data['sample_rates'], data['frames'],
+                                                                            data['db_sums'], data['db_square_sums']):
+                    self.profiles[str(key)] = NoiseProfile(int(sample_rate), int(frames), db_sum, db_square_sum)
+
+    def get(self, key, sample_rate):
+        """
+        Returns the profile of a source, or None if there is none for this sampling rate.
+        """
+
+        profile = self.profiles.get(key)
+        if profile is None or profile.sample_rate != sample_rate:
+            return None
+        return profile
+
+    def add(self, key, profile):
+        """
+        Adds the profile of a file to the profile of its source.
+        """
+
+        current = self.get(key, profile.sample_rate)
+        self.profiles[key] = profile if current is None else current.merge(profile)
+
+    def save(self):
+        """
+        Saves the profiles. It's written to a temp file first so a crash never leaves a half written file behind.
+        """
+
+        if self.path is None:
+            return
+        keys = sorted(self.profiles)
+        profiles = [self.profiles[key] for key in keys]
+        with open(self.path + '.tmp', 'wb') as f:
+            np.savez(f, keys=np.array(keys, dtype=str),
+                     sample_rates=np.array([profile.sample_rate for profile in profiles], dtype=np.int64),
+                     frames=np.array([profile.frames for profile in profiles], dtype=np.int64),
+                     db_sums=np.array([profile.db_sum for profile in profiles]).reshape(-1, N_FFT // 2 + 1),
+                     db_square_sums=np.array([profile.db_square_sum for profile in profiles]).reshape(-1, N_FFT // 2 + 1))
+        os.replace(self.path + '.tmp', self.path)
+
+    def __len__(self):
+        return len(self.profiles)
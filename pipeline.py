@@ -0,0 +1,271 @@
+from cleaner import load_audio, remove_silence_array, reduce_noise_array, normalize_array, list_audio_files
+from noise_profile import estimate_noise_profile, silent_samples
+from resampler import DEFAULT_ENGINE
+from features import feature_batch, iter_features_batched, iter_mfcc_batched
+from feature_store import FeatureStoreWriter, INDEX_FILE
+from cache import open_cache
+from state_store import open_state, source_name
+from segmenter import iter_segments
+from metrics import get_logger, log_event
+from concurrent.futures import ProcessPoolExecutor
+import soundfile as sf
+import pandas as pd
+import librosa
+import inspect
+import metrics
+import logging
+import os
+
+logger = get_logger('pipeline')
+
+# Fused version of cleaner.py -> split-audio.py -> mfcc-feature-extraction.py. Each source file is decoded once, cleaned in memory,
+# cut into segments and the MFCC features are extracted from the segments directly, without writing and reloading a wav file for
+# every 5 second segment.
+
+def extract_mfcc(samples, sample_rate, n_mfcc=20):
+    """
+    Extracts the MFCC features of an in-memory audio buffer, same as extract_and_save_mfcc.
+
+    Parameters:
+    - samples: Mono float32 audio buffer
+    - sample_rate: Sampling rate of the buffer
+    - n_mfcc: Number of MFCC coefficients
+
+    Returns:
+    - MFCC features (2D array, n_mfcc x frames)
+    """
+
+    return librosa.feature.mfcc(y=samples, sr=sample_rate, n_mfcc=n_mfcc)
+
+def iter_file_features(input_file, segments_dir=None, sample_rate=16000, segment_length_ms=5000, n_mfcc=20,
+                       noise_reduction_strength=0.5, batch_size=64, tail='keep', noise_profile=None, resampler=DEFAULT_ENGINE,
+                       features=None, cmvn=False):
+    """
+    Cleans, splits and extracts the MFCC features of a single audio file in one pass.
+
+    Parameters:
+    - input_file: Path to the input audio file
+    - segments_dir: Path to save the segment wav files, segments are not written if it's None
+    - sample_rate: Sampling rate of the cleaned audio ( 16Khz by default. )
+    - segment_length_ms: Segment length for each audio
+    - n_mfcc: Number of MFCC coefficients
+    - noise_reduction_strength: The proportion to reduce the noise by (1.0 = 100%)
+    - batch_size: Number of segments stacked into one MFCC batch (features.py), librosa is called for each segment if it's None
+    - tail: What to do with the last segment if it's shorter than segment_length_ms, see segmenter.py
+    - noise_profile: 'silence' to gate the noise with a profile estimated from the file's silent parts (noise_profile.py) instead
+      of letting noisereduce estimate it over the whole file
+    - resampler: Resampler engine (resampler.py)
+    - features: Names of the features to extract from one shared spectrogram (features.FEATURES), only the MFCCs if it's None
+    - cmvn: Per-utterance mean and variance normalization of the features (features.feature_batch)
+
+    Returns:
+    - A generator of (segment_count, mfcc) tuples, (segment_count, features) with features.
+    """
+
+    with metrics.timer('pipeline.decode'):
+        samples, sr = load_audio(input_file, sample_rate=sample_rate, resampler=resampler)
+    metrics.count('audio_seconds', len(samples) / sr, stage='pipeline')
+    with metrics.timer('pipeline.clean'):
+        cleaned, silent_intervals = remove_silence_array(samples, sr, return_silent=True)
+        profile = None
+        if noise_profile == 'silence':
+            profile = estimate_noise_profile(silent_samples(samples, sr, silent_intervals), sr)
+        samples = reduce_noise_array(cleaned, sr, noise_reduction_strength=noise_reduction_strength, noise_profile=profile)
+        del cleaned
+        samples = normalize_array(samples)
+
+    # Same naming as split-audio.py and mfcc-feature-extraction.py: {file_name}_segment_{segment_count}
+    base_name = source_name(input_file)
+
+    def segments():
+        for segment_count, segment in iter_segments(samples, sr, segment_length_ms=segment_length_ms, tail=tail):
+            if segments_dir is not None:
+                sf.write(os.path.join(segments_dir, f"{base_name}_segment_{segment_count}.wav"), segment, sr, subtype='PCM_16')
+            yield segment_count, segment
+
+    if features is not None or cmvn:
+        features = tuple(features) if features is not None else ('mfcc',)
+        if batch_size is None:
+            for segment_count, segment in segments():
+                yield segment_count, feature_batch(segment[None, :], sr, features=features, n_mfcc=n_mfcc, cmvn=cmvn)[0]
+        else:
+            yield from iter_features_batched(segments(), sr, batch_size=batch_size, features=features, n_mfcc=n_mfcc, cmvn=cmvn)
+    elif batch_size is None:
+        for segment_count, segment in segments():
+            yield segment_count, extract_mfcc(segment, sr, n_mfcc=n_mfcc)
+    else:
+        yield from iter_mfcc_batched(segments(), sr, batch_size=batch_size, n_mfcc=n_mfcc)
+
+def process_file(input_file, features_dir, segments_dir=None, **options):
+    """
+    Cleans, splits and extracts the MFCC features of a single audio file and saves them as csv files.
+
+    Parameters:
+    - input_file: Path to the input audio file
+    - features_dir: Path to save the MFCC csv files
+    - segments_dir: Path to save the segment wav files, segments are not written if it's None
+    - options: Keyword arguments passed to iter_file_features
+
+    Returns:
+    - Number of segments written.
+    """
+
+    base_name = source_name(input_file)
+
+    written = 0
+    for segment_count, mfcc in iter_file_features(input_file, segments_dir=segments_dir, **options):
+        pd.DataFrame(mfcc).to_csv(os.path.join(features_dir, f"{base_name}_segment_{segment_count}.csv"), index=False)
+        written += 1
+
+    return written
+
+def _process_task(task):
+    """
+    Worker of run_pipeline. Processes one file and returns its error instead of raising it.
+
+    Parameters:
+    - task: A tuple of (input_file, features_dir, segments_dir, options). If features_dir is None, the features are returned to
+      the main process instead of being saved as csv files.
+
+    Returns:
+    - A tuple of (input_file, segment_count, features, error, collected metrics). features is a list of (segment_count, mfcc)
+      tuples, or None if the features are saved as csv files. error is None if the file is processed successfully.
+    """
+
+    input_file, features_dir, segments_dir, options = task
+    try:
+        with metrics.timer('pipeline'):
+            if features_dir is None:
+                features = list(iter_file_features(input_file, segments_dir=segments_dir, **options))
+                return input_file, len(features), features, None, metrics.collect()
+            segment_count = process_file(input_file, features_dir, segments_dir=segments_dir, **options)
+        return input_file, segment_count, None, None, metrics.collect()
+    except Exception as e:
+        return input_file, 0, None, f"{type(e).__name__}: {e}", metrics.collect()
+
+def _pipeline_params(options, store_dir):
+    # Every parameter that changes the output of a file: the options with the defaults of iter_file_features filled in, plus
+    # where the features go.
+    params = {
+        name: parameter.default for name, parameter in inspect.signature(iter_file_features).parameters.items()
+        if parameter.default is not inspect.Parameter.empty and name != 'segments_dir'
+    }
+    params.update(options)
+    params['output'] = 'csv' if store_dir is None else 'store'
+    return params
+
+def run_pipeline(input_base_dir, features_base_dir=None, segments_base_dir=None, accent_types=None, workers=None, store_dir=None,
+                 manifest=None, state_db=None, **options):
+    """
+    Runs the fused clean -> split -> MFCC pipeline over every accent folder with a pool of worker processes.
+
+    Parameters:
+    - input_base_dir: Path to the input audio dataset, one folder for each accent type (mp3 or wav files.)
+    - features_base_dir: Path to the output audio features as csv files, same folder structure as input_base_dir
+    - segments_base_dir: Path to the output audio segments, segments are not written if it's None
+    - accent_types: List of accent folders to process, all of them by default
+    - workers: Number of worker processes, os.cpu_count() by default
+    - store_dir: Path to a binary feature store (feature_store.py). If it's given, the features are saved into the store instead of
+      csv files.
+    - manifest: Path to the build cache manifest (cache.py). Files that are already processed with the same content and
+      parameters are skipped.
+    - state_db: Path to the crawl state database (state_store.py). The pipeline stage of every file is recorded as done or failed.
+    - options: Keyword arguments passed to iter_file_features (sample_rate, segment_length_ms, n_mfcc, noise_reduction_strength,
+      batch_size, tail)
+
+    Returns:
+    - A list of (input_file, error) tuples for the files that couldn't be processed, sorted by input_file.
+    """
+
+    if features_base_dir is None and store_dir is None:
+        raise ValueError("Either features_base_dir or store_dir must be given.")
+
+    if accent_types is None:
+        accent_types = [name for name in os.listdir(input_base_dir) if os.path.isdir(os.path.join(input_base_dir, name))]
+
+    cache = open_cache(manifest)
+    params = _pipeline_params(options, store_dir)
+
+    tasks = []
+    task_accent_types = []
+    skipped = 0
+    for accent_type in sorted(accent_types):
+        # The workers only save csv files, features for the store are sent back and written here by a single writer.
+        features_dir = None
+        if store_dir is None:
+            features_dir = os.path.join(features_base_dir, accent_type)
+            os.makedirs(features_dir, exist_ok=True)
+
+        segments_dir = None
+        if segments_base_dir is not None:
+            segments_dir = os.path.join(segments_base_dir, accent_type)
+            os.makedirs(segments_dir, exist_ok=True)
+
+        for file in list_audio_files(os.path.join(input_base_dir, accent_type)):
+            if cache is not None and cache.is_fresh('pipeline', file, params):
+                skipped += 1
+                continue
+            tasks.append((file, features_dir, segments_dir, options))
+            task_accent_types.append(accent_type)
+
+    writer = FeatureStoreWriter(store_dir) if store_dir is not None else None
+
+    failures = []
+    failed = []
+    processed = []
+    total_segments = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=metrics.init_worker, initargs=(metrics.is_enabled(),)) as executor:
+        results = executor.map(_process_task, tasks, chunksize=1)
+        for (_, features_dir, _, _), accent_type, (input_file, segment_count, features, error, collected) in zip(tasks, task_accent_types,
+                                                                                                              results):
+            metrics.merge(collected)
+            total_segments += segment_count
+            if error is not None:
+                failures.append((input_file, error))
+                failed.append((input_file, accent_type, error))
+                metrics.count('failures', stage='pipeline')
+                log_event(logger, logging.WARNING, "pipeline failed", file=input_file, error=error.splitlines()[0])
+                continue
+
+            metrics.count('files', stage='pipeline')
+            metrics.count('segments', segment_count, stage='pipeline')
+            log_event(logger, logging.DEBUG, "processed", file=input_file, segments=segment_count)
+
+            source_file = source_name(input_file)
+            if writer is not None:
+                # All the old segments of the file are replaced, even if it has fewer (or no) segments now.
+                writer.replace(accent_type, source_file)
+                for segment_index, mfcc in features:
+                    writer.add(accent_type, source_file, segment_index, mfcc)
+                outputs = [os.path.join(store_dir, f"{accent_type}.f32"), os.path.join(store_dir, INDEX_FILE)]
+            else:
+                outputs = [os.path.join(features_dir, f"{source_file}_segment_{i}.csv") for i in range(segment_count)]
+            processed.append((input_file, accent_type, outputs))
+
+    if writer is not None:
+        writer.close()
+
+    # The store's index is written on close, so the files are recorded only now.
+    if cache is not None:
+        for input_file, _, outputs in processed:
+            cache.record('pipeline', input_file, params, outputs)
+        cache.save()
+
+    state = open_state(state_db)
+    if state is not None:
+        for input_file, accent_type, _ in processed:
+            state.set_stage('pipeline', input_file, 'done', accent_type=accent_type)
+        for input_file, accent_type, error in failed:
+            state.set_stage('pipeline', input_file, 'failed', error=error, accent_type=accent_type)
+        state.close()
+
+    metrics.count('skipped', skipped, stage='pipeline')
+    log_event(logger, logging.INFO, "pipeline finished", processed=len(tasks) - len(failures), files=len(tasks), failed=len(failures),
+              segments=total_segments, unchanged=skipped)
+    return failures
+
+if __name__ == "__main__":
+    metrics.configure(level='INFO', textfile="pipeline_metrics.prom")
+    run_pipeline("audio_files", store_dir="cleaned_audio_feature_store", manifest="build_manifest.json", state_db="crawler_state.db",
+                 tail='pad')
+    metrics.report()
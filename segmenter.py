@@ -0,0 +1,81 @@
+import numpy as np
+
+# Fixed-length segmentation of a decoded signal. The full segments are a reshaped view of the signal, so no sample is copied, and the
+# last, shorter part of the signal (the tail) is handled by a tail policy:
+# - keep: the tail is a shorter last segment, same as split-audio.py always did.
+# - drop: the tail is thrown away.
+# - pad: the tail is zero-padded to the segment length.
+# - merge: the tail is appended to the previous segment, the last segment is longer than the others.
+# With drop and pad every segment has the same shape, which is what batched feature extraction and training need.
+
+TAIL_POLICIES = ('keep', 'drop', 'pad', 'merge')
+
+def segment_length_samples(sample_rate, segment_length_ms):
+    """
+    Returns:
+    - Segment length in samples.
+    """
+
+    return segment_length_ms * sample_rate // 1000
+
+def split_signal(samples, sample_rate, segment_length_ms=5000, tail='keep'):
+    """
+    Splits a signal into fixed-length segments.
+
+    Parameters:
+    - samples: Audio buffer, (frames,) or (frames, channels)
+    - sample_rate: Sampling rate of the buffer
+    - segment_length_ms: Segment length for each audio
+    - tail: What to do with the last, shorter part of the signal, one of TAIL_POLICIES
+
+    Returns:
+    - A tuple of (segments, last). segments is a view of samples with one row for each full segment,
+      (count, segment_length) or (count, segment_length, channels). last is the extra last segment made from the tail, or None.
+      With the merge policy, last replaces the last row of segments, which is then left out of segments.
+    """
+
+    if tail not in TAIL_POLICIES:
+        raise ValueError(f"Unknown tail policy: {tail}, must be one of {TAIL_POLICIES}")
+
+    segment_length = segment_length_samples(sample_rate, segment_length_ms)
+    count = len(samples) // segment_length
+    end = count * segment_length
+
+    # Reshaping the contiguous part of the signal is a view, the segments share the memory of samples.
+    segments = samples[:end].reshape((count, segment_length) + samples.shape[1:])
+    rest = samples[end:]
+
+    if len(rest) == 0 or tail == 'drop':
+        return segments, None
+
+    if tail == 'pad':
+        padded = np.zeros((segment_length,) + samples.shape[1:], dtype=samples.dtype)
+        padded[:len(rest)] = rest
+        return segments, padded
+
+    if tail == 'merge' and count > 0:
+        # The previous segment and the tail are contiguous in samples, so this is a view as well.
+        return segments[:-1], samples[end - segment_length:]
+
+    # keep, or merge with nothing to merge with.
+    return segments, rest
+
+def iter_segments(samples, sample_rate, segment_length_ms=5000, tail='keep'):
+    """
+    Yields fixed-length segments of an audio buffer.
+
+    Parameters:
+    - samples: Audio buffer, (frames,) or (frames, channels)
+    - sample_rate: Sampling rate of the buffer
+    - segment_length_ms: Segment length for each audio
+    - tail: What to do with the last, shorter part of the signal, one of TAIL_POLICIES
+
+    Returns:
+    - A generator of (segment_count, segment) tuples.
+    """
+
+    segments, last = split_signal(samples, sample_rate, segment_length_ms=segment_length_ms, tail=tail)
+    for segment_count, segment in enumerate(segments):
+        yield segment_count, segment
+    if last is not None:
+        yield len(segments), last
@@ -1,8 +1,18 @@
-from pydub import AudioSegment
+import soundfile as sf
 import os
 import glob
+from cache import open_cache
+from state_store import open_state, source_name
+from segmenter import iter_segments
+from resampler import DEFAULT_ENGINE, resample
+from metrics import get_logger, log_event
+import metrics
+import logging
 
-def split_audio_files(folder_path, accent_type, segment_length_ms=5000, output_dir='cleaned_audio_segments'):
+logger = get_logger('split_audio')
+
+def split_audio_files(folder_path, accent_type, segment_length_ms=5000, output_dir='cleaned_audio_segments', manifest=None,
+                      tail='keep', state_db=None, sample_rate=None, resampler=DEFAULT_ENGINE):
     """
     Splits the audio into segments and saves it to output_base_dir.
     
@@ -11,6 +21,14 @@ def split_audio_files(folder_path, accent_type, segment_length_ms=5000, output_d
     - accent_type: Type of accent in the audio dataset
     - segment_length_ms: Segment length for each audio
     - output_dir: Path to the output audio dataset
+    - manifest: Path to the build cache manifest (cache.py). Files that are already split with the same content and
+      parameters are skipped.
+    - tail: What to do with the last segment if it's shorter than segment_length_ms: 'keep', 'drop', 'pad' (with zeros) or
+      'merge' (with the previous segment). See segmenter.py.
+    - state_db: Path to the crawl state database (state_store.py). The split stage of every file is recorded as done.
+    - sample_rate: Sampling rate of the segments. The files at another rate are resampled, the segments keep the rate of their file
+      if it's None.
+    - resampler: Resampler engine (resampler.py) of the files that are resampled
     """
     try:
         # Get a list of all .wav files in the specified folder
@@ -22,26 +40,76 @@ def split_audio_files(folder_path, accent_type, segment_length_ms=5000, output_d
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
+        cache = open_cache(manifest)
+        params = {'segment_length_ms': segment_length_ms, 'tail': tail}
+        if sample_rate is not None:
+            params.update(sample_rate=sample_rate, resampler=resampler)
+        state = open_state(state_db)
+
         for audio_file in audio_files:
-            audio = AudioSegment.from_file(audio_file)
-            # Get the total_length of the audio file in ms.
-            total_length = len(audio)
-            segment_count = 0
-            
-            for i in range(0, total_length, segment_length_ms):
-                segment = audio[i:i + segment_length_ms]
-
-                # Create a segment file in the output_dir with the name of the wav input file and replace the first '.' part with
-                # _segment_{segment_count} and save the segment into it.
-                segment_file = os.path.join(output_dir, f"{os.path.basename(audio_file).split('.')[0]}_segment_{segment_count}.wav")
-                segment.export(segment_file, format='wav')
-                segment_count += 1
-                print(f"Exported: {segment_file}")
+            if cache is not None and cache.is_fresh('split', audio_file, params):
+                logger.debug("Skipping %s, already split.", audio_file)
+                metrics.count('skipped', stage='split')
+                continue
+
+            # Read the samples as they are stored (16 bit PCM for the cleaned files), so the segments are written back bit-exact.
+            info = sf.info(audio_file)
+            with metrics.timer('split.read'):
+                if sample_rate is None or info.samplerate == sample_rate:
+                    samples, sr = sf.read(audio_file, dtype='int16' if info.subtype == 'PCM_16' else 'float32')
+                else:
+                    # Through the same resampler as the cleaning, written back in the file's sample format.
+                    samples, sr = sf.read(audio_file, dtype='float32')
+                    samples, sr = resample(samples.T, sr, sample_rate, resampler).T, sample_rate
+            segment_files = []
+
+            # Segments are views of samples, nothing is copied until they are written.
+            with metrics.timer('split.write'):
+                for segment_count, segment in iter_segments(samples, sr, segment_length_ms=segment_length_ms, tail=tail):
+                    # Create a segment file in the output_dir with the name of the wav input file and replace the extension with
+                    # _segment_{segment_count} and save the segment into it. Only the extension: titles like "Dr. Smith ..." and
+                    # "Dr. Jones ..." must not end up with the same name.
+                    segment_file = os.path.join(output_dir, f"{source_name(audio_file)}_segment_{segment_count}.wav")
+                    write_segment(segment_file, segment, sr, info.subtype)
+                    segment_files.append(segment_file)
+
+            metrics.count('files', stage='split')
+            metrics.count('audio_seconds', len(samples) / sr, stage='split')
+            metrics.count('segments', len(segment_files), stage='split')
+            log_event(logger, logging.DEBUG, "split", file=audio_file, segments=len(segment_files))
+
+            if cache is not None:
+                cache.record('split', audio_file, params, segment_files)
+            if state is not None:
+                state.set_stage('split', audio_file, 'done', accent_type=accent_type)
+
+        if cache is not None:
+            cache.save()
+        if state is not None:
+            state.close()
         
-        print("Audio splitting completed.")
+        logger.info("Audio splitting completed.")
     except Exception as e:
-        print(f"Error splitting audio: {e}")
+        metrics.count('failures', stage='split')
+        log_event(logger, logging.WARNING, "split failed", folder=folder_path, error=f"{type(e).__name__}: {e}")
+
+def write_segment(segment_file, segment, sample_rate, subtype='PCM_16'):
+    """
+    Writes a segment as a wav file. Every segment goes through here, so they are all written the same way.
+    
+    Parameters:
+    - segment_file: Path to save the segment
+    - segment: Audio buffer of the segment
+    - sample_rate: Sampling rate of the segment
+    - subtype: Sample format of the wav file
+    """
+
+    sf.write(segment_file, segment, sample_rate, subtype=subtype, format='WAV')
 
-folder_path = "cleaned_audio_files/Australian"
-accent_type = "Australian"
-split_audio_files(folder_path, accent_type)
\ No newline at end of file
+# Only when it's run as a script, so benchmark.py can load the module without splitting anything.
+if __name__ == "__main__":
+    metrics.configure(level='INFO', textfile="pipeline_metrics.prom")
+    folder_path = "cleaned_audio_files/Australian"
+    accent_type = "Australian"
+    split_audio_files(folder_path, accent_type, manifest="build_manifest.json", tail='pad', state_db="crawler_state.db")
+    metrics.report()
@@ -0,0 +1,402 @@
+import sqlite3
+import time
+import os
+from metrics import get_logger
+
+logger = get_logger('state_store')
+
+# Crawl and processing state in one SQLite database, instead of downloaded_videos.txt. It records every video the crawler tried to
+# download (title, accent type, file path, duration, failure reason) and which stages (clean, split, mfcc, pipeline) finished for
+# every source file, so a run can continue exactly where the last one stopped, and "what still needs cleaning" is one query.
+#
+# The database is in WAL mode: readers never block the writer, and several processes (the crawler and the stage scripts) can write
+# at the same time, a writer waits for the others for up to timeout seconds instead of failing. Each record is its own short
+# transaction, so a crash loses at most the record being written.
+#
+# Stage rows are keyed by the accent type and the source name, the file name without its extension, which is what the segment and
+# feature files are named after (split-audio.py, feature_store.py). That way a segment or a cleaned file finds its video without
+# knowing the URL. The accent type is part of the key because two videos can have the same title in different accent folders. It's
+# '' when it's not known.
+#
+# The origin of a video is the channel or playlist URL the crawler found it on: the videos of one origin are usually recorded with the
+# same setup, so they can share a noise profile (noise_profile.py). It's NULL for search results, which come from anywhere.
+
+STAGES = ('clean', 'split', 'mfcc', 'pipeline')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    url TEXT PRIMARY KEY,
+    accent_type TEXT,
+    title TEXT,
+    source TEXT,
+    origin TEXT,
+    file_path TEXT,
+    duration REAL,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS videos_status ON videos (status, accent_type);
+CREATE INDEX IF NOT EXISTS videos_source ON videos (source);
+
+CREATE TABLE IF NOT EXISTS stages (
+    source TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    accent_type TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (accent_type, source, stage)
+);
+CREATE INDEX IF NOT EXISTS stages_status ON stages (stage, status);
+
+CREATE TABLE IF NOT EXISTS imports (
+    path TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    imported_at REAL NOT NULL
+);
+"""
+
+def source_name(file_path):
+    """
+    Returns the source name of an audio file, the name its segments and features are saved under.
+
+    Parameters:
+    - file_path: Path to the audio file.
+
+    Returns:
+    - The file name without its extension. Only the extension is removed, the titles of two videos can have the same part before
+      their first '.' ("Dr. Smith ..." and "Dr. Jones ...").
+    """
+
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+class StateStore:
+    """
+    SQLite store of the crawl and processing state. Use it as a context manager, the connection is closed when it's closed.
+
+    Parameters:
+    - db_path: Path to the database file, it's created if it doesn't exist.
+    - timeout: Seconds to wait for another process that is writing.
+    """
+
+    def __init__(self, db_path, timeout=30):
+        self.db_path = db_path
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+
+        # isolation_level=None: every statement commits by itself, the multi-statement writes use explicit transactions.
+        self.connection = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is safe in WAL mode, a power cut can lose the last commits but never corrupts the database.
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self._migrate_stages()
+        self.connection.executescript(SCHEMA)
+        self._migrate_videos()
+        self._migrate_sources()
+
+    def _migrate_stages(self):
+        # Databases of older versions have the stages keyed by (source, stage) only, their rows are copied into the new table.
+        columns = {name: pk for _, name, _, _, _, pk in self.connection.execute("PRAGMA table_info(stages)")}
+        if not columns or columns.get('accent_type'):
+            return
+
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.execute("ALTER TABLE stages RENAME TO stages_old")
+            self.connection.execute("DROP INDEX IF EXISTS stages_status")
+            for statement in SCHEMA.split(';'):
+                if 'stages' in statement:
+                    self.connection.execute(statement)
+            self.connection.execute(
+                """
+                INSERT INTO stages (source, stage, accent_type, status, error, updated_at)
+                SELECT source, stage, COALESCE(accent_type, ''), status, error, updated_at FROM stages_old
+                """
+            )
+            self.connection.execute("DROP TABLE stages_old")
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        logger.info("Added the accent type to the key of the stages in %s.", self.db_path)
+
+    def _migrate_videos(self):
+        # Databases of older versions have no origin column, their videos have no known origin.
+        columns = {name for _, name, _, _, _, _ in self.connection.execute("PRAGMA table_info(videos)")}
+        if 'origin' not in columns:
+            self.connection.execute("ALTER TABLE videos ADD COLUMN origin TEXT")
+
+    def _migrate_sources(self):
+        # Databases of older versions named the sources up to the first '.' of the file name. The videos get their new source name
+        # from their file path, and the stage rows follow them. A stage row whose old name was shared by several videos can't be
+        # told apart, it's dropped and the stage runs again for them.
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] >= 1:
+            return
+
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            renames = {}
+            rows = self.connection.execute("SELECT url, COALESCE(accent_type, ''), file_path FROM videos WHERE file_path IS NOT NULL")
+            for url, accent_type, file_path in rows.fetchall():
+                source = source_name(file_path)
+                self.connection.execute("UPDATE videos SET source = ? WHERE url = ?", (source, url))
+                renames.setdefault((accent_type, os.path.basename(file_path).split('.')[0]), set()).add(source)
+
+            for (accent_type, old_source), sources in renames.items():
+                if sources == {old_source}:
+                    continue
+                if len(sources) == 1:
+                    # The row of the new name wins if there is already one.
+                    self.connection.execute("UPDATE OR REPLACE stages SET source = ? WHERE accent_type = ? AND source = ?",
+                                            (next(iter(sources)), accent_type, old_source))
+                else:
+                    self.connection.execute("DELETE FROM stages WHERE accent_type = ? AND source = ?", (accent_type, old_source))
+            self.connection.execute("PRAGMA user_version = 1")
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def import_txt(self, txt_path, accent_type=None):
+        """
+        Imports the URLs of downloaded_videos.txt as downloaded videos. Each file is imported only once, so it's safe to call on
+        every start.
+
+        Parameters:
+        - txt_path: Path to the txt file, one URL on each line.
+        - accent_type: Accent type of the videos, if it's known.
+
+        Returns:
+        - Number of imported URLs, 0 if the file doesn't exist or was already imported.
+        """
+
+        path = os.path.abspath(txt_path)
+        if not os.path.exists(path):
+            return 0
+
+        with open(path, 'r') as f:
+            urls = [line.strip() for line in f if line.strip()]
+
+        now = time.time()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            if self.connection.execute("SELECT 1 FROM imports WHERE path = ?", (path,)).fetchone() is not None:
+                self.connection.execute("ROLLBACK")
+                return 0
+
+            # The txt file only knows the URLs, the rows that are already in the store know more and are kept as they are.
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO videos (url, accent_type, status, updated_at) VALUES (?, ?, 'downloaded', ?)",
+                [(url, accent_type, now) for url in urls]
+            )
+            self.connection.execute("INSERT INTO imports (path, count, imported_at) VALUES (?, ?, ?)", (path, len(urls), now))
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+        logger.info("Imported %d video URLs from %s.", len(urls), txt_path)
+        return len(urls)
+
+    def record_download(self, url, accent_type=None, title=None, file_path=None, duration=None, origin=None):
+        """
+        Records a completed download.
+
+        Parameters:
+        - url: The URL of the YouTube video.
+        - accent_type: Accent type of the video.
+        - title: Title of the video.
+        - file_path: Path of the downloaded audio file.
+        - duration: Duration of the audio in seconds.
+        - origin: URL of the channel or playlist the video was found on, None for search results.
+        """
+
+        source = source_name(file_path) if file_path is not None else None
+        self.connection.execute(
+            """
+            INSERT INTO videos (url, accent_type, title, source, origin, file_path, duration, status, error, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 'downloaded', NULL, ?)
+            ON CONFLICT (url) DO UPDATE SET
+                accent_type = COALESCE(excluded.accent_type, accent_type),
+                title = COALESCE(excluded.title, title),
+                source = COALESCE(excluded.source, source),
+                origin = COALESCE(excluded.origin, origin),
+                file_path = COALESCE(excluded.file_path, file_path),
+                duration = COALESCE(excluded.duration, duration),
+                status = 'downloaded', error = NULL, updated_at = excluded.updated_at
+            """,
+            (url, accent_type, title, source, origin, file_path, duration, time.time())
+        )
+
+    def record_failure(self, url, error, accent_type=None):
+        """
+        Records a failed download. A video that is already downloaded stays downloaded.
+
+        Parameters:
+        - url: The URL of the YouTube video.
+        - error: The failure reason.
+        - accent_type: Accent type of the video.
+        """
+
+        self.connection.execute(
+            """
+            INSERT INTO videos (url, accent_type, status, error, updated_at) VALUES (?, ?, 'failed', ?, ?)
+            ON CONFLICT (url) DO UPDATE SET
+                accent_type = COALESCE(excluded.accent_type, accent_type),
+                error = excluded.error, updated_at = excluded.updated_at
+            WHERE status != 'downloaded'
+            """,
+            (url, accent_type, str(error), time.time())
+        )
+
+    def downloaded_urls(self):
+        """
+        Returns:
+        - A set of the URLs of the downloaded videos.
+        """
+
+        return {url for url, in self.connection.execute("SELECT url FROM videos WHERE status = 'downloaded'")}
+
+    def is_downloaded(self, url):
+        """
+        Checks if a video is already downloaded.
+
+        Parameters:
+        - url: The URL of the YouTube video.
+
+        Returns:
+        - True or False.
+        """
+
+        row = self.connection.execute("SELECT 1 FROM videos WHERE url = ? AND status = 'downloaded'", (url,)).fetchone()
+        return row is not None
+
+    def origins(self, accent_type=None):
+        """
+        Returns the origins of the downloaded videos that have one.
+
+        Parameters:
+        - accent_type: Only the videos of this accent type, all of them by default.
+
+        Returns:
+        - A dictionary of (accent type, source name) -> origin URL. The accent type is '' when it's not known.
+        """
+
+        query = """
+            SELECT COALESCE(accent_type, ''), source, origin FROM videos
+            WHERE status = 'downloaded' AND source IS NOT NULL AND origin IS NOT NULL
+        """
+        params = []
+        if accent_type is not None:
+            query += " AND accent_type = ?"
+            params.append(accent_type)
+        return {(accent, source): origin for accent, source, origin in self.connection.execute(query, params)}
+
+    def set_stage(self, stage, file_path, status, error=None, accent_type=None):
+        """
+        Records the status of a stage for a source file.
+
+        Parameters:
+        - stage: Name of the stage, one of STAGES.
+        - file_path: Path to the input file of the stage, or to any file named after the same source.
+        - status: 'done' or 'failed'.
+        - error: The failure reason, if it failed.
+        - accent_type: Accent type of the file, part of the key: the same source name in another accent type is another video.
+        """
+
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage: {stage}, must be one of {STAGES}")
+
+        self.connection.execute(
+            """
+            INSERT INTO stages (source, stage, accent_type, status, error, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (accent_type, source, stage) DO UPDATE SET
+                status = excluded.status, error = excluded.error, updated_at = excluded.updated_at
+            """,
+            (source_name(file_path), stage, accent_type or '', status, None if error is None else str(error), time.time())
+        )
+
+    def stage_status(self, stage, file_path, accent_type=None):
+        """
+        Returns the status of a stage for a source file.
+
+        Parameters:
+        - stage: Name of the stage.
+        - file_path: Path to the input file of the stage, or to any file named after the same source.
+        - accent_type: Accent type of the file, as given to set_stage.
+
+        Returns:
+        - 'done', 'failed' or None if the stage didn't run for the file.
+        """
+
+        row = self.connection.execute("SELECT status FROM stages WHERE accent_type = ? AND source = ? AND stage = ?",
+                                      (accent_type or '', source_name(file_path), stage)).fetchone()
+        return row[0] if row is not None else None
+
+    def pending(self, stage, accent_type=None):
+        """
+        Lists the downloaded videos that the stage didn't finish for yet (never ran or failed).
+
+        Parameters:
+        - stage: Name of the stage.
+        - accent_type: Only the videos of this accent type, all of them by default.
+
+        Returns:
+        - A list of (url, file_path) tuples, sorted by file_path.
+        """
+
+        query = """
+            SELECT videos.url, videos.file_path FROM videos
+            LEFT JOIN stages ON stages.accent_type = COALESCE(videos.accent_type, '') AND stages.source = videos.source
+                AND stages.stage = ?
+            WHERE videos.status = 'downloaded' AND videos.file_path IS NOT NULL AND (stages.status IS NULL OR stages.status != 'done')
+        """
+        params = [stage]
+        if accent_type is not None:
+            query += " AND videos.accent_type = ?"
+            params.append(accent_type)
+        return self.connection.execute(query + " ORDER BY videos.file_path", params).fetchall()
+
+    def failures(self, stage=None):
+        """
+        Lists the failures of the downloads, or of a stage.
+
+        Parameters:
+        - stage: Name of the stage, the download failures if it's None.
+
+        Returns:
+        - A list of (url, error) tuples for the downloads, (accent type/source name, error) tuples for a stage.
+        """
+
+        if stage is None:
+            return self.connection.execute("SELECT url, error FROM videos WHERE status = 'failed' ORDER BY url").fetchall()
+        return self.connection.execute(
+            """
+            SELECT CASE accent_type WHEN '' THEN source ELSE accent_type || '/' || source END, error FROM stages
+            WHERE stage = ? AND status = 'failed' ORDER BY accent_type, source
+            """,
+            (stage,)
+        ).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_state(db_path):
+    """
+    Opens the state store, or returns None if db_path is None so the callers can keep a single code path.
+
+    Parameters:
+    - db_path: Path to the database file, or None.
+
+    Returns:
+    - A StateStore or None.
+    """
+
+    return StateStore(db_path) if db_path is not None else None
@@ -0,0 +1,24 @@
+import importlib.util
+import sys
+import os
+
+# The modules are scripts in the repository root, not a package.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'tests', 'fixtures')
+sys.path.insert(0, ROOT)
+
+def load_script(file_name):
+    """
+    Imports a script of the repository root whose name isn't a valid module name, like split-audio.py.
+
+    Parameters:
+    - file_name: File name of the script.
+
+    Returns:
+    - The module.
+    """
+
+    spec = importlib.util.spec_from_file_location(os.path.splitext(file_name)[0].replace('-', '_'), os.path.join(ROOT, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
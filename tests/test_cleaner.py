@@ -0,0 +1,55 @@
+from pydub import AudioSegment, silence
+from benchmark import synthetic_speech
+import numpy as np
+import cleaner
+import pytest
+
+# The array silence detection must find exactly the intervals pydub finds with seek_step=1, the file based cleaning and the in-memory
+# cleaning remove the same parts of a file.
+
+SAMPLE_RATE = 16000
+
+def to_pcm(samples):
+    # The buffer as the 16-bit PCM pydub reads from the wav files.
+    return np.clip(np.round(samples * 32768), -32768, 32767).astype(np.int16)
+
+def to_segment(pcm):
+    channels = 1 if pcm.ndim == 1 else pcm.shape[1]
+    return AudioSegment(pcm.tobytes(), frame_rate=SAMPLE_RATE, sample_width=2, channels=channels)
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('silence_thresh, min_silence_len', [(-55, 1000), (-40, 300), (-30, 200)])
+def test_detect_silence_matches_pydub(seed, silence_thresh, min_silence_len):
+    pcm = to_pcm(synthetic_speech(20, SAMPLE_RATE, seed=seed))
+
+    expected = silence.detect_silence(to_segment(pcm), min_silence_len, silence_thresh, 1)
+    detected = cleaner.detect_silence_array(pcm.astype(np.float32) / 32768, SAMPLE_RATE, silence_thresh, min_silence_len)
+
+    assert detected.tolist() == expected
+
+def test_detect_nonsilent_matches_pydub():
+    pcm = to_pcm(synthetic_speech(20, SAMPLE_RATE, seed=3))
+
+    expected = silence.detect_nonsilent(to_segment(pcm), 1000, -40, 1)
+    detected = cleaner.detect_nonsilent_array(pcm.astype(np.float32) / 32768, SAMPLE_RATE, -40, 1000)
+
+    assert detected.tolist() == expected
+
+def test_detect_silence_matches_pydub_on_stereo_with_a_partial_last_millisecond():
+    left = synthetic_speech(12, SAMPLE_RATE, seed=4)
+    right = synthetic_speech(12, SAMPLE_RATE, seed=5)
+    # 7 frames after the last whole millisecond, pydub zero-pads the last slice.
+    pcm = to_pcm(np.stack([left, right], axis=1)[:12 * SAMPLE_RATE - 9])
+
+    expected = silence.detect_silence(to_segment(pcm), 500, -45, 1)
+    detected = cleaner.detect_silence_array(pcm.astype(np.float32) / 32768, SAMPLE_RATE, -45, 500)
+
+    assert detected.tolist() == expected
+
+def test_detect_silence_of_a_buffer_shorter_than_min_silence_len():
+    pcm = np.zeros(SAMPLE_RATE // 2, dtype=np.int16)
+
+    expected = silence.detect_silence(to_segment(pcm), 1000, -55, 1)
+    detected = cleaner.detect_silence_array(pcm.astype(np.float32), SAMPLE_RATE, -55, 1000)
+
+    assert detected.tolist() == expected == []
@@ -0,0 +1,74 @@
+from conftest import FIXTURES
+import crawler
+import pytest
+import re
+import os
+
+# The result extraction of the Selenium discovery on a saved search results page (60 results, some without a view count). The page
+# is parsed the same way with lxml and with BeautifulSoup, and cutting it into scrolls doesn't change what is extracted.
+
+RESULTS_PAGE = os.path.join(FIXTURES, 'search_results.html')
+
+def read_page():
+    with open(RESULTS_PAGE, 'r', encoding='utf-8') as f:
+        return f.read()
+
+@pytest.fixture(params=['lxml', 'html.parser'])
+def parser(request, monkeypatch):
+    if request.param == 'html.parser':
+        monkeypatch.setattr(crawler, 'lxml', None)
+    elif crawler.lxml is None:
+        pytest.skip("lxml isn't installed")
+    return request.param
+
+def test_extract_entries_reads_saved_page(parser):
+    entries = crawler.extract_entries(read_page(), 'video-title')
+
+    assert len(entries) == 60
+    assert entries[0] == ('/watch?v=fx000000000&pp=ygUM', 'Scottish conversation #0 – Glasgow & Edinburgh', '1.0K views')
+    assert entries[1] == ('/watch?v=fx000000001&pp=ygUM', "Listening practice 1: Can't stop talkin'", '137 views')
+    # No view count span under #meta.
+    assert [index for index, entry in enumerate(entries) if entry[2] is None] == [7, 18, 29, 40, 51]
+    # The thumbnail links have another id and aren't results.
+    assert len({href for href, _, _ in entries}) == 60
+
+def test_extract_entries_of_an_empty_page(parser):
+    assert crawler.extract_entries('', 'video-title') == []
+    assert crawler.extract_entries('<html><body></body></html>', 'video-title') == []
+
+@pytest.mark.parametrize('scrolls', [2, 7, 60])
+def test_incremental_extraction_matches_full_page(parser, scrolls):
+    html = read_page()
+    full = crawler.extract_entries(html, 'video-title')
+
+    # Cut at the result elements like benchmark_extraction, each part holds only the results that came in with its scroll.
+    starts = [m.start() for m in re.finditer('<ytd-video-renderer[\\s>]', html)]
+    cuts = sorted({starts[len(starts) * i // scrolls] for i in range(1, scrolls)} | {len(html)})
+    incremental = []
+    previous = 0
+    for cut in cuts:
+        incremental.extend(crawler.extract_entries(html[previous:cut], 'video-title'))
+        previous = cut
+
+    assert incremental == full
+
+def test_benchmark_extraction_on_a_large_page(tmp_path):
+    # Thousands of results, the size where re-parsing the whole page after every scroll dominates the discovery loop.
+    html = read_page()
+    items = re.findall(r'<ytd-video-renderer.*?</ytd-video-renderer>', html, re.DOTALL)
+    body = ''.join(item.replace('fx000', f'fx{copy:03d}') for copy in range(34) for item in items)
+    page = html[:html.index(items[0])] + body + html[html.index(items[-1]) + len(items[-1]):]
+    page_file = tmp_path / 'large.html'
+    page_file.write_text(page, encoding='utf-8')
+
+    result = crawler.benchmark_extraction(str(page_file), scrolls=5, repeat=1)
+
+    assert result['results'] == 34 * 60
+    assert result['incremental_seconds'] < result['full_parse_seconds']
+
+def test_benchmark_extraction_needs_result_elements(tmp_path):
+    page_file = tmp_path / 'empty.html'
+    page_file.write_text('<html><body></body></html>', encoding='utf-8')
+
+    with pytest.raises(ValueError):
+        crawler.benchmark_extraction(str(page_file))
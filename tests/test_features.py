@@ -0,0 +1,64 @@
+from feature_store import FeatureStore, FeatureStoreWriter, FRAMES_INDEX
+from features import feature_frames, frame_windows, mfcc_batch, window_frames
+from benchmark import synthetic_speech
+import numpy as np
+import pytest
+
+# The windows cut from the frame sequence of a whole file must be the MFCC of the segments cut at the same samples, except the
+# frames at the edges of a window, which see the neighbouring audio instead of the zero padding of the segment.
+
+SAMPLE_RATE = 16000
+HOP_LENGTH = 512
+# n_fft // (2 * hop_length) frames at each edge of a window.
+EDGE = 2
+
+def segments_of(samples, window_seconds, hop):
+    # The segments that start at the same samples as the windows, window_seconds long.
+    window_samples = int(window_seconds * SAMPLE_RATE)
+    starts = range(0, len(samples) - window_samples + 1, hop * HOP_LENGTH)
+    return np.stack([samples[start:start + window_samples] for start in starts])
+
+@pytest.mark.parametrize('block_frames', [4096, 50])
+def test_frame_windows_match_segment_mfcc(block_frames):
+    samples = synthetic_speech(30, SAMPLE_RATE, seed=0)
+    length, hop = window_frames(5.0, 1.024)
+    assert (length, hop) == (157, 32)
+
+    windows = frame_windows(feature_frames(samples, SAMPLE_RATE, block_frames=block_frames), length, hop)
+    segments = segments_of(samples, 5.0, hop)
+    expected = mfcc_batch(segments, SAMPLE_RATE, top_db=None)
+
+    assert windows.shape == expected.shape
+    np.testing.assert_allclose(windows[:, :, EDGE:-EDGE], expected[:, :, EDGE:-EDGE], rtol=1e-4, atol=1e-3)
+
+def test_frame_windows_are_views():
+    frames = np.arange(20 * 400, dtype=np.float32).reshape(20, 400)
+
+    windows = frame_windows(frames, 157, 32)
+
+    assert windows.shape == (8, 20, 157)
+    assert np.shares_memory(windows, frames)
+    assert np.array_equal(windows[3], frames[:, 96:253])
+    assert frame_windows(frames[:, :100], 157, 32).shape == (0, 20, 157)
+
+def test_window_frames_rejects_hops_off_the_frame_grid():
+    # 1 s is 31.25 frames of 32 ms.
+    with pytest.raises(ValueError):
+        window_frames(5.0, 1.0)
+    with pytest.raises(ValueError):
+        window_frames(5.0, 0.01)
+
+def test_store_windows_match_frame_windows(tmp_path):
+    samples = synthetic_speech(12, SAMPLE_RATE, seed=1)
+    frames = feature_frames(samples, SAMPLE_RATE)
+    with FeatureStoreWriter(str(tmp_path)) as writer:
+        writer.add('Scottish', 'Dr. Smith talk', FRAMES_INDEX, frames)
+        writer.add('Scottish', 'Dr. Smith talk', 0, frames[:, :157])
+
+    store = FeatureStore(str(tmp_path))
+
+    assert np.array_equal(store.windows('Scottish', 'Dr. Smith talk'), frame_windows(frames, 157, 32))
+    assert store.frame_sources() == [('Scottish', 'Dr. Smith talk')]
+    # The frame sequence isn't a segment.
+    assert store.keys() == [('Scottish', 'Dr. Smith talk', 0)]
+    assert [key for key, _ in store] == [('Scottish', 'Dr. Smith talk', 0)]
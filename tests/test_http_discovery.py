@@ -0,0 +1,119 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from conftest import FIXTURES
+import http_discovery
+import threading
+import pytest
+import json
+import os
+
+# The browserless discovery against recorded listing pages, served by a local stand-in for YouTube: the listing pages on GET and the
+# continuation responses on POST to the API endpoint, picked by the continuation token.
+
+PAGES = {'/results': 'search_page.html', '/playlist': 'playlist_page.html'}
+CONTINUATIONS = {
+    'SEARCH-TOKEN-1': 'search_continuation.json',
+    'PLAYLIST-TOKEN-1': 'playlist_continuation_1.json',
+    'PLAYLIST-TOKEN-2': 'playlist_continuation_2.json',
+}
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+@pytest.fixture
+def youtube(monkeypatch):
+    # Every request the server got, as (method, path, query, json body).
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body, content_type):
+            body = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            requests.append(('GET', parts.path, parse_qs(parts.query), None))
+            if parts.path not in PAGES:
+                self.send_error(404)
+                return
+            self._send(read_fixture(PAGES[parts.path]), 'text/html; charset=utf-8')
+
+        def do_POST(self):
+            parts = urlsplit(self.path)
+            payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            requests.append(('POST', parts.path, parse_qs(parts.query), payload))
+            if payload.get('continuation') not in CONTINUATIONS:
+                self.send_error(400)
+                return
+            self._send(read_fixture(CONTINUATIONS[payload['continuation']]), 'application/json')
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(http_discovery, 'base_url', url)
+    try:
+        yield url, requests
+    finally:
+        http_discovery.close_sessions()
+        server.shutdown()
+        server.server_close()
+
+def test_parse_listing_reads_videos_and_continuation():
+    data = http_discovery.extract_initial_data(read_fixture('search_page.html'))
+    entries, continuation = http_discovery.parse_listing(data)
+
+    assert continuation == 'SEARCH-TOKEN-1'
+    assert [entry['href'] for entry in entries] == [f"/watch?v=scot0000{i}" for i in range(1, 6)]
+    assert entries[0] == {'href': '/watch?v=scot00001', 'title': 'Scottish conversation listening practice', 'view_count_text': '15K views'}
+    # No view count on the page, like a live stream.
+    assert entries[4]['view_count_text'] is None
+
+def test_parse_listing_of_the_last_continuation_has_no_token():
+    entries, continuation = http_discovery.parse_listing(json.loads(read_fixture('playlist_continuation_2.json')))
+
+    assert continuation is None
+    assert entries == [{'href': '/watch?v=play00004', 'title': 'Episode 4', 'view_count_text': '2M views'}]
+
+def test_playlist_view_counts_come_from_the_video_info():
+    entries, continuation = http_discovery.parse_listing(http_discovery.extract_initial_data(read_fixture('playlist_page.html')))
+
+    assert continuation == 'PLAYLIST-TOKEN-1'
+    assert [entry['view_count_text'] for entry in entries] == ['1234 views', '56K views']
+
+def test_search_filters_and_continues(youtube):
+    url, requests = youtube
+
+    links = http_discovery.get_video_links('Scottish conversation listening', 'Scottish', max_results=2)
+    # The first page has enough accepted videos, no continuation is loaded.
+    assert links == {'https://www.youtube.com/watch?v=scot00001', 'https://www.youtube.com/watch?v=scot00004'}
+    assert [(method, path) for method, path, _, _ in requests] == [('GET', '/results')]
+    assert requests[0][2] == {'search_query': ['Scottish conversation listening']}
+
+    # A bigger max_results continues the same session from its token, the video seen on the first page isn't counted twice.
+    links = http_discovery.get_video_links('Scottish conversation listening', 'Scottish', max_results=10)
+    assert links == {f"https://www.youtube.com/watch?v={video_id}" for video_id in ('scot00001', 'scot00004', 'scot00006', 'scot00007')}
+    method, path, query, payload = requests[1]
+    assert (method, path, query) == ('POST', '/youtubei/v1/search', {'key': ['fixture-key']})
+    assert payload['continuation'] == 'SEARCH-TOKEN-1'
+    assert payload['context']['client']['clientVersion'] == '2.20240101.00.00'
+    assert len(requests) == 2
+
+def test_playlist_pages_through_every_continuation(youtube):
+    url, requests = youtube
+
+    links = http_discovery.get_videos_from_playlist(f"{url}/playlist?list=PLfixture", max_results=10)
+
+    assert links == {f"https://www.youtube.com/watch?v=play0000{i}" for i in range(1, 5)}
+    assert [(method, path) for method, path, _, _ in requests] == [('GET', '/playlist'), ('POST', '/youtubei/v1/browse'),
+                                                                    ('POST', '/youtubei/v1/browse')]
+    assert [payload['continuation'] for _, _, _, payload in requests[1:]] == ['PLAYLIST-TOKEN-1', 'PLAYLIST-TOKEN-2']
+    assert http_discovery.get_session(('playlist', f"{url}/playlist?list=PLfixture"), None).exhausted
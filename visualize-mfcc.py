@@ -2,24 +2,78 @@ import numpy as np
 import matplotlib.pyplot as plt
 import librosa.display
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib import colormaps
+from matplotlib.image import imsave
+from feature_store import FeatureStore, INDEX_FILE
+from dataset_stats import list_segments
+from metrics import get_logger, log_event
+import metrics
+import logging
+import argparse
+import os
+
+# Besides the interactive plot of one segment, a headless batch mode to review the whole dataset for label noise:
+#
+# - Contact sheets: the segments of every accent type as small thumbnails in a grid, one png page of per_page segments, with a csv
+#   file that maps every cell of the grid to its segment. The thumbnails are colored straight from the arrays (no plot for every
+#   segment), and the pages are rendered in parallel by a pool of worker processes.
+# - Mean heatmaps: the mean MFCC of every accent type, frame by frame. The pages add their segments to running sums while they're
+#   rendered, so the features are read only once and never all in memory.
+#
+# Nothing is shown, the batch mode draws on Agg figures, so it works without a display.
+#
+# python visualize-mfcc.py --gallery features --output mfcc_gallery --workers 4
+
+logger = get_logger('visualize_mfcc')
+
+SAMPLE_RATE = 16000
+HOP_LENGTH = 512
 
 def visualize_mfcc(mfcc_file_path):
     """
     Visualizes MFCC feature converted from csv file using pyplot.
-    
+
     Parameters:
     - mfcc_file_path: Path to the csv file that contains MFCC features.
     """
-    
+
     # Load the MFCC features from the csv file
     mfcc_df = pd.read_csv(mfcc_file_path)
 
     # Convert dataframe to numpy array
     mfcc = mfcc_df.to_numpy()
-    
-    # Plot the MFCC features ( time axis should be 5 seconds but instead it's less than that ? )
+    plot_mfcc(mfcc)
+
+def visualize_stored_mfcc(store_dir, accent_type, source_file, segment_index):
+    """
+    Visualizes MFCC feature of a segment in the feature store using pyplot.
+
+    Parameters:
+    - store_dir: Path to the feature store (feature_store.py).
+    - accent_type: Accent type of the segment.
+    - source_file: Name of the source audio file of the segment.
+    - segment_index: Index of the segment in the source file.
+    """
+
+    plot_mfcc(FeatureStore(store_dir).get(accent_type, source_file, segment_index))
+
+def plot_mfcc(mfcc, sample_rate=SAMPLE_RATE, hop_length=HOP_LENGTH):
+    """
+    Plots the MFCC features using pyplot.
+
+    Parameters:
+    - mfcc: MFCC features (2D array).
+    - sample_rate: Sampling rate the features were extracted at.
+    - hop_length: Number of samples between frames.
+    """
+
+    # specshow needs the sampling rate and the hop length of the features for the time axis, without them it assumes 22050 Hz and
+    # a 5 second segment looks shorter.
     plt.figure(figsize=(10, 6))
-    librosa.display.specshow(mfcc, x_axis='time')
+    librosa.display.specshow(mfcc, sr=sample_rate, hop_length=hop_length, x_axis='time')
     plt.colorbar(format='%+2.0f dB')
     plt.title('MFCC')
     plt.xlabel('Time (s)')
@@ -27,14 +81,165 @@ def visualize_mfcc(mfcc_file_path):
     plt.tight_layout()
     plt.show()
 
-    # plt.figure(figsize=(10, 4))
-    # librosa.display.specshow(mfcc, x_axis='time')
-    # plt.colorbar(label='Amplitude (dB)')
-    # plt.title('MFCC')
-    # plt.xlabel('Time')
-    # plt.ylabel('MFCC')
-    # plt.tight_layout()
-    # plt.show()
-
-mfcc_file = "test_cleaned_audio_features/Scottish/A BIG Discovery in Scotland's Sma Glen_segment_0.csv"
-visualize_mfcc(mfcc_file)
\ No newline at end of file
+def _read_segment(store, item):
+    if store is not None:
+        return store.get(*item)
+    # np.loadtxt is much faster than pandas on these small files, the first line is the header of the DataFrame.
+    return np.loadtxt(item, delimiter=',', skiprows=1, dtype=np.float32, ndmin=2)
+
+def _thumbnail_grid(segments, columns, frames, row_scale, gap=2):
+    # All the thumbnails of a page share a color scale, so a silent or very loud segment stands out from the others.
+    values = np.concatenate([segment[1:].ravel() for segment in segments])
+    low, high = np.percentile(values, [1, 99]) if len(values) else (0.0, 1.0)
+    scale = 1.0 / (high - low) if high > low else 1.0
+    colormap = colormaps['magma']
+
+    rows = (len(segments) + columns - 1) // columns
+    height = segments[0].shape[0] * row_scale
+    grid = np.full((rows * (height + gap) + gap, columns * (frames + gap) + gap, 4), 255, dtype=np.uint8)
+    for position, segment in enumerate(segments):
+        # The first coefficient is the loudness, much larger than the others, it would take the whole color range. It is left dark.
+        image = np.clip((segment[:, :frames] - low) * scale, 0.0, 1.0)
+        image[0] = 0.0
+        # Coefficient 0 at the bottom, like specshow.
+        image = np.repeat(image[::-1], row_scale, axis=0)
+        top = gap + (position // columns) * (height + gap)
+        left = gap + (position % columns) * (frames + gap)
+        grid[top:top + height, left:left + image.shape[1]] = colormap(image, bytes=True)
+    return grid
+
+def _page_task(task):
+    input_dir, accent_type, page, items, output_dir, columns, frames, row_scale = task
+    store = FeatureStore(input_dir) if os.path.exists(os.path.join(input_dir, INDEX_FILE)) else None
+
+    segments = []
+    total = None
+    counts = np.zeros(frames, dtype=np.int64)
+    for item in items:
+        with metrics.timer('visualize.read'):
+            segment = np.asarray(_read_segment(store, item), dtype=np.float32)
+        segments.append(segment)
+        # Running sums of the mean heatmap, frame by frame, the shorter segments count only for their own frames.
+        length = min(segment.shape[1], frames)
+        if total is None:
+            total = np.zeros((segment.shape[0], frames), dtype=np.float64)
+        total[:, :length] += segment[:, :length]
+        counts[:length] += 1
+        metrics.count('segments', stage='visualize')
+
+    with metrics.timer('visualize.render'):
+        page_file = os.path.join(output_dir, f"{accent_type}_page_{page}.png")
+        imsave(page_file, _thumbnail_grid(segments, columns, frames, row_scale))
+
+        # Which segment is in which cell of the sheet.
+        names = [(item[1], item[2]) if store is not None else (os.path.splitext(os.path.basename(item))[0], '') for item in items]
+        pd.DataFrame({'row': [position // columns for position in range(len(items))],
+                      'column': [position % columns for position in range(len(items))],
+                      'segment': [name for name, _ in names],
+                      'segment_index': [index for _, index in names]}).to_csv(page_file[:-4] + '.csv', index=False)
+
+    return accent_type, total, counts, metrics.collect()
+
+def plot_mean_mfcc(means, output_file, sample_rate=SAMPLE_RATE, hop_length=HOP_LENGTH):
+    """
+    Saves the mean MFCC heatmaps of the accent types into one png file, one plot for each accent type.
+
+    Parameters:
+    - means: Dict of accent type -> mean MFCC (2D array, n_mfcc x frames).
+    - output_file: Path to the png file.
+    - sample_rate: Sampling rate the features were extracted at.
+    - hop_length: Number of samples between frames.
+    """
+
+    # An Agg figure, not pyplot, so nothing needs a display.
+    figure = Figure(figsize=(10, 2.5 * len(means)))
+    FigureCanvasAgg(figure)
+    # The same color scale for every accent type, without the loudness coefficient.
+    values = np.concatenate([mean[1:].ravel() for mean in means.values()])
+    vmin, vmax = np.nanmin(values), np.nanmax(values)
+
+    for position, accent_type in enumerate(sorted(means)):
+        axes = figure.add_subplot(len(means), 1, position + 1)
+        image = librosa.display.specshow(means[accent_type], sr=sample_rate, hop_length=hop_length, x_axis='time', ax=axes,
+                                         vmin=vmin, vmax=vmax, cmap='magma')
+        axes.set_title(f"{accent_type} mean MFCC")
+        axes.set_ylabel('MFCC')
+        figure.colorbar(image, ax=axes)
+    figure.tight_layout()
+    figure.savefig(output_file, dpi=100)
+
+def render_gallery(input_dir, output_dir, workers=None, per_page=400, columns=20, frames=157, row_scale=3, max_per_class=None,
+                   sample_rate=SAMPLE_RATE, hop_length=HOP_LENGTH):
+    """
+    Renders the contact sheets of every accent type and their mean MFCC heatmaps, without a display.
+
+    Parameters:
+    - input_dir: Path to the csv output of extract_and_save_mfcc, or to a feature store.
+    - output_dir: Path to the output folder, {accent_type}_page_{page}.png/.csv and mean_mfcc.png.
+    - workers: Number of worker processes, os.cpu_count() by default.
+    - per_page: Number of segments on a contact sheet page.
+    - columns: Number of thumbnails in a row of a page.
+    - frames: Width of a thumbnail in frames, longer segments are cropped. 157 is a 5 second segment.
+    - row_scale: Height of a coefficient in pixels.
+    - max_per_class: Render only the first max_per_class segments of every accent type.
+    - sample_rate: Sampling rate the features were extracted at, for the time axis of the heatmaps.
+    - hop_length: Number of samples between frames, for the time axis of the heatmaps.
+
+    Returns:
+    - A dict of accent type -> mean MFCC (2D array).
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    by_class = {}
+    for accent_type, item in list_segments(input_dir):
+        by_class.setdefault(accent_type, []).append(item)
+
+    tasks = []
+    for accent_type in sorted(by_class):
+        items = by_class[accent_type][:max_per_class]
+        for page, start in enumerate(range(0, len(items), per_page)):
+            tasks.append((input_dir, accent_type, page, items[start:start + per_page], output_dir, columns, frames, row_scale))
+
+    totals = {}
+    counts = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=metrics.init_worker, initargs=(metrics.is_enabled(),)) as executor:
+        for accent_type, total, count, collected in executor.map(_page_task, tasks, chunksize=1):
+            metrics.merge(collected)
+            if accent_type in totals:
+                totals[accent_type] += total
+                counts[accent_type] += count
+            else:
+                totals[accent_type], counts[accent_type] = total, count
+
+    means = {}
+    for accent_type in totals:
+        # Frames no segment reaches are left empty.
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[accent_type] = np.where(counts[accent_type] > 0, totals[accent_type] / counts[accent_type], np.nan)
+    if means:
+        with metrics.timer('visualize.means'):
+            plot_mean_mfcc(means, os.path.join(output_dir, 'mean_mfcc.png'), sample_rate=sample_rate, hop_length=hop_length)
+
+    log_event(logger, logging.INFO, "gallery rendered", output=output_dir, pages=len(tasks), classes=len(means),
+              segments=sum(len(task[3]) for task in tasks))
+    return means
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plots the MFCC features of a segment, or renders the contact sheets of a dataset.")
+    parser.add_argument('mfcc_file', nargs='?',
+                        default="test_cleaned_audio_features/Scottish/A BIG Discovery in Scotland's Sma Glen_segment_0.csv",
+                        help="Csv file of the segment to plot")
+    parser.add_argument('--gallery', help="Feature csv folder or feature store to render the contact sheets of, without a display")
+    parser.add_argument('--output', default='mfcc_gallery', help="Output folder of the contact sheets")
+    parser.add_argument('--workers', type=int, help="Worker processes")
+    parser.add_argument('--per-page', type=int, default=400, help="Number of segments on a page")
+    parser.add_argument('--max-per-class', type=int, help="Max. number of segments of every accent type")
+    args = parser.parse_args()
+
+    if args.gallery:
+        metrics.configure(level='INFO', textfile="pipeline_metrics.prom")
+        render_gallery(args.gallery, args.output, workers=args.workers, per_page=args.per_page, max_per_class=args.max_per_class)
+        metrics.report()
+    else:
+        visualize_mfcc(args.mfcc_file)